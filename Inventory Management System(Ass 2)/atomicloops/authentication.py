@@ -1,12 +1,176 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, router, transaction
+from django.utils import timezone
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from .exceptions import UserDeleted
+from .tokens import add_to_blacklist
+import threading
+import time
+
+USER_CACHE_KEY = 'atomic:user:{user_id}'
+
+DEFAULT_USER_CACHE_CONFIG = {
+    # seconds a user stays in the shared (redis) cache, 0 disables the cache
+    'TIMEOUT': 60,
+    # seconds a user stays in the per-process LRU; invalidations only reach the
+    # other processes through redis, so this bounds how long they may still
+    # accept a user that was deactivated or deleted
+    'LOCAL_TIMEOUT': 5,
+    'LOCAL_SIZE': 1024,
+}
+
+# never written to the shared cache, loaded from the database when accessed
+USER_CACHE_EXCLUDE = ('password',)
+
+
+def get_user_cache_config():
+    config = dict(DEFAULT_USER_CACHE_CONFIG)
+    config.update(getattr(settings, 'ATOMIC_USER_CACHE', {}))
+    return config
+
+
+class UserCache:
+    """
+    Authenticated users by id: a small per-process LRU in front of the shared
+    cache. Entries are plain field values, every request gets its own user
+    instance built from them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.config = None
+
+    def get_config(self):
+        if self.config is None:
+            self.config = get_user_cache_config()
+        return self.config
+
+    @property
+    def enabled(self):
+        return self.get_config()['TIMEOUT'] > 0
+
+    def get(self, user_id):
+        key = USER_CACHE_KEY.format(user_id=user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return self.build(entry[1])
+                del self.entries[key]
+        values = cache.get(key)
+        if values is None:
+            return None
+        self.store_local(key, values)
+        return self.build(values)
+
+    def set(self, user_id, user):
+        key = USER_CACHE_KEY.format(user_id=user_id)
+        values = {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields if field.attname not in USER_CACHE_EXCLUDE
+        }
+        cache.set(key, values, self.get_config()['TIMEOUT'])
+        self.store_local(key, values)
+
+    def store_local(self, key, values):
+        config = self.get_config()
+        with self.lock:
+            self.entries[key] = (time.monotonic() + config['LOCAL_TIMEOUT'], values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > config['LOCAL_SIZE']:
+                self.entries.popitem(last=False)
+
+    def build(self, values):
+        model = get_user_model()
+        return model.from_db(router.db_for_read(model), list(values), list(values.values()))
+
+    def invalidate(self, user_id):
+        key = USER_CACHE_KEY.format(user_id=user_id)
+        with self.lock:
+            self.entries.pop(key, None)
+        cache.delete(key)
+
+
+user_cache = UserCache()
+
+
+def invalidate_cached_user(user_id):
+    # after commit, a request running meanwhile would cache the old row again
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
+
+
+def blacklist_user_tokens(user_id):
+    """
+    Blacklists every unexpired outstanding token of the user with a single
+    INSERT ... SELECT; tokens that are already blacklisted are skipped.
+    Returns the number of tokens blacklisted.
+    """
+    now = timezone.now()
+    blacklisted = connection.ops.quote_name(BlacklistedToken._meta.db_table)
+    outstanding = connection.ops.quote_name(OutstandingToken._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH inserted AS (
+                INSERT INTO {blacklisted} (token_id, blacklisted_at)
+                SELECT id, %s FROM {outstanding} WHERE user_id = %s AND expires_at > %s
+                ON CONFLICT (token_id) DO NOTHING
+                RETURNING token_id
+            )
+            SELECT o.jti, o.expires_at FROM inserted i JOIN {outstanding} o ON o.id = i.token_id
+            """.format(blacklisted=blacklisted, outstanding=outstanding),
+            [now, user_id, now],
+        )
+        tokens = [(jti, expires_at.timestamp()) for jti, expires_at in cursor.fetchall()]
+    add_to_blacklist(tokens)
+    return len(tokens)
+
+
+def revoke_user_tokens(user_id, blacklist=False):
+    """
+    Invalidates every token issued to the user so far by moving the user's
+    tokensValidAfter watermark: one UPDATE whatever the number of tokens.
+    Tokens carry `iat` in whole seconds, so every token issued within the
+    second of the watermark is refused too, including one from a login right
+    after it: that client has to log in once more.
+    `blacklist` also blacklists the outstanding refresh tokens.
+    """
+    now = timezone.now()
+    get_user_model().objects.filter(pk=user_id).update(tokensValidAfter=now, updatedAt=now)
+    invalidate_cached_user(user_id)
+    if blacklist:
+        blacklist_user_tokens(user_id)
+
+
+def is_token_revoked(user, validated_token):
+    valid_after = getattr(user, 'tokensValidAfter', None)
+    issued_at = validated_token.get('iat')
+    return valid_after is not None and issued_at is not None and issued_at <= int(valid_after.timestamp())
 
 
 class AtomicJWTAuthentication(JWTAuthentication):
     def get_user(self, validated_token):
-        try:
-            user = super().get_user(validated_token)
-        except AuthenticationFailed:
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        # CHECK_REVOKE_TOKEN compares the password hash, which is not cached
+        use_cache = user_id is not None and user_cache.enabled and not api_settings.CHECK_REVOKE_TOKEN
+        user = user_cache.get(user_id) if use_cache else None
+        if user is None:
+            try:
+                user = super().get_user(validated_token)
+            except AuthenticationFailed:
+                raise UserDeleted("User no longer exists and has been deleted.")
+            if use_cache:
+                user_cache.set(user_id, user)
+        elif not user.is_active:
             raise UserDeleted("User no longer exists and has been deleted.")
+        if is_token_revoked(user, validated_token):
+            raise InvalidToken("Token has been revoked")
         return user
@@ -0,0 +1,174 @@
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.views import Response
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+import hashlib
+import time
+
+
+MODEL_VERSION_KEY = 'atomic:model-version:{label}'
+RESPONSE_CACHE_KEY = 'atomic:response:{view}:{action}:{digest}'
+CACHE_STATS_KEY = 'atomic:cache-stats:{view}:{event}'
+
+# Models whose post_save/post_delete signals bump their version key
+_versioned_models = set()
+
+
+def model_version_key(model):
+    return MODEL_VERSION_KEY.format(label=model._meta.label_lower)
+
+
+def get_model_versions(models):
+    keys = [model_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seeded with a timestamp so an evicted version never reuses an old number
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    key = model_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def model_changed(sender, **kwargs):
+    bump_model_version(sender)
+
+
+def register_model(model):
+    if model in _versioned_models:
+        return
+    _versioned_models.add(model)
+    uid = 'atomic-cache-' + model._meta.label_lower
+    post_save.connect(model_changed, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(model_changed, sender=model, weak=False, dispatch_uid=uid)
+
+
+def get_cache_stats(view_name):
+    keys = {event: CACHE_STATS_KEY.format(view=view_name, event=event) for event in ('hit', 'miss')}
+    counts = cache.get_many(keys.values())
+    hits = counts.get(keys['hit'], 0)
+    misses = counts.get(keys['miss'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hitRate': round(hits / total, 4) if total else None,
+    }
+
+
+def count_cache_event(view_name, event):
+    key = CACHE_STATS_KEY.format(view=view_name, event=event)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+# Atomic Cache Mixin
+class AtomicCacheMixin:
+    """
+    Read-through cache for list/retrieve responses of an AtomicViewSet.
+
+        class UsersView(AtomicCacheMixin, AtomicViewSet):
+            cache_models = (UsersDevices,)
+
+    Responses are keyed on the path, query params, user level, X-Timezone-Region
+    header and the version of every model the response depends on (the view's
+    model plus cache_models). Versions are bumped by post_save/post_delete and
+    after every successful write through the view, so bulk updates that skip
+    signals invalidate as well. Served responses carry an X-Cache: HIT/MISS
+    header and superusers can read the counters from the cache-stats action.
+
+    A hit is served before get_queryset/get_object run, so entries are per
+    user by default. cache_vary_on_user = False shares them between users of
+    the same level; only do that when neither the queryset nor the object
+    permissions depend on the user beyond their level (e.g. UsersPermission,
+    which lets every authenticated user read any object).
+    """
+    cache_timeout = None
+    cache_models = ()
+    cache_vary_on_user = True
+    cache_actions = ('list', 'retrieve')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in cls.get_cache_models():
+            register_model(model)
+
+    @classmethod
+    def get_cache_models(cls):
+        models = list(cls.cache_models)
+        if getattr(cls, 'queryset', None) is not None:
+            models.insert(0, cls.queryset.model)
+        elif getattr(cls, 'serializer_class', None) is not None:
+            models.insert(0, cls.serializer_class.Meta.model)
+        return list(dict.fromkeys(models))
+
+    @classmethod
+    def get_cache_view_name(cls):
+        return '{}.{}'.format(cls.__module__, cls.__qualname__)
+
+    def get_cache_key(self, request):
+        user = request.user
+        parts = [
+            request.path,
+            sorted((key, request.query_params.getlist(key)) for key in request.query_params),
+            getattr(user, 'level', None),
+            request.META.get('HTTP_X_TIMEZONE_REGION', None),
+            get_model_versions(self.get_cache_models()),
+        ]
+        if self.cache_vary_on_user:
+            parts.append(str(user.pk))
+        digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+        return RESPONSE_CACHE_KEY.format(view=self.get_cache_view_name(), action=self.action, digest=digest)
+
+    def get_cache_timeout(self):
+        return self.cache_timeout if self.cache_timeout is not None else getattr(settings, 'CACHE_TTL', 60 * 5)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        view_name = self.get_cache_view_name()
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            count_cache_event(view_name, 'hit')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        count_cache_event(view_name, 'miss')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.get_cache_timeout())
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if 'list' not in self.cache_actions:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if 'retrieve' not in self.cache_actions:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # Queryset.update/bulk_update/bulk_create do not send signals
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and status.is_success(response.status_code):
+            for model in self.get_cache_models():
+                bump_model_version(model)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request, *args, **kwargs):
+        if not request.user.is_superuser:
+            return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
+        return Response(get_cache_stats(self.get_cache_view_name()), status=status.HTTP_200_OK)
@@ -0,0 +1,453 @@
+from rest_framework.exceptions import ValidationError
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from datetime import timedelta
+import boto3
+import csv
+import io
+import json
+import os
+import zlib
+
+# Defaults for settings.ATOMIC_EXPORT_CHUNK_SIZE / ATOMIC_EXPORT_PART_SIZE
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_PART_SIZE = 8 * 1024 * 1024
+# Default for settings.ATOMIC_EXPORT_ROW_GROUP_SIZE (parquet row groups / arrow record batches)
+EXPORT_ROW_GROUP_SIZE = 100000
+# S3 rejects multipart parts below 5MB, except for the last one
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+EXPORT_FORMATS = ('tsv', 'parquet', 'arrow')
+# Default for settings.ATOMIC_EXPORT_WATERMARK_LAG (seconds)
+EXPORT_WATERMARK_LAG = 60
+
+
+def get_export_columns(model, columns=None):
+    """
+    Validated column list of an export. Columns are concrete field names or
+    attnames (userId or userId_id), all concrete fields by default.
+    """
+    fields = model._meta.concrete_fields
+    if not columns:
+        return [field.attname for field in fields]
+    allowed = {field.name for field in fields} | {field.attname for field in fields}
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValidationError({'columns': ['Unknown columns: {}'.format(', '.join(map(str, unknown)))]})
+    return list(columns)
+
+
+def get_export_filters(model, filters=None):
+    """
+    Validated filters of an export: {field or field__lookup: value} on the
+    model's own concrete fields, related models cannot be traversed.
+    """
+    filters = filters or {}
+    if not isinstance(filters, dict):
+        raise ValidationError({'filters': ['Expected an object of field lookups']})
+    errors = []
+    for key in filters:
+        name, _, lookup = key.partition('__')
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            errors.append('Unknown field: {}'.format(name))
+            continue
+        if not field.concrete or (lookup and lookup not in field.get_lookups()):
+            errors.append('Invalid filter: {}'.format(key))
+    if errors:
+        raise ValidationError({'filters': errors})
+    return filters
+
+
+def get_watermark_field(model):
+    # models opt in to incremental exports with `export_watermark_field`
+    return getattr(model, 'export_watermark_field', None)
+
+
+def set_watermarks(export_record):
+    """
+    Window of an incremental export: from the end of the user's last completed
+    incremental export of the same model, format, columns and filters
+    (everything on the first run) up to now minus ATOMIC_EXPORT_WATERMARK_LAG.
+    """
+    previous = (
+        type(export_record).objects
+        .filter(
+            userId_id=export_record.userId_id,
+            appName=export_record.appName,
+            modelName=export_record.modelName,
+            format=export_record.format,
+            columns=export_record.columns,
+            filters=export_record.filters,
+            incremental=True,
+            status='completed',
+        )
+        .exclude(pk=export_record.pk)
+        .order_by('-watermarkTo')
+        .first()
+    )
+    lag = getattr(settings, 'ATOMIC_EXPORT_WATERMARK_LAG', EXPORT_WATERMARK_LAG)
+    export_record.watermarkFrom = previous.watermarkTo if previous else None
+    export_record.watermarkTo = timezone.now() - timedelta(seconds=lag)
+
+
+class S3MultipartSink:
+    """S3 multipart upload of an export, parts are uploaded straight from memory."""
+
+    def __init__(self, key):
+        self.key = key
+        self.client = boto3.client(
+            "s3", region_name=settings.REGION,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY
+        )
+
+    def start(self):
+        upload = self.client.create_multipart_upload(
+            Bucket=settings.S3_BUCKET, Key=self.key, ACL='public-read', ContentType='application/gzip'
+        )
+        return upload['UploadId']
+
+    def upload_part(self, upload_id, number, data):
+        part = self.client.upload_part(
+            Bucket=settings.S3_BUCKET, Key=self.key, UploadId=upload_id, PartNumber=number, Body=data
+        )
+        return part['ETag']
+
+    def complete(self, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=settings.S3_BUCKET, Key=self.key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+        )
+        return f"{settings.AWS_URL}/{self.key}"
+
+    def abort(self, upload_id):
+        self.client.abort_multipart_upload(Bucket=settings.S3_BUCKET, Key=self.key, UploadId=upload_id)
+
+
+class LocalDirectorySink:
+    """
+    Stand-in for S3 (settings.ATOMIC_EXPORT_LOCAL_DIR): parts are written next
+    to the target file and concatenated into it on completion.
+    """
+
+    def __init__(self, key, directory=None):
+        self.path = os.path.join(directory or settings.ATOMIC_EXPORT_LOCAL_DIR, key)
+
+    def part_path(self, number):
+        return f"{self.path}.part{number:05d}"
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return 'local'
+
+    def upload_part(self, upload_id, number, data):
+        with open(self.part_path(number), 'wb') as f:
+            f.write(data)
+        return str(number)
+
+    def complete(self, upload_id, parts):
+        with open(self.path, 'wb') as output:
+            for part in parts:
+                with open(self.part_path(part['PartNumber']), 'rb') as f:
+                    while True:
+                        block = f.read(1024 * 1024)
+                        if not block:
+                            break
+                        output.write(block)
+        self.abort(upload_id)
+        return f"file://{self.path}"
+
+    def abort(self, upload_id):
+        directory, name = os.path.split(self.path)
+        for filename in os.listdir(directory):
+            if filename.startswith(name + '.part'):
+                os.remove(os.path.join(directory, filename))
+
+
+def get_export_sink(key):
+    if getattr(settings, 'ATOMIC_EXPORT_LOCAL_DIR', None):
+        return LocalDirectorySink(key)
+    return S3MultipartSink(key)
+
+
+class ExportPart:
+    """
+    One multipart part: TSV rows gzip-compressed as an independent gzip member.
+    Members can be concatenated, so the parts form a single .tsv.gz file.
+    """
+
+    def __init__(self, header=None):
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.text = io.StringIO()
+        self.writer = csv.writer(self.text, delimiter='\t', lineterminator='\n')
+        self.chunks = []
+        self.size = 0
+        self.rows = 0
+        if header:
+            self.writer.writerow(header)
+
+    def compress(self):
+        self.chunks.append(self.compressor.compress(self.text.getvalue().encode('utf-8')))
+        self.size += len(self.chunks[-1])
+        self.text.seek(0)
+        self.text.truncate()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
+        self.compress()
+
+    def close(self):
+        self.compress()
+        self.chunks.append(self.compressor.flush())
+        return b''.join(self.chunks)
+
+
+class AtomicExporter:
+    """
+    Streaming TSV export of an ExportData record.
+
+    Rows are read in primary key order from a server-side cursor
+    (values_list().iterator()), encoded and gzip-compressed in memory and
+    uploaded as multipart parts of roughly `part_size` compressed bytes; nothing
+    touches the local disk. After every part the record stores the uploaded
+    parts and the last exported pk, so a failed export resumes with the next
+    part instead of starting over.
+    """
+
+    extension = 'tsv.gz'
+
+    def __init__(self, export_record, sink=None, chunk_size=None, part_size=None):
+        self.export = export_record
+        self.model = apps.get_model(export_record.appName, export_record.modelName)
+        if not export_record.fileKey:
+            export_record.fileKey = f"export-data/{export_record.modelName}-{export_record.id}.{self.extension}"
+        self.sink = sink or get_export_sink(export_record.fileKey)
+        self.chunk_size = chunk_size or getattr(settings, 'ATOMIC_EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)
+        part_size = part_size or getattr(settings, 'ATOMIC_EXPORT_PART_SIZE', EXPORT_PART_SIZE)
+        self.part_size = max(part_size, S3_MIN_PART_SIZE) if isinstance(self.sink, S3MultipartSink) else part_size
+
+    def get_queryset(self):
+        queryset = self.model.objects.filter(**self.export.filters)
+        if self.export.incremental:
+            # a range scan on the watermark column's index instead of the whole table
+            field = get_watermark_field(self.model)
+            if self.export.watermarkFrom is not None:
+                queryset = queryset.filter(**{f'{field}__gt': self.export.watermarkFrom})
+            queryset = queryset.filter(**{f'{field}__lte': self.export.watermarkTo})
+        if self.export.lastKey is not None:
+            queryset = queryset.filter(pk__gt=self.export.lastKey)
+        return queryset.order_by('pk')
+
+    def save(self, *fields):
+        self.export.save(update_fields=list(fields) + ['updatedAt'])
+
+    def upload(self, data, rows, last_key=None):
+        number = len(self.export.parts) + 1
+        etag = self.sink.upload_part(self.export.uploadId, number, data)
+        self.export.parts = self.export.parts + [{'PartNumber': number, 'ETag': etag}]
+        self.export.rows += rows
+        if last_key is not None:
+            self.export.lastKey = last_key
+        self.save('parts', 'rows', 'lastKey')
+
+    def export_rows(self):
+        columns = get_export_columns(self.model, self.export.columns)
+        rows = self.get_queryset().values_list('pk', *columns).iterator(chunk_size=self.chunk_size)
+        # the header goes into the first part only
+        part = ExportPart(header=None if self.export.parts else columns)
+        batch = []
+        last_key = None
+        for row in rows:
+            batch.append(row[1:])
+            if len(batch) < self.chunk_size:
+                continue
+            last_key = row[0]
+            part.write(batch)
+            batch = []
+            if part.size >= self.part_size:
+                self.upload(part.close(), part.rows, last_key)
+                part = ExportPart()
+        if batch:
+            last_key = row[0]
+            part.write(batch)
+        # the last part may be small; an export without rows still uploads its header
+        if part.rows or not self.export.parts:
+            self.upload(part.close(), part.rows, last_key)
+
+    def start(self):
+        if self.export.incremental and self.export.watermarkTo is None:
+            set_watermarks(self.export)
+        if not self.export.uploadId:
+            self.export.uploadId = self.sink.start()
+
+    def run(self):
+        self.export.status = 'running'
+        self.start()
+        self.save('status', 'fileKey', 'uploadId', 'parts', 'rows', 'lastKey', 'watermarkFrom', 'watermarkTo')
+        self.export_rows()
+        self.export.fileUrl = self.sink.complete(self.export.uploadId, self.export.parts)
+        self.export.status = 'completed'
+        self.save('fileUrl', 'status')
+        return self.export
+
+    def abort(self):
+        if self.export.uploadId:
+            self.sink.abort(self.export.uploadId)
+        self.export.status = 'failed'
+        self.save('status')
+
+
+def arrow_type(field):
+    import pyarrow as pa
+
+    if field.is_relation:
+        return arrow_type(field.target_field)
+    internal_type = field.get_internal_type()
+    if internal_type == 'DecimalField':
+        if field.max_digits > 38:
+            return pa.decimal256(field.max_digits, field.decimal_places)
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if internal_type == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC' if settings.USE_TZ else None)
+    return {
+        'AutoField': pa.int32(),
+        'SmallAutoField': pa.int16(),
+        'BigAutoField': pa.int64(),
+        'IntegerField': pa.int32(),
+        'SmallIntegerField': pa.int16(),
+        'BigIntegerField': pa.int64(),
+        'PositiveIntegerField': pa.int64(),
+        'PositiveSmallIntegerField': pa.int32(),
+        'PositiveBigIntegerField': pa.uint64(),
+        'BooleanField': pa.bool_(),
+        'FloatField': pa.float64(),
+        'DateField': pa.date32(),
+        'TimeField': pa.time64('us'),
+        'DurationField': pa.duration('us'),
+        'BinaryField': pa.binary(),
+    }.get(internal_type, pa.string())
+
+
+def arrow_converter(field):
+    # python values that pyarrow cannot take as they come from values_list
+    if field.is_relation:
+        return arrow_converter(field.target_field)
+    internal_type = field.get_internal_type()
+    if internal_type == 'UUIDField':
+        return lambda value: None if value is None else str(value)
+    if internal_type == 'JSONField':
+        return lambda value: None if value is None else json.dumps(value, default=str)
+    return None
+
+
+class PartStream(io.RawIOBase):
+    """
+    Write-only file handed to the pyarrow writers: the bytes are buffered and
+    sent as a multipart part every `part_size` bytes.
+    """
+
+    def __init__(self, exporter):
+        super().__init__()
+        self.exporter = exporter
+        self.buffer = bytearray()
+        self.position = 0
+        # rows written since the last uploaded part
+        self.rows = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.exporter.part_size:
+            self.upload()
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def upload(self):
+        self.exporter.upload(bytes(self.buffer), self.rows)
+        self.buffer.clear()
+        self.rows = 0
+
+
+class AtomicColumnarExporter(AtomicExporter):
+    """
+    Parquet or Arrow IPC export of an ExportData record, typed from the model
+    fields (ints, decimals, timestamps...) and zstd compressed.
+
+    Rows come from the same server-side cursor as the TSV export and are
+    written in row groups (record batches) of `row_group_size` rows; the
+    output is streamed into multipart parts. A columnar file is only valid
+    with its footer, so a failed export restarts from scratch.
+    """
+
+    def __init__(self, export_record, sink=None, chunk_size=None, part_size=None, row_group_size=None):
+        self.extension = export_record.format
+        super().__init__(export_record, sink=sink, chunk_size=chunk_size, part_size=part_size)
+        self.row_group_size = row_group_size or getattr(settings, 'ATOMIC_EXPORT_ROW_GROUP_SIZE', EXPORT_ROW_GROUP_SIZE)
+
+    def start(self):
+        if self.export.parts:
+            self.sink.abort(self.export.uploadId)
+            self.export.uploadId = ''
+            self.export.parts = []
+            self.export.rows = 0
+            self.export.lastKey = None
+        super().start()
+
+    def get_writer(self, stream, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.export.format == 'parquet':
+            # ids, quantities and timestamps are mostly sorted or small steps: delta encoding
+            # beats dictionaries on them by far
+            delta = [
+                field.name for field in schema if pa.types.is_integer(field.type) or pa.types.is_timestamp(field.type)
+            ]
+            return pq.ParquetWriter(
+                pa.PythonFile(stream, mode='w'), schema, compression='zstd',
+                use_dictionary=[field.name for field in schema if field.name not in delta],
+                column_encoding={name: 'DELTA_BINARY_PACKED' for name in delta},
+            )
+        return pa.ipc.new_file(
+            pa.PythonFile(stream, mode='w'), schema, options=pa.ipc.IpcWriteOptions(compression='zstd')
+        )
+
+    def export_rows(self):
+        import pyarrow as pa
+
+        columns = get_export_columns(self.model, self.export.columns)
+        fields = [self.model._meta.get_field(column) for column in columns]
+        schema = pa.schema([pa.field(column, arrow_type(field)) for column, field in zip(columns, fields)])
+        converters = [arrow_converter(field) for field in fields]
+
+        stream = PartStream(self)
+        writer = self.get_writer(stream, schema)
+        rows = self.get_queryset().values_list(*columns).iterator(chunk_size=self.chunk_size)
+        while True:
+            batch = [row for _, row in zip(range(self.row_group_size), rows)]
+            if not batch:
+                break
+            values = []
+            for converter, column in zip(converters, zip(*batch)):
+                values.append(list(map(converter, column)) if converter else column)
+            stream.rows += len(batch)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(value, type=field.type) for value, field in zip(values, schema)], schema=schema
+            ))
+        writer.close()
+        if stream.buffer or not self.export.parts:
+            stream.upload()
+
+
+def get_exporter(export_record, **kwargs):
+    if export_record.format == 'tsv':
+        return AtomicExporter(export_record, **kwargs)
+    return AtomicColumnarExporter(export_record, **kwargs)
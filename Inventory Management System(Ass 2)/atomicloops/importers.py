@@ -0,0 +1,168 @@
+from rest_framework import serializers
+from rest_framework.utils import model_meta
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from utils.iterables import chunked
+import csv
+import io
+import os
+
+# Defaults for settings.ATOMIC_IMPORT_CHUNK_SIZE / ATOMIC_IMPORT_MAX_ERRORS
+IMPORT_CHUNK_SIZE = 2000
+IMPORT_MAX_ERRORS = 1000
+# Default for settings.ATOMIC_IMPORT_ASYNC_SIZE, uploads above it (bytes) are imported by celery
+IMPORT_ASYNC_SIZE = 1024 * 1024
+
+
+def get_delimiter(filename):
+    return ',' if os.path.splitext(filename or '')[1].lower() == '.csv' else '\t'
+
+
+def find_existing_indexes(model, data):
+    """
+    Indexes of the items ({field: value}) that already exist as a row, in one
+    query: rows matching any item are labelled with the first item they match.
+    """
+    if not data:
+        return []
+    conditions = [Q(**item) if item else Q(pk__isnull=False) for item in data]
+    query = Q()
+    for condition in conditions:
+        query |= condition
+    return sorted(set(
+        model.objects.filter(query)
+        .annotate(bulk_item=Case(
+            *[When(condition, then=Value(index)) for index, condition in enumerate(conditions)],
+            output_field=IntegerField(),
+        ))
+        .values_list('bulk_item', flat=True)
+    ))
+
+
+def bulk_create_validated(serializer, batch_size):
+    """
+    Saves a validated ListSerializer with bulk_create. Serializers that customise
+    create or write many-to-many relations are saved row by row.
+    """
+    child = serializer.child
+    model = child.Meta.model
+    many_to_many = [name for name, relation in model_meta.get_field_info(model).relations.items() if relation.to_many]
+    custom_create = type(child).create is not serializers.ModelSerializer.create
+    if custom_create or any(name in attrs for attrs in serializer.validated_data for name in many_to_many):
+        serializer.save()
+        return
+    serializer.instance = model.objects.bulk_create(
+        [model(**attrs) for attrs in serializer.validated_data], batch_size=batch_size
+    )
+
+
+class AtomicImporter:
+    """
+    Streaming TSV/CSV import through a model serializer.
+
+    The file is read incrementally with the csv module; rows are validated and
+    written in chunks of `chunk_size`, each chunk in its own transaction, so
+    memory use does not depend on the file size and a bad row only rejects
+    itself. Rows that already exist (same value for a unique column, or an
+    identical row when the header has no unique column) are rejected as well.
+    `progress` is called with the running summary after every chunk.
+    """
+
+    def __init__(self, serializer_class, context=None, chunk_size=None, delimiter='\t', progress=None):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        self.context = context or {}
+        self.chunk_size = chunk_size or getattr(settings, 'ATOMIC_IMPORT_CHUNK_SIZE', IMPORT_CHUNK_SIZE)
+        self.max_errors = getattr(settings, 'ATOMIC_IMPORT_MAX_ERRORS', IMPORT_MAX_ERRORS)
+        self.delimiter = delimiter
+        self.progress = progress
+        self.summary = {'totalRows': 0, 'importedRows': 0, 'failedRows': 0, 'errors': []}
+
+    def read_rows(self, file):
+        # yields (line number, row); blank lines are skipped
+        text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        reader = csv.DictReader(text, delimiter=self.delimiter)
+        for row in reader:
+            if any(row.values()):
+                yield reader.line_num, {key: value for key, value in row.items() if key is not None}
+
+    def add_error(self, line, error):
+        self.summary['failedRows'] += 1
+        if len(self.summary['errors']) < self.max_errors:
+            self.summary['errors'].append({'line': line, 'error': error})
+
+    def import_file(self, file):
+        for chunk in chunked(self.read_rows(file), self.chunk_size):
+            self.summary['totalRows'] += len(chunk)
+            self.import_chunk(chunk)
+            if self.progress is not None:
+                self.progress(self.summary)
+        return self.summary
+
+    def normalize(self, rows, fields):
+        # {line: {field: python value}} for the given model fields; rows with values
+        # that do not convert are left to the serializer to report
+        normalized = {}
+        for line, row in rows:
+            try:
+                normalized[line] = {name: field.to_python(row[name]) for name, field in fields.items() if name in row}
+            except (DjangoValidationError, TypeError, ValueError):
+                continue
+        return normalized
+
+    def existing_lines(self, rows):
+        columns = rows[0][1].keys()
+        fields = {field.name: field for field in self.model._meta.concrete_fields if field.name in columns}
+        unique_fields = [name for name, field in fields.items() if field.unique and not field.primary_key]
+        normalized = self.normalize(rows, fields)
+        if not unique_fields:
+            lines = list(normalized)
+            return {lines[index] for index in find_existing_indexes(self.model, list(normalized.values()))}
+        existing = set()
+        for name in unique_fields:
+            values = [item[name] for item in normalized.values()]
+            seen = set(self.model.objects.filter(**{name + '__in': values}).values_list(name, flat=True))
+            for line, item in normalized.items():
+                if item[name] in seen:
+                    existing.add(line)
+                seen.add(item[name])
+        return existing
+
+    def validate_rows(self, rows):
+        # returns (valid rows, validated serializer); invalid rows are reported and dropped
+        serializer = self.serializer_class(data=[row for _, row in rows], many=True, context=self.context)
+        if serializer.is_valid():
+            return rows, serializer
+        valid = []
+        for (line, row), errors in zip(rows, serializer.errors):
+            if errors:
+                self.add_error(line, errors)
+            else:
+                valid.append((line, row))
+        if not valid:
+            return valid, None
+        serializer = self.serializer_class(data=[row for _, row in valid], many=True, context=self.context)
+        serializer.is_valid(raise_exception=True)
+        return valid, serializer
+
+    def import_chunk(self, rows):
+        existing = self.existing_lines(rows)
+        for line, _ in rows:
+            if line in existing:
+                self.add_error(line, 'This data already exists')
+        rows = [(line, row) for line, row in rows if line not in existing]
+        if not rows:
+            return
+        rows, serializer = self.validate_rows(rows)
+        if serializer is None:
+            return
+        try:
+            with transaction.atomic():
+                bulk_create_validated(serializer, self.chunk_size)
+        except DatabaseError as e:
+            for line, _ in rows:
+                self.add_error(line, str(e))
+            return
+        self.summary['importedRows'] += len(rows)
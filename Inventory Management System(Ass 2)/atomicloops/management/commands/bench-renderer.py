@@ -0,0 +1,76 @@
+import datetime
+import json
+import statistics
+import sys
+import time
+import uuid
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from atomicloops import renderers
+from atomicloops.renderers import AtomicJsonRenderer, SUCCESS_PREFIX, SUCCESS_SUFFIX
+
+MB = 1024 * 1024
+
+
+def build_rows(count):
+    # list payload shaped like the users / devices / alerts responses, with the
+    # python types views hand over without a serializer (UUID, Decimal, datetimes)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            'id': uuid.uuid4(),
+            'firstName': 'First {}'.format(index),
+            'lastName': 'Lâst {}'.format(index),
+            'email': 'user{}@example.com'.format(index),
+            'level': index % 5,
+            'isVerified': index % 2 == 0,
+            'profilePicture': None,
+            'price': Decimal('{}.{:02d}'.format(index, index % 100)),
+            'createdAt': now - datetime.timedelta(seconds=index, microseconds=index),
+            'expiresOn': (now + datetime.timedelta(days=index % 365)).date(),
+            'stock': {'warehouse_id': index % 7, 'quantity_on_hand': index * 3, 'days_until_stockout': index / 7},
+        }
+        for index in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'compare AtomicJsonRenderer with the DRF JSONRenderer envelope on large list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        rows = build_rows(kwargs['rows'])
+        context = {'response': Response(status=200)}
+        drf = JSONRenderer()
+        atomic = AtomicJsonRenderer()
+        candidates = {
+            # what AtomicJsonRenderer did before: wrap in a dict, render with DRF
+            'drf': lambda: drf.render({'data': rows, 'error': {}, 'isSuccess': True}, 'application/json', context),
+            'atomic-json': lambda: SUCCESS_PREFIX + renderers.json_dumps(rows) + SUCCESS_SUFFIX,
+        }
+        if renderers.orjson is not None:
+            candidates['atomic-orjson'] = lambda: atomic.render(rows, 'application/json', context)
+        else:
+            sys.stdout.write("orjson is not installed, AtomicJsonRenderer uses the json module\n")
+
+        expected = json.loads(candidates['drf']())
+        sys.stdout.write(f"{'renderer':>14} {'mean ms':>10} {'p95 ms':>10} {'MB/s':>10} {'size':>10}\n")
+        for name, render in candidates.items():
+            content = render()
+            if json.loads(content) != expected:
+                raise CommandError(f'{name} does not render the same document as drf')
+            timings = []
+            for _ in range(kwargs['repeat']):
+                start = time.perf_counter()
+                render()
+                timings.append(time.perf_counter() - start)
+            mean = statistics.mean(timings)
+            p95 = sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) > 1 else mean
+            sys.stdout.write(
+                f"{name:>14} {mean * 1000:>10.3f} {p95 * 1000:>10.3f} {len(content) / mean / MB:>10.1f} {len(content):>10}\n"
+            )
@@ -0,0 +1,80 @@
+import json
+import statistics
+import sys
+import time
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from atomicloops.middleware import AtomicSQLInjectionMiddleware
+
+UNITS = {'KB': 1024, 'MB': 1024 * 1024, 'B': 1}
+
+
+def parse_size(value):
+    for unit, factor in UNITS.items():
+        if value.upper().endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    raise CommandError(f'Invalid size {value}, expected e.g. 1KB, 100KB or 10MB')
+
+
+def json_body(size):
+    record = {"name": "Widget", "sku": "SKU-000000", "description": "Plain product description " * 4}
+    count = max(1, size // len(json.dumps(record)))
+    return json.dumps([record] * count).encode('utf-8')
+
+
+def multipart_body(body):
+    return encode_multipart(BOUNDARY, {
+        'name': 'Widget',
+        'file': SimpleUploadedFile('bench.tsv', body, content_type='text/tab-separated-values'),
+    })
+
+
+class Command(BaseCommand):
+    help = (
+        'measure the per request overhead of AtomicSQLInjectionMiddleware for different body sizes, '
+        'under the settings in use (DATA_UPLOAD_MAX_MEMORY_SIZE included)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', default=['1KB', '100KB', '10MB'])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        factory = RequestFactory()
+        middleware = AtomicSQLInjectionMiddleware(lambda request: HttpResponse())
+        builders = {
+            'json': lambda size, body: factory.post('/bench', data=body, content_type='application/json'),
+            'multipart': lambda size, body: factory.generic('POST', '/bench', multipart_body(body), MULTIPART_CONTENT),
+            'put-multi': lambda size, body: factory.generic('PUT', '/bench', multipart_body(body), MULTIPART_CONTENT),
+            'query': lambda size, body: factory.get('/bench', data={'search': 'widget', 'limit': 10}),
+        }
+
+        sys.stdout.write(f"max scan size: {middleware.max_scan_size} bytes\n")
+        sys.stdout.write(f"DATA_UPLOAD_MAX_MEMORY_SIZE: {settings.DATA_UPLOAD_MAX_MEMORY_SIZE} bytes\n")
+        sys.stdout.write(f"{'size':>8} {'body':>10} {'mean ms':>10} {'p95 ms':>10} {'MB/s':>10}\n")
+        for size_name in kwargs['sizes']:
+            size = parse_size(size_name)
+            body = json_body(size)
+            for kind, build in builders.items():
+                timings = []
+                try:
+                    for _ in range(kwargs['repeat']):
+                        request = build(size, body)
+                        start = time.perf_counter()
+                        response = middleware(request)
+                        timings.append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            raise CommandError(f'{kind} request of {size_name} was rejected')
+                except RequestDataTooBig:
+                    # answered with 400 by Django, as without the middleware
+                    sys.stdout.write(f"{size_name:>8} {kind:>10} {'above DATA_UPLOAD_MAX_MEMORY_SIZE':>32}\n")
+                    continue
+                mean = statistics.mean(timings)
+                p95 = sorted(timings)[int(len(timings) * 0.95) - 1] if len(timings) > 1 else mean
+                throughput = len(body) / mean / UNITS['MB'] if kind != 'query' else 0
+                sys.stdout.write(f"{size_name:>8} {kind:>10} {mean * 1000:>10.3f} {p95 * 1000:>10.3f} {throughput:>10.1f}\n")
@@ -0,0 +1,178 @@
+from django.conf import settings
+from collections import Counter
+import atexit
+import json
+import os
+import threading
+import time
+import urllib.request
+
+# Request latency histogram buckets (upper bounds in ms)
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+DEFAULT_METRICS_CONFIG = {
+    # seconds between two flushes of the in-process aggregates
+    'FLUSH_INTERVAL': 60,
+    # JSON lines file the snapshots are appended to (None to disable)
+    'FILE': None,
+    # URL the snapshots are POSTed to as JSON (None to disable)
+    'ENDPOINT': None,
+    'ENDPOINT_TIMEOUT': 5,
+    # a query shape executed at least this many times in one request is reported as N+1
+    'N_PLUS_ONE_THRESHOLD': 3,
+    # N+1 shapes kept per route and flush
+    'TOP_SHAPES': 5,
+}
+
+
+def get_metrics_config():
+    config = dict(DEFAULT_METRICS_CONFIG)
+    config.update(getattr(settings, 'ATOMIC_METRICS', {}))
+    return config
+
+
+class RouteStats:
+    __slots__ = ('requests', 'errors', 'total_ms', 'max_ms', 'queries', 'db_ms', 'duplicate_queries', 'histogram', 'shapes')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.duplicate_queries = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+        self.shapes = Counter()
+
+    def add(self, request_metrics, status_code, threshold):
+        self.requests += 1
+        self.errors += status_code >= 500
+        self.total_ms += request_metrics.total_ms
+        self.max_ms = max(self.max_ms, request_metrics.total_ms)
+        self.queries += request_metrics.queries
+        self.db_ms += request_metrics.db_ms
+        for bucket, bound in enumerate(LATENCY_BUCKETS):
+            if request_metrics.total_ms <= bound:
+                self.histogram[bucket] += 1
+                break
+        for shape, count in request_metrics.shapes.items():
+            if count > 1:
+                self.duplicate_queries += count - 1
+            if count >= threshold:
+                self.shapes[shape] += count
+
+    def as_dict(self, top_shapes):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avgMs': round(self.total_ms / self.requests, 3),
+            'maxMs': round(self.max_ms, 3),
+            'queries': self.queries,
+            'avgQueries': round(self.queries / self.requests, 2),
+            'dbMs': round(self.db_ms, 3),
+            'duplicateQueries': self.duplicate_queries,
+            'latencyHistogram': dict(zip([str(bound) for bound in LATENCY_BUCKETS], self.histogram)),
+            'nPlusOne': [{'sql': shape, 'count': count} for shape, count in self.shapes.most_common(top_shapes)],
+        }
+
+
+class RequestMetrics:
+    """
+    Per request counters, fed by connection.execute_wrapper. Query shapes are the
+    parameterised SQL, so the same statement run in a loop counts as one shape.
+    """
+    __slots__ = ('queries', 'db_ms', 'total_ms', 'shapes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.total_ms = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - start) * 1000
+            self.queries += 1
+            self.shapes[sql] += 1
+
+
+class MetricsRegistry:
+    """
+    In-process aggregate of RouteStats. Requests only update the aggregate under
+    a lock, a daemon thread swaps it out every FLUSH_INTERVAL seconds and writes
+    it to the configured file and/or endpoint off the request path.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.started_at = time.time()
+        self.flusher = None
+        self.pid = None
+        self.config = None
+
+    def record(self, route, method, request_metrics, status_code):
+        self.ensure_flusher()
+        key = '{} {}'.format(method, route)
+        with self.lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+            stats.add(request_metrics, status_code, self.config['N_PLUS_ONE_THRESHOLD'])
+
+    def ensure_flusher(self):
+        # one flusher per process, restarted after a fork (gunicorn --preload)
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.config = get_metrics_config()
+            self.routes = {}
+            self.started_at = time.time()
+            self.flusher = threading.Thread(target=self.run, name='atomic-metrics-flusher', daemon=True)
+            self.flusher.start()
+            self.pid = os.getpid()
+            atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.config['FLUSH_INTERVAL'])
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            routes, self.routes = self.routes, {}
+            started_at, self.started_at = self.started_at, time.time()
+        return {
+            'pid': os.getpid(),
+            'from': started_at,
+            'to': self.started_at,
+            'routes': {key: stats.as_dict(self.config['TOP_SHAPES']) for key, stats in routes.items()},
+        }
+
+    def flush(self):
+        data = self.snapshot()
+        if not data['routes']:
+            return
+        payload = json.dumps(data)
+        try:
+            if self.config['FILE']:
+                with open(self.config['FILE'], 'a') as f:
+                    f.write(payload + '\n')
+            if self.config['ENDPOINT']:
+                request = urllib.request.Request(
+                    self.config['ENDPOINT'], data=payload.encode('utf-8'),
+                    headers={'Content-Type': 'application/json'}, method='POST'
+                )
+                urllib.request.urlopen(request, timeout=self.config['ENDPOINT_TIMEOUT']).close()
+        except OSError:
+            # metrics are best effort, a failed flush drops that interval
+            pass
+
+
+registry = MetricsRegistry()
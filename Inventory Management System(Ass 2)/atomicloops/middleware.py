@@ -1,86 +1,198 @@
 import re
 import json
-from django.db import connection
-from django.http import QueryDict, HttpResponse
-from django.http.multipartparser import MultiPartParser
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, QueryDict
+from django.http.multipartparser import MultiPartParserError
+from django.utils.datastructures import MultiValueDict
+from atomicloops.metrics import RequestMetrics, registry
+
+
+# Statements blocked as soon as they appear anywhere in the scanned text
+SQL_PHRASES = (
+    rb'truncate table', rb'create database', rb'select database', rb'drop database', rb'create table',
+    rb'select table', rb'drop table', rb'create schema', rb'select schema', rb'drop schema', rb'insert into',
+    rb'select +from',
+)
+# Keywords blocked only in sequence: "select .* from", "select.*from.*where",
+# "update.*set.*where" and "delete from.*where"
+SQL_KEYWORDS = (rb'delete from', rb'select', rb'from', rb'where', rb'update', rb'set')
+
+# One flat alternation over lowercased bytes: without groups, lookahead or case
+# folding the regex engine can skip ahead on the first byte of the keywords.
+SQL_TOKEN_REGEX = re.compile(rb'|'.join(SQL_PHRASES + SQL_KEYWORDS))
+
+# Largest body (in bytes) scanned per request, None scans everything
+SQL_INJECTION_MAX_SCAN_SIZE = 1024 * 1024
+
+
+class SQLSequenceMatcher:
+    """
+    State machine over the token stream of SQL_TOKEN_REGEX (any token that is
+    not a sequence keyword is a phrase and matches at once), equivalent to
+    the former list of per-pattern regex searches but linear in the body size.
+    Each state is the end offset of the first match of a sequence prefix, a
+    keyword only advances a sequence when it starts after that offset.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.ends = {}
+        self.handlers = {
+            b'select': self.select,
+            b'from': self.from_,
+            b'where': self.where,
+            b'update': self.update,
+            b'set': self.set_,
+            b'delete from': self.delete_from,
+        }
+
+    def after(self, state, start):
+        return state in self.ends and start >= self.ends[state]
+
+    def mark(self, state, end):
+        self.ends.setdefault(state, end)
+        return False
+
+    def select(self, start, end):
+        if self.data[end:end + 1] == b' ':
+            self.mark('select ', end + 1)
+        return self.mark('select', end)
+
+    def from_(self, start, end):
+        # select .* from
+        if self.data[start - 1:start] == b' ' and self.after('select ', start - 1):
+            return True
+        return self.after('select', start) and self.mark('select..from', end)
+
+    def where(self, start, end):
+        return any(self.after(state, start) for state in ('select..from', 'update..set', 'delete from'))
+
+    def update(self, start, end):
+        return self.mark('update', end)
+
+    def set_(self, start, end):
+        return self.after('update', start) and self.mark('update..set', end)
+
+    def delete_from(self, start, end):
+        return self.mark('delete from', end)
+
+    def matches(self):
+        search = SQL_TOKEN_REGEX.search
+        match = search(self.data)
+        while match is not None:
+            handler = self.handlers.get(match.group())
+            if handler is None or handler(match.start(), match.end()):
+                return True
+            # resume one byte further so overlapping keywords ("delete from" / "from") are seen
+            match = search(self.data, match.start() + 1)
+        return False
+
+
+def contains_sql(data, max_size=None):
+    if max_size is not None and len(data) > max_size:
+        data = data[:max_size]
+    return SQLSequenceMatcher(data.lower()).matches()
+
+
+def query_dict_bytes(query_dict):
+    return '\n'.join(
+        '{}\n{}'.format(key, value) for key, values in query_dict.lists() for value in values
+    ).encode('utf-8')
 
 
 class AtomicSQLInjectionMiddleware(object):
+    """
+    Rejects requests whose body or query params contain SQL statements (422).
+
+    JSON bodies are scanned as raw bytes in a single pass (decoded only when they
+    carry \\u escapes), form and multipart bodies through their parsed fields;
+    uploaded files are not scanned. At most SQL_INJECTION_MAX_SCAN_SIZE bytes
+    of a body are scanned.
+
+    Django only parses POST forms into request.POST / request.FILES. PUT and
+    PATCH multipart bodies, and form bodies above DATA_UPLOAD_MAX_MEMORY_SIZE,
+    are parsed here from the request stream in the same way, once: DRF takes
+    request.POST / request.FILES when the stream has already been read.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.max_scan_size = getattr(settings, 'SQL_INJECTION_MAX_SCAN_SIZE', SQL_INJECTION_MAX_SCAN_SIZE)
 
-    # flake8: noqa: C901
     def __call__(self, request):
-        if request.method in ['POST', 'PUT', 'PATCH']:
-            if request.content_type == 'application/json':
-                try:
-                    data = json.loads(request.body.decode('utf-8'))
-                except (json.JSONDecodeError, UnicodeDecodeError):
-                    data, _ = self.parse_files(request)
-                    data = data.dict()
-            elif request.content_type == 'multipart/form-data':
-                data = self.parse_multipart_form_data(request)
-            elif request.content_type == 'application/x-www-form-urlencoded':
-                data = QueryDict(request.body.decode('utf-8')).dict()
-            else:
-                data = {}
-        else:
-            data = {}
-        data = json.dumps(data).lower()
-        query_params = json.dumps(dict(zip(request.GET.keys(), request.GET.values()))).lower()
-        regex_pattern = ['truncate table', 'create database', 'select database', 'drop database', 'create table', 'select table', 'drop table', 'create schema', 'select schema', 'drop schema', 'insert into', 'select * from', 'select .* from.*', 'select.*from.*where.*', 'update.*set.*where.*', 'delete from.*where.*']
-        for pattern in regex_pattern:
-            if re.search(pattern, data):
-                return HttpResponse(status=422)
-        for pattern in regex_pattern:
-            if re.search(pattern, query_params):
-                return HttpResponse(status=422)
+        if self.body_contains_sql(request) or contains_sql(query_dict_bytes(request.GET)):
+            return HttpResponse(status=422)
         response = self.get_response(request)
         return response
 
-    def parse_multipart_form_data(self, request):
-        # Create a copy of the original POST data
-        original_post_data = request.POST.copy()
-
-        # Create a QueryDict to store the form data
-        form_data = QueryDict('', mutable=True)
-
-        # Parse form data using MultiPartParser
-        parser = MultiPartParser(request.META, request, request.upload_handlers)
-        post_data, files_data = parser.parse()
-
-        # Update the QueryDict with parsed form data
-        form_data.update(original_post_data)
-        form_data.update(post_data)
-
-        return form_data
-
-    def parse_files(self, request):
-        # Create a copy of the original POST data
-        original_post_data = request.POST.copy()
-
-        # Create a QueryDict to store the form data
-        form_data = QueryDict('', mutable=True)
-
-        # Parse form data using MultiPartParser
-        parser = MultiPartParser(request.META, request, request.upload_handlers)
-        post_data, files_data = parser.parse()
-
-        # Update the QueryDict with parsed form data
-        form_data.update(original_post_data)
-        form_data.update(post_data)
-
-        # return form_data
-        return post_data, files_data
-
+    def body_contains_sql(self, request):
+        if request.method not in ['POST', 'PUT', 'PATCH']:
+            return False
+        if request.content_type == 'application/json':
+            body = request.body
+            if b'\\u' in body:
+                # unicode escapes could hide keywords from the byte scan
+                body = self.unescape_json(body)
+            return contains_sql(body, self.max_scan_size)
+        if request.content_type in ['multipart/form-data', 'application/x-www-form-urlencoded']:
+            data = query_dict_bytes(self.form_data(request))
+            return contains_sql(data, self.max_scan_size)
+        return False
+
+    def form_data(self, request):
+        if request.method == 'POST':
+            return request.POST
+        if request.content_type == 'application/x-www-form-urlencoded' and not self.exceeds_memory_size(request):
+            # the body stays readable for views outside DRF
+            return QueryDict(request.body, encoding=request.encoding)
+        try:
+            if request.content_type == 'multipart/form-data':
+                request._post, request._files = request.parse_file_upload(request.META, request)
+            else:
+                request._post, request._files = QueryDict(request.read(), encoding=request.encoding), MultiValueDict()
+        except MultiPartParserError:
+            # as Django does for POST, the view finds no data
+            request._post, request._files = QueryDict(), MultiValueDict()
+        return request._post
+
+    def exceeds_memory_size(self, request):
+        # request.body raises RequestDataTooBig above DATA_UPLOAD_MAX_MEMORY_SIZE
+        if settings.DATA_UPLOAD_MAX_MEMORY_SIZE is None:
+            return False
+        try:
+            return int(request.META.get('CONTENT_LENGTH') or 0) > settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        except ValueError:
+            return False
+
+    def unescape_json(self, body):
+        try:
+            return json.dumps(json.loads(body), ensure_ascii=False).encode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            return body
+
+
+class AtomicInstrumentationMiddleware:
+    """
+    Always-on per route metrics: request time, query count, DB time and
+    repeated (N+1) query shapes, collected with connection.execute_wrapper
+    and aggregated in process by atomicloops.metrics (see ATOMIC_METRICS).
+    """
 
-class QueryCountMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        response = self.get_response(request)
-        query_count = len(connection.queries)
-        with open('logs/query_count.txt', 'a+') as f:
-            f.write(f"{request.path} {request.method} {query_count} \n")
+        request_metrics = RequestMetrics()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(request_metrics))
+            response = self.get_response(request)
+        request_metrics.total_ms = (time.perf_counter() - start) * 1000
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else '<unresolved>'
+        registry.record(route, request.method, request_metrics, response.status_code)
         return response
@@ -7,7 +7,10 @@ from django.utils.translation import gettext_lazy as _
 class AtomicBaseModel(models.Model):
     id = models.UUIDField(verbose_name=_('Id'), primary_key=True, db_column="id", default=uuid.uuid4)
     createdAt = models.DateTimeField(verbose_name=_('Create Date'), auto_now_add=True, db_column='created_at')
-    updatedAt = models.DateTimeField(verbose_name=_('Update Date'), auto_now=True, db_column='updated_at')
+    updatedAt = models.DateTimeField(verbose_name=_('Update Date'), auto_now=True, db_column='updated_at', db_index=True)
+
+    # column incremental exports (atomicloops.exporters) select changed rows on
+    export_watermark_field = 'updatedAt'
 
     class Meta:
         abstract = True
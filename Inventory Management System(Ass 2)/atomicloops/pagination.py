@@ -1,6 +1,11 @@
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from collections import OrderedDict
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+import json
 import math
 
 
@@ -16,3 +21,171 @@ class AtomicPagination(pagination.LimitOffsetPagination):
             ('previous', self.get_previous_link()),
             ('results', data)
         ]))
+
+
+def estimate_count(queryset):
+    """
+    Planner row estimate for a queryset, without scanning the table.
+
+    Unfiltered querysets read pg_class.reltuples, filtered ones the top level
+    "Plan Rows" of EXPLAIN. Falls back to an exact count on other databases
+    and on tables that were never analyzed.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    queryset = queryset.order_by()
+    if not queryset.query.where and not queryset.query.distinct:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)]
+            )
+            row = cursor.fetchone()
+        estimate = row[0] if row else -1
+    else:
+        plan = json.loads(queryset.explain(format='json'))
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+    return estimate if estimate >= 0 else queryset.count()
+
+
+# Keyset Pagination
+class AtomicCursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination over a composite ordering, (createdAt, id) by default.
+
+    The cursor stores the values of every ordering field of the last row, so a
+    page is one indexed range scan whatever its depth. The view's `ordering`
+    is used when declared and the primary key is appended as a tie breaker.
+    Ordering fields must be non-null.
+
+    count_mode controls the `count` of the envelope:
+        'exact'    - COUNT(*) of the filtered queryset
+        'estimate' - planner estimate, see estimate_count
+        'none'     - no count query, count is null
+    A view can override it with a `pagination_count_mode` attribute.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    ordering = ('-createdAt', '-pk')
+    count_mode = 'exact'
+    count_modes = ('exact', 'estimate', 'none')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering == tuple(self.ordering) and getattr(view, 'ordering', None):
+            view_ordering = view.ordering
+            ordering = (view_ordering,) if isinstance(view_ordering, str) else tuple(view_ordering)
+
+        pk_names = {'pk', queryset.model._meta.pk.name}
+        if not any(field.lstrip('-') in pk_names for field in ordering):
+            ordering += ('-pk' if ordering[-1].startswith('-') else 'pk',)
+        return ordering
+
+    def get_count(self, queryset, view):
+        count_mode = getattr(view, 'pagination_count_mode', self.count_mode)
+        assert count_mode in self.count_modes, (
+            'Invalid count mode {mode!r}, expected one of {modes}.'.format(mode=count_mode, modes=self.count_modes)
+        )
+        if count_mode == 'none':
+            return None
+        if count_mode == 'estimate':
+            return estimate_count(queryset)
+        return queryset.count()
+
+    def get_keyset_filter(self, values, reverse):
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), per field direction
+        keyset = Q()
+        equal = {}
+        for order, value in zip(self.ordering, values):
+            field = order.lstrip('-')
+            lookup = '__lt' if order.startswith('-') != reverse else '__gt'
+            keyset |= Q(**equal, **{field + lookup: value})
+            equal[field] = value
+        return keyset
+
+    def decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.count = self.get_count(queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*pagination._reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        # The ordering is unique, so the position alone locates the page and offset stays 0
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self.get_keyset_filter(self.decode_position(current_position), reverse))
+            except ValidationError:
+                # values that do not fit the ordering fields
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        following_position = self._get_position_from_instance(results[-1], self.ordering) if has_following else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = has_following
+            self.has_previous = (current_position is not None) or (offset > 0)
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field = order.lstrip('-')
+            attr = instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            values.append(None if attr is None else str(attr))
+        return json.dumps(values, separators=(',', ':'))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties']['count'] = {'type': 'integer', 'nullable': True, 'example': 123}
+        return response_schema
+
+
+# Keyset pagination without the COUNT(*), for very large tables
+class AtomicEstimatedCursorPagination(AtomicCursorPagination):
+    count_mode = 'estimate'
@@ -1,12 +1,65 @@
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, documents are then encoded with the json module
+    orjson = None
+
+# Types orjson leaves to DRF's encoder: Decimal (as float), datetimes (millisecond
+# precision, "Z" for UTC, as DRF writes them), lazy translations, querysets...
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson is not None else 0
+
+drf_encoder = JSONEncoder()
+
+SUCCESS_PREFIX = b'{"data":'
+SUCCESS_SUFFIX = b',"error":{},"isSuccess":true}'
+
+
+def escape_separators(content):
+    # DRF always escapes U+2028/U+2029 so the JSON is also valid javascript
+    return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+def json_dumps(data):
+    return escape_separators(
+        json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+    )
+
+
+def dumps(data):
+    """
+    Compact UTF-8 JSON of `data`, the document DRF's JSONRenderer writes with
+    the default settings. Encoded by orjson when it is installed.
+    """
+    if orjson is not None:
+        try:
+            return escape_separators(orjson.dumps(data, default=drf_encoder.default, option=ORJSON_OPTIONS))
+        except orjson.JSONEncodeError:
+            # e.g. integers above 64 bits, the json module reports anything really unsupported
+            pass
+    return json_dumps(data)
 
 
 class AtomicJsonRenderer(JSONRenderer):
 
+    def fast_path(self, accepted_media_type, renderer_context):
+        # dumps only writes the default compact, unicode output
+        return self.compact and not self.ensure_ascii and self.get_indent(accepted_media_type, renderer_context) is None
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        if self.fast_path(accepted_media_type, renderer_context or {}):
+            return dumps(data)
+        return super(AtomicJsonRenderer, self).render(data, accepted_media_type, renderer_context)
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         if renderer_context is not None:
             # status_codes = [200, 201, 204, 205]
             if renderer_context['response'].status_code in [200, 201, 205]:
+                if self.fast_path(accepted_media_type, renderer_context):
+                    # envelope written around the encoded payload, no wrapping dict
+                    return SUCCESS_PREFIX + dumps(data) + SUCCESS_SUFFIX
                 data = {'data': data, "error": {}, "isSuccess": True}
             elif renderer_context['response'].status_code == 204:
                 return super(AtomicJsonRenderer, self).render(data, accepted_media_type, renderer_context)
@@ -16,4 +69,4 @@ class AtomicJsonRenderer(JSONRenderer):
                 data = {'data': {}, "error": data, "isSuccess": False}
         else:
             data = {'data': data}
-        return super(AtomicJsonRenderer, self).render(data, accepted_media_type, renderer_context)
+        return self.encode(data, accepted_media_type, renderer_context)
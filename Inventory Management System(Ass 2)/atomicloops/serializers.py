@@ -1,52 +1,160 @@
 # Atomic Serializer
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.utils.serializer_helpers import ReturnList
 from collections import OrderedDict
-from utils.time import convert_time
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.functional import cached_property
+from utils.time import format_time, get_timezone
 
 
-class AtomicSerializer(serializers.ModelSerializer):
+class AtomicTimeField(serializers.Field):
+    """
+    Read only datetime in the zone of the request's X-Timezone-Region header,
+    formatted as utils.time.TIME_FORMAT. The zone is looked up once per
+    serializer, so a list resolves it once for all its rows.
+    """
 
-    createdAt = serializers.SerializerMethodField()
-    updatedAt = serializers.SerializerMethodField()
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
 
-    def get_createdAt(self, instance):
-        timezone = self.context['request'].META.get('HTTP_X_TIMEZONE_REGION', None)
-        return convert_time(instance.createdAt, timezone)
+    @cached_property
+    def timezone(self):
+        request = self.context.get('request')
+        return get_timezone(request.META.get('HTTP_X_TIMEZONE_REGION') if request is not None else None)
 
-    def get_updatedAt(self, instance):
-        timezone = self.context['request'].META.get('HTTP_X_TIMEZONE_REGION', None)
-        return convert_time(instance.updatedAt, timezone)
+    def to_representation(self, value):
+        return format_time(value, self.timezone)
+
+
+# model -> {field name: verbose name}, the keys errors are reported under
+_verbose_names = {}
+
+
+def get_verbose_names(model):
+    names = _verbose_names.get(model)
+    if names is None:
+        # forward fields only, reverse relations have no verbose_name
+        names = _verbose_names[model] = {
+            field.name: field.verbose_name
+            for field in model._meta.fields + model._meta.many_to_many if hasattr(field, 'verbose_name')
+        }
+    return names
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        action = self.context["view"].action
-        permission = self.context["request"].user == instance.id
-        if action == "list":
-            return OrderedDict(
-                {key: data[key] for key in data if key in self.Meta.list_fields}
-            )
-        if action == "retrieve":
-            if not permission:
-                return data
-            return OrderedDict(
-                {key: data[key] for key in data if key in self.Meta.get_fields}
-            )
-        return data
+
+def map_errors(errors, names):
+    # field names replaced by their (translated) verbose name, other keys kept
+    return {str(names[key]) if key in names else key: error for key, error in errors.items()}
+
+
+class AtomicListSerializer(serializers.ListSerializer):
 
     @property
     def errors(self):
-        # get errors
+        # every row mapped in one pass, verbose names translated once
         errors = super().errors
-        verbose_errors = {}
+        names = {name: str(verbose_name) for name, verbose_name in self.child.verbose_names.items()}
+        if isinstance(errors, dict):
+            return map_errors(errors, names)
+        return ReturnList([map_errors(row, names) if row else row for row in errors], serializer=self)
+
 
-        # fields = { field.name: field.verbose_name } for each field in model
-        fields = {field.name: field.verbose_name for field in
-                  self.Meta.model._meta.get_fields() if hasattr(field, 'verbose_name')}
+# Meta attribute holding the fields each action returns
+PROJECTIONS = {'list': 'list_fields', 'retrieve': 'get_fields'}
 
-        # iterate over errors and replace error key with verbose name if exists
-        for field_name, error in errors.items():
-            if field_name in fields:
-                verbose_errors[str(fields[field_name])] = error
+# (serializer class, action) -> projected field names / model columns they read
+_projections = {}
+_projection_columns = {}
+
+
+class AtomicSerializer(serializers.ModelSerializer):
+
+    createdAt = AtomicTimeField()
+    updatedAt = AtomicTimeField()
+
+    # {field name: verbose name} of Meta.model, set when the class is created
+    verbose_names = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        model = getattr(getattr(cls, 'Meta', None), 'model', None)
+        if model is not None:
+            cls.verbose_names = get_verbose_names(model)
+            if not hasattr(cls.Meta, 'list_serializer_class'):
+                cls.Meta.list_serializer_class = AtomicListSerializer
+
+    @classmethod
+    def get_projection(cls, action):
+        # field names returned for `action`, None for all of them
+        key = (cls, action)
+        if key not in _projections:
+            names = getattr(cls.Meta, PROJECTIONS[action], None) if action in PROJECTIONS else None
+            _projections[key] = frozenset(names) if names is not None else None
+        return _projections[key]
+
+    @classmethod
+    def get_projection_columns(cls, action):
+        """
+        Model fields read by the projected fields of `action`, for .only();
+        None when a field reads anything else (methods, properties, dotted sources).
+        """
+        key = (cls, action)
+        if key not in _projection_columns:
+            _projection_columns[key] = cls.find_projection_columns(action)
+        return _projection_columns[key]
+
+    @classmethod
+    def find_projection_columns(cls, action):
+        names = cls.get_projection(action)
+        if names is None:
+            return None
+        model = cls.Meta.model
+        columns = [model._meta.pk.name]
+        for field in cls().fields.values():
+            if field.write_only or field.field_name not in names:
+                continue
+            if field.source == '*' or '.' in field.source:
+                return None
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                return None
+            if model_field.concrete:
+                columns.append(model_field.name)
+            elif not (model_field.many_to_many or model_field.one_to_many):
+                return None
+        return list(dict.fromkeys(columns))
+
+    def get_projected_fields(self, names):
+        # readable fields kept by a projection, built once per serializer instance
+        projected = self.__dict__.setdefault('_projected_fields', {})
+        if names not in projected:
+            projected[names] = [field for field in self._readable_fields if names is None or field.field_name in names]
+        return projected[names]
+
+    def to_representation(self, instance):
+        action = getattr(self.context.get("view"), "action", None)
+        names = None
+        if action == "list":
+            names = self.get_projection(action)
+        elif action == "retrieve" and self.context["request"].user == instance.id:
+            names = self.get_projection(action)
+        # serializers.Serializer.to_representation over the projected fields only
+        ret = OrderedDict()
+        for field in self.get_projected_fields(names):
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            if check_for_none is None:
+                ret[field.field_name] = None
             else:
-                verbose_errors[field_name] = error
-        return verbose_errors
+                ret[field.field_name] = field.to_representation(attribute)
+        return ret
+
+    @property
+    def errors(self):
+        return map_errors(super().errors, self.verbose_names)
@@ -1,82 +1,83 @@
 from src.celery import app
 import os
 from django.conf import settings
-import csv
-from django.apps import apps
-import random
-import boto3
-import string
 import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from users.serializers import ExportDataSerializer
+from django.utils.module_loading import import_string
+from users.models import ExportData, ImportData
+from atomicloops.exporters import get_exporter
+from atomicloops.importers import AtomicImporter
+from atomicloops.tokens import BLACKLIST_LOAD_LOCK_KEY, delete_expired_tokens, load_blacklist
+from django.core.cache import cache
+from utils.email import SMTPConnection, is_transient
 
 BASE_DIR = settings.BASE_DIR
 
 
+@app.task(bind=True, max_retries=3, default_retry_delay=60)
+def export_data(self, export_id):
+    # streaming export of an ExportData record, a retry resumes after the last uploaded part
+    export_record = ExportData.objects.get(id=export_id)
+    if export_record.status == 'completed':
+        return export_record.fileUrl
+    exporter = get_exporter(export_record)
+    try:
+        exporter.run()
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        exporter.abort()
+        raise
+    return export_record.fileUrl
+
+
 @app.task(bind=True)
-def export_data(
-    self, model, app_name, filename=None, userId=None,
-):
-    table = apps.get_model('{}.{}'.format(app_name, model))
-    qs = table.objects.all()
+def import_file(self, import_id, serializer, path, delimiter='\t'):
+    # streaming import of an upload stored by AtomicViewSet.import_data, progress is saved per chunk
+    import_record = ImportData.objects.get(id=import_id)
+    serializer_class = import_string(serializer)
+    importer = AtomicImporter(serializer_class, delimiter=delimiter, progress=import_record.update_progress)
+    try:
+        with open(path, 'rb') as file:
+            summary = importer.import_file(file)
+    except Exception as e:
+        importer.add_error(None, str(e))
+        import_record.update_progress(importer.summary, status="failed")
+        raise
+    finally:
+        os.remove(path)
+    import_record.finish(summary)
+    return {key: summary[key] for key in ('totalRows', 'importedRows', 'failedRows')}
 
-    keys = list(qs.first().__dict__.keys())
-    keys.remove('_state')
-    filename = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-    # Write to file
-    with open(filename, 'w', newline='') as output_file:
-        dict_writer = csv.DictWriter(output_file, keys, delimiter='\t')
-        dict_writer.writeheader()
-        for item in qs:
-            row = item.__dict__
-            del row['_state']
-            dict_writer.writerow(item.__dict__)
 
-    # upload to AWS
-    file_id = self.request.id
-    s3 = boto3.client("s3", region_name=settings.REGION, aws_access_key_id=settings.AWS_ACCESS_KEY_ID, aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY)
-    aws_path = "export-data/%s-%s.tsv" % (model, file_id)
-    s3.upload_file(
-        filename,
-        settings.S3_BUCKET,
-        aws_path,
-        ExtraArgs={'ACL': 'public-read'})
-    aws_url = f"{settings.AWS_URL}/{aws_path}"
-    data = {
-        'id': file_id,
-        'userId': userId,
-        'modelName': model,
-        'fileUrl': aws_url
-    }
-    serializer = ExportDataSerializer(data=data)
-    if serializer.is_valid():
-        serializer.save()
-    os.remove(filename)
+# SMTP session reused by every send_email run of this worker process
+smtp_connection = None
 
 
-@app.task(bind=True)
+@app.task(bind=True, max_retries=3)
 def send_email(self, receiver, subject, message, cc=''):
+    global smtp_connection
+    if smtp_connection is None:
+        smtp_connection = SMTPConnection()
     try:
-        # stmp setup to send email
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.set_debuglevel(0)  # 0 for no debugging
-        server.ehlo()  # say hello to the server
-        server.starttls()  # start TLS encryption
-        server.login(settings.EMAIL, settings.PASSWORD)
-
-        # Email Configuration
-        body = MIMEMultipart("alternative")
-        body["Subject"] = subject
-        body["From"] = settings.EMAIL
-        body["To"] = receiver   # send to single email
-        body.attach(MIMEText(message, 'html'))
-        if cc != "":
-            body['Cc'] = cc
-            rcpt = [receiver] + cc.split(',')
-        else:
-            rcpt = [receiver]
-        server.sendmail(settings.EMAIL, rcpt, body.as_string())
+        smtp_connection.send(receiver, subject, message, cc)
         return True
-    except:
+    except (smtplib.SMTPException, OSError) as e:
+        if is_transient(e) and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=smtp_connection.config['RETRY_BACKOFF'] * 2 ** self.request.retries)
         return False
+
+
+@app.task
+def load_token_blacklist():
+    # fills the redis blacklist set, scheduled by the first lookup that finds it incomplete
+    try:
+        return load_blacklist()
+    finally:
+        cache.delete(BLACKLIST_LOAD_LOCK_KEY)
+
+
+@app.task
+def purge_expired_tokens():
+    # periodic: the token_blacklist tables otherwise grow with every login and rotation.
+    # No reload here: a failed add drops the complete marker and the next lookup schedules one
+    return delete_expired_tokens()
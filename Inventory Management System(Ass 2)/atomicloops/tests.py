@@ -1,3 +1,596 @@
-from django.test import TestCase
+import smtplib
+import socketserver
+import threading
+from datetime import datetime, timedelta, timezone as fixed_timezone
+from unittest import mock
+from urllib.parse import urlencode, urlparse
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+import pytz
+from redis.exceptions import RedisError
+from rest_framework import generics, parsers, serializers
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import ExportData, ImportData, Users, UsersDevices
+from users.serializers import UsersDevicesSerializer, UsersSerializer
+from utils.email import DEFAULT_EMAIL_CONFIG, EmailDispatcher, SMTPConnection, is_transient
+from utils.time import convert_time
+from .authentication import AtomicJWTAuthentication, revoke_user_tokens
+from .cache import AtomicCacheMixin
+from .exporters import set_watermarks
+from .middleware import AtomicSQLInjectionMiddleware
+from .pagination import AtomicCursorPagination
+from .serializers import AtomicListSerializer
+from .tasks import import_file, purge_expired_tokens, send_email
+from .tokens import BLACKLIST_COMPLETE_MEMBER, add_to_blacklist, blacklist_key
+from .viewsets import AtomicViewSet
+
+
+class CachedUsersView(AtomicCacheMixin, AtomicViewSet):
+    queryset = Users.objects.all()
+
+
+class SharedCachedUsersView(CachedUsersView):
+    cache_vary_on_user = False
+
+
+class AtomicCacheMixinTests(SimpleTestCase):
+
+    def cache_key(self, view_class, user):
+        request = Request(APIRequestFactory().get('/users/1/'))
+        request.user = user
+        return view_class(action='retrieve', request=request).get_cache_key(request)
+
+    def test_entries_are_per_user_by_default(self):
+        first, second = Users(pk=1, level=1), Users(pk=2, level=1)
+        self.assertNotEqual(self.cache_key(CachedUsersView, first), self.cache_key(CachedUsersView, second))
+
+    def test_opting_out_shares_entries_within_a_level(self):
+        first, second = Users(pk=1, level=1), Users(pk=2, level=1)
+        self.assertEqual(self.cache_key(SharedCachedUsersView, first), self.cache_key(SharedCachedUsersView, second))
+        self.assertNotEqual(
+            self.cache_key(SharedCachedUsersView, first), self.cache_key(SharedCachedUsersView, Users(pk=3, level=5))
+        )
+
+
+class AtomicSQLInjectionMiddlewareTests(SimpleTestCase):
+    sql = {'name': 'x', 'comment': "1'; drop table users; --"}
+    clean = {'name': 'x', 'comment': 'fine'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = AtomicSQLInjectionMiddleware(lambda request: HttpResponse())
+
+    def form_request(self, method, data):
+        return self.factory.generic(method.upper(), '/users/1/', urlencode(data), 'application/x-www-form-urlencoded')
+
+    def multipart_request(self, method, data):
+        return self.factory.generic(method.upper(), '/users/1/', encode_multipart(BOUNDARY, data), MULTIPART_CONTENT)
+
+    def test_form_bodies_are_scanned_for_every_method(self):
+        for method in ('post', 'put', 'patch'):
+            with self.subTest(method=method):
+                self.assertEqual(self.middleware(self.form_request(method, self.sql)).status_code, 422)
+                self.assertEqual(self.middleware(self.form_request(method, self.clean)).status_code, 200)
+
+    def test_multipart_bodies_are_scanned_for_every_method(self):
+        for method in ('post', 'put', 'patch'):
+            with self.subTest(method=method):
+                self.assertEqual(self.middleware(self.multipart_request(method, self.sql)).status_code, 422)
+                self.assertEqual(self.middleware(self.multipart_request(method, self.clean)).status_code, 200)
+
+    def test_patch_body_is_still_readable_after_the_scan(self):
+        middleware = AtomicSQLInjectionMiddleware(lambda request: HttpResponse(request.body))
+        self.assertEqual(middleware(self.form_request('patch', self.clean)).content, urlencode(self.clean).encode())
+
+    def drf_response(self, request):
+        # what the view's parsers hand over once the middleware has scanned the body
+        return AtomicSQLInjectionMiddleware(EchoView.as_view())(request)
+
+    def test_put_multipart_is_parsed_once_for_drf(self):
+        data = dict(self.clean, file=SimpleUploadedFile('image.png', b'\x89PNG' + b'x' * 5000))
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024):
+            with mock.patch('rest_framework.parsers.MultiPartParser.parse') as parse:
+                response = self.drf_response(self.multipart_request('put', data))
+        self.assertEqual(response.status_code, 200)
+        parse.assert_not_called()
+        self.assertEqual(response.data, {'data': self.clean, 'files': {'file': 5004}})
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_form_bodies_above_the_memory_size_are_scanned(self):
+        large = dict(self.clean, notes='n' * 2000)
+        response = self.drf_response(self.form_request('patch', large))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data'], large)
+        self.assertEqual(self.middleware(self.form_request('patch', dict(self.sql, notes='n' * 2000))).status_code, 422)
+        multipart = dict(self.sql, file=SimpleUploadedFile('image.png', b'x' * 5000))
+        self.assertEqual(self.middleware(self.multipart_request('put', multipart)).status_code, 422)
+
+
+class EchoView(APIView):
+    authentication_classes = []
+    permission_classes = []
+    parser_classes = [parsers.FormParser, parsers.MultiPartParser]
+
+    def put(self, request):
+        return Response({
+            'data': {key: value for key, value in request.data.items() if key not in request.FILES},
+            'files': {name: file.size for name, file in request.FILES.items()},
+        })
+
+    patch = put
+
+
+class TokenBlacklistTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = mock.Mock()
+        patcher = mock.patch('atomicloops.tokens.get_blacklist_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_added_tokens_keep_the_set_complete(self):
+        add_to_blacklist([('new', 2000000000)])
+        self.client.zadd.assert_called_once_with(blacklist_key(), {'new': 2000000000})
+        self.client.zrem.assert_not_called()
+
+    def test_failed_add_unmarks_the_set_complete(self):
+        # lookups then fall back to the database until the set is reloaded
+        self.client.zadd.side_effect = RedisError('timeout')
+        with self.assertLogs('atomicloops.tokens', 'WARNING'):
+            add_to_blacklist([('new', 2000000000)])
+        self.client.zrem.assert_called_once_with(blacklist_key(), BLACKLIST_COMPLETE_MEMBER)
+
+
+class DevicesView(AtomicViewSet):
+    queryset = UsersDevices.objects.all()
+    serializer_class = UsersDevicesSerializer
+
+
+class PurgeExpiredTokensTests(TestCase):
+    def test_purge_does_not_reload_the_blacklist(self):
+        with mock.patch('atomicloops.tasks.load_blacklist') as load:
+            deleted = purge_expired_tokens()
+        load.assert_not_called()
+        self.assertEqual(deleted, {'blacklisted': 0, 'outstanding': 0})
+
+
+class ImportDataTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_superuser(email='admin@example.com', password='x')
+        cls.user = Users.objects.create_user(email='user@example.com', password='x', level=1)
+
+    def upload(self, *rows):
+        lines = ['userId\tdeviceId\ttoken\tdeviceType\tlanguage'] + [
+            f'{self.admin.id}\t{device}\ttoken\t{kind}\ten' for device, kind in rows
+        ]
+        request = APIRequestFactory().post(
+            '/devices/import-data/',
+            {'file': SimpleUploadedFile('devices.tsv', '\n'.join(lines).encode())},
+            format='multipart',
+        )
+        force_authenticate(request, user=self.admin)
+        return DevicesView.as_view({'post': 'import_data'})(request)
+
+    def import_status(self, import_id, user):
+        request = APIRequestFactory().get(f'/devices/import-data/{import_id}/')
+        force_authenticate(request, user=user)
+        return DevicesView.as_view({'get': 'import_status'})(request, import_id=import_id)
+
+    def test_partial_import_is_created_with_counts(self):
+        response = self.upload(('d1', 'android'), ('d2', 'not-a-device'), ('d3', 'ios'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['importedRows'], response.data['failedRows']), (2, 1))
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual(sorted(UsersDevices.objects.values_list('deviceId', flat=True)), ['d1', 'd3'])
+
+    def test_import_without_imported_rows_is_rejected(self):
+        response = self.upload(('d1', 'not-a-device'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['importedRows'], response.data['failedRows']), (0, 1))
+        self.assertFalse(UsersDevices.objects.exists())
+
+    @override_settings(ATOMIC_IMPORT_ASYNC_SIZE=1)
+    def test_async_import_status(self):
+        with mock.patch.object(import_file, 'delay') as delay:
+            response = self.upload(('d1', 'android'), ('d2', 'not-a-device'))
+        self.assertEqual(response.status_code, 202)
+        import_id = response.data['id']
+        self.assertEqual(self.import_status(import_id, self.admin).data['status'], 'queued')
+
+        # what the celery worker runs
+        import_file(*delay.call_args.args)
+        response = self.import_status(import_id, self.admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'completed')
+        self.assertEqual((response.data['importedRows'], response.data['failedRows']), (1, 1))
+        self.assertEqual(self.import_status(import_id, self.user).status_code, 403)
+        self.assertEqual(ImportData.objects.get(id=import_id).errors[0]['line'], 3)
+
+
+class WatermarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create_superuser(email='admin@example.com', password='x')
+        cls.watermark = timezone.now() - timedelta(days=1)
+        ExportData.objects.create(
+            userId=cls.user, appName='users', modelName='UsersDevices', incremental=True, status='completed',
+            columns=['id', 'deviceId'], filters={'deviceType': 'android'}, watermarkTo=cls.watermark,
+        )
+
+    def watermark_from(self, **kwargs):
+        export = ExportData(userId=self.user, appName='users', modelName='UsersDevices', incremental=True, **kwargs)
+        set_watermarks(export)
+        return export.watermarkFrom
+
+    def test_run_continues_the_same_export(self):
+        self.assertEqual(
+            self.watermark_from(columns=['id', 'deviceId'], filters={'deviceType': 'android'}), self.watermark
+        )
+
+    def test_other_filters_or_columns_start_over(self):
+        self.assertIsNone(self.watermark_from(columns=['id', 'deviceId'], filters={'deviceType': 'ios'}))
+        self.assertIsNone(self.watermark_from(columns=['id'], filters={'deviceType': 'android'}))
+        self.assertIsNone(self.watermark_from(columns=['id', 'deviceId']))
+        self.assertIsNone(
+            self.watermark_from(columns=['id', 'deviceId'], filters={'deviceType': 'android'}, format='parquet')
+        )
+
+
+class TokenRevocationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create_user(email='user@example.com', password='x', level=1)
+
+    def token_issued(self, at_time):
+        token = AccessToken.for_user(self.user)
+        token.set_iat(at_time=at_time)
+        return token
+
+    def test_tokens_of_the_revocation_second_are_refused(self):
+        revoke_user_tokens(self.user.id)
+        valid_after = Users.objects.get(pk=self.user.pk).tokensValidAfter
+        authentication = AtomicJWTAuthentication()
+        for at_time in (valid_after - timedelta(seconds=1), valid_after.replace(microsecond=0), valid_after):
+            with self.subTest(at_time=at_time):
+                with self.assertRaises(InvalidToken):
+                    authentication.get_user(self.token_issued(at_time))
+        next_second = valid_after.replace(microsecond=0) + timedelta(seconds=1)
+        self.assertEqual(authentication.get_user(self.token_issued(next_second)), self.user)
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP server for the mail tests: accepts every command, counts the
+    sessions and delivered messages, and answers the end of DATA with the
+    queued `replies` (250 once they run out).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSession)
+        self.sessions = 0
+        self.attempts = 0
+        self.messages = []
+        self.replies = []
+        self.thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPSession(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.sessions += 1
+        self.reply('220 stand-in')
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith('EHLO'):
+                self.reply('250 stand-in')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                message = b''.join(iter(self.rfile.readline, b'.\r\n'))
+                self.server.attempts += 1
+                reply = self.server.replies.pop(0) if self.server.replies else '250 ok'
+                if reply.startswith('250'):
+                    self.server.messages.append(message)
+                self.reply(reply)
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class EmailTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = SMTPStandIn().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.config = dict(
+            DEFAULT_EMAIL_CONFIG, HOST='127.0.0.1', PORT=self.server.port, USE_TLS=False, RETRY_BACKOFF=0,
+        )
+
+    def test_batch_goes_out_over_one_session(self):
+        dispatcher = EmailDispatcher()
+        with override_settings(ATOMIC_EMAIL=dict(self.config, WORKERS=1)):
+            for index in range(5):
+                dispatcher.enqueue(f'user{index}@example.com', 'subject', 'message')
+            dispatcher.queue.join()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.sessions, 1)
+
+    def test_transient_reply_is_retried(self):
+        self.server.replies = ['451 try again later']
+        self.assertTrue(SMTPConnection(self.config).send_with_retries('user@example.com', 'subject', 'message'))
+        self.assertEqual((self.server.attempts, len(self.server.messages)), (2, 1))
+
+    def test_permanent_reply_is_not_retried(self):
+        self.server.replies = ['550 mailbox unavailable']
+        with self.assertLogs('utils.email', 'ERROR'):
+            sent = SMTPConnection(self.config).send_with_retries('user@example.com', 'subject', 'message')
+        self.assertFalse(sent)
+        self.assertEqual((self.server.attempts, self.server.messages), (1, []))
+
+    def test_full_queue_falls_back_to_celery(self):
+        dispatcher = EmailDispatcher()
+        with override_settings(ATOMIC_EMAIL=dict(self.config, WORKERS=0, QUEUE_SIZE=1)):
+            with mock.patch.object(send_email, 'delay') as delay:
+                dispatcher.enqueue('first@example.com', 'subject', 'message')
+                dispatcher.enqueue('second@example.com', 'subject', 'message', 'cc@example.com')
+        delay.assert_called_once_with('second@example.com', 'subject', 'message', 'cc@example.com')
+        self.assertEqual(dispatcher.queue.qsize(), 1)
+
+    def test_only_transient_errors_are_retried(self):
+        self.assertTrue(is_transient(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient(ConnectionResetError()))
+        self.assertTrue(is_transient(TimeoutError()))
+        self.assertTrue(is_transient(smtplib.SMTPDataError(421, b'closing')))
+        self.assertFalse(is_transient(smtplib.SMTPNotSupportedError('STARTTLS extension not supported')))
+        self.assertFalse(is_transient(smtplib.SMTPDataError(554, b'rejected')))
+
+
+class CursorDevicesView(generics.ListAPIView):
+    authentication_classes = []
+    permission_classes = []
+    queryset = UsersDevices.objects.all()
+    serializer_class = UsersDevicesSerializer
+    pagination_class = AtomicCursorPagination
+    pagination_count_mode = 'exact'
+    ordering = ('-createdAt', 'pk')
+
+
+class AtomicCursorPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = Users.objects.create_superuser(email='admin@example.com', password='x')
+        start = timezone.now()
+        for index in range(23):
+            device = UsersDevices.objects.create(
+                userId=user, deviceId=f'd{index}', token='token', deviceType='android', language='en'
+            )
+            # groups of three rows share a createdAt, the pk breaks the ties
+            UsersDevices.objects.filter(pk=device.pk).update(createdAt=start - timedelta(minutes=index // 3))
+        cls.expected = [
+            str(pk) for pk in UsersDevices.objects.order_by('-createdAt', 'pk').values_list('pk', flat=True)
+        ]
+
+    def get(self, query='', **view_attrs):
+        request = APIRequestFactory().get('/devices/' + query)
+        return CursorDevicesView.as_view(**view_attrs)(request)
+
+    def follow(self, link):
+        return self.get('?' + urlparse(link).query)
+
+    def test_forward_then_backward_walk(self):
+        response = self.get('?limit=5')
+        forward = [response.data['results']]
+        while response.data['next']:
+            response = self.follow(response.data['next'])
+            forward.append(response.data['results'])
+        self.assertEqual([row['id'] for page in forward for row in page], self.expected)
+        self.assertEqual([len(page) for page in forward], [5, 5, 5, 5, 3])
+
+        backward = [response.data['results']]
+        while response.data['previous']:
+            response = self.follow(response.data['previous'])
+            backward.append(response.data['results'])
+        self.assertEqual(backward, forward[::-1])
+        self.assertIsNone(response.data['previous'])
+
+    def cursor_link(self, position):
+        pagination = AtomicCursorPagination()
+        pagination.base_url = 'http://testserver/devices/'
+        return pagination.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def test_invalid_cursors_are_not_found(self):
+        positions = (
+            # another ordering, not a list, not json, values of the wrong type
+            '["2024-01-01T00:00:00+00:00"]', '{"a":1}', 'not json', '["not a date","1"]',
+            '["2024-01-01T00:00:00+00:00","not a uuid"]',
+        )
+        for position in positions:
+            with self.subTest(position=position):
+                self.assertEqual(self.follow(self.cursor_link(position)).status_code, 404)
+        self.assertEqual(self.get('?cursor=garbage').status_code, 404)
+        self.assertEqual(self.follow(self.get('?limit=5').data['next']).status_code, 200)
+
+    def test_count_modes(self):
+        self.assertEqual(self.get('?limit=5').data['count'], 23)
+        self.assertIsNone(self.get('?limit=5', pagination_count_mode='none').data['count'])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE users_devices')
+        self.assertEqual(self.get('?limit=5', pagination_count_mode='estimate').data['count'], 23)
+
+
+class UsersListView(AtomicViewSet):
+    queryset = Users.objects.order_by('email')
+    serializer_class = UsersSerializer
+
+
+class ProjectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Users.objects.create_superuser(email='admin@example.com', password='x')
+        for index in range(3):
+            user = Users.objects.create_user(email=f'user{index}@example.com', password='x', level=1, firstName=f'user {index}')
+            UsersDevices.objects.create(userId=user, deviceId=f'd{index}', token='token', deviceType='ios', language='en')
+
+    def context(self, action, user):
+        request = Request(APIRequestFactory().get('/'))
+        request.user = user
+        return {'request': request, 'view': mock.Mock(action=action)}
+
+    def expected(self, serializer, instance, action, user):
+        # DRF's ModelSerializer output filtered as before the projections
+        data = serializers.ModelSerializer.to_representation(serializer, instance)
+        meta = type(serializer).Meta
+        if action == 'list':
+            return {key: value for key, value in data.items() if key in meta.list_fields}
+        if action == 'retrieve' and user == instance.id:
+            return {key: value for key, value in data.items() if key in meta.get_fields}
+        return dict(data)
+
+    def test_output_matches_model_serializer(self):
+        for serializer_class, queryset in ((UsersSerializer, Users.objects.all()), (UsersDevicesSerializer, UsersDevices.objects.all())):
+            for action in ('list', 'retrieve', 'update'):
+                for instance in queryset:
+                    with self.subTest(serializer=serializer_class.__name__, action=action, instance=instance.pk):
+                        serializer = serializer_class(instance, context=self.context(action, self.admin))
+                        self.assertEqual(dict(serializer.data), self.expected(serializer, instance, action, self.admin))
+
+    def list(self, view_class):
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user=self.admin)
+        return view_class.as_view({'get': 'list'})(request)
+
+    def test_list_reads_only_projected_columns_without_extra_queries(self):
+        for view_class, serializer_class, rows in ((UsersListView, UsersSerializer, 4), (DevicesView, UsersDevicesSerializer, 3)):
+            with self.subTest(view=view_class.__name__):
+                self.assertIsNotNone(serializer_class.get_projection_columns('list'))
+                # COUNT(*) and the page, no query per deferred field
+                with self.assertNumQueries(2):
+                    response = self.list(view_class)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), rows)
+
+
+def legacy_convert_time(time, zone):
+    # utils.time.convert_time before format_time replaced strftime
+    try:
+        return time.astimezone(pytz.timezone(zone)).strftime("%d-%m-%YT%H:%M:%S%z %Z")
+    except Exception:
+        return time.strftime("%d-%m-%YT%H:%M:%S%z %Z")
+
+
+class ConvertTimeTests(SimpleTestCase):
+    zones = (
+        'Asia/Kathmandu', 'Australia/Lord_Howe', 'Pacific/Chatham', 'America/St_Johns', 'Africa/Monrovia',
+        'Asia/Kolkata', 'UTC', 'Europe/London', 'Not/AZone', '', None,
+    )
+    # fractional offsets, their changes (Kathmandu 1986, Monrovia 1972) and DST edges
+    times = (
+        datetime(1900, 1, 1, tzinfo=fixed_timezone.utc),
+        datetime(1919, 3, 1, 0, 44, 30, tzinfo=fixed_timezone.utc),
+        datetime(1950, 6, 15, 12, 30, 15, 250000, tzinfo=fixed_timezone.utc),
+        datetime(1971, 12, 31, 23, 59, 59, tzinfo=fixed_timezone.utc),
+        datetime(1972, 1, 7, 0, 44, 30, tzinfo=fixed_timezone.utc),
+        datetime(1985, 12, 31, 18, 29, 59, tzinfo=fixed_timezone.utc),
+        datetime(1986, 1, 1, 0, 0, tzinfo=fixed_timezone.utc),
+        datetime(2000, 2, 29, 23, 59, 59, 999999, tzinfo=fixed_timezone.utc),
+        datetime(2021, 4, 3, 14, 59, 59, tzinfo=fixed_timezone.utc),
+        datetime(2021, 4, 3, 15, 0, 0, tzinfo=fixed_timezone.utc),
+        datetime(2024, 9, 28, 14, 0, 0, tzinfo=fixed_timezone.utc),
+        datetime(2024, 11, 3, 3, 30, tzinfo=fixed_timezone.utc),
+        datetime(2024, 3, 10, 5, 30, tzinfo=fixed_timezone(timedelta(hours=-3, minutes=-30))),
+        # sub-minute offsets only reach format_time through fixed-offset datetimes
+        datetime(1971, 6, 1, 11, 15, 30, tzinfo=fixed_timezone(timedelta(minutes=-44, seconds=-30), 'MMT')),
+        datetime(1971, 6, 1, 11, 15, 30, tzinfo=fixed_timezone(timedelta(hours=5, minutes=53, seconds=28))),
+        datetime(1971, 6, 1, 11, 15, 30, tzinfo=fixed_timezone(timedelta(seconds=-30, microseconds=-250))),
+    )
+
+    def test_matches_strftime(self):
+        for zone in self.zones:
+            for time in self.times:
+                with self.subTest(zone=zone, time=time):
+                    self.assertEqual(convert_time(time, zone), legacy_convert_time(time, zone))
+
+
+class CheckedDevicesSerializer(UsersDevicesSerializer):
+    def validate(self, attrs):
+        if attrs['deviceId'] == attrs['token']:
+            raise serializers.ValidationError('Token must differ from the device id.')
+        return attrs
+
+    class Meta(UsersDevicesSerializer.Meta):
+        pass
+
+
+class AtomicListSerializerTests(TestCase):
+    def setUp(self):
+        self.user = Users.objects.create_user(email='rows@example.com', password='x', level=1)
+
+    def device(self, **values):
+        row = {'userId': self.user.pk, 'deviceId': 'device', 'token': 'token', 'deviceType': 'web', 'language': 'en'}
+        row.update(values)
+        return row
+
+    def test_row_errors_use_verbose_names(self):
+        rows = [
+            self.device(),
+            self.device(deviceType='fridge', language=''),
+            self.device(token='device'),
+            'not a row',
+            self.device(deviceId='other'),
+        ]
+        serializer = CheckedDevicesSerializer(data=rows, many=True)
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors
+        self.assertEqual(len(errors), len(rows))
+        self.assertEqual(errors[0], {})
+        self.assertEqual(set(errors[1]), {'Device Type', 'Language'})
+        self.assertEqual(errors[1]['Device Type'][0].code, 'invalid_choice')
+        self.assertEqual(errors[2], {'non_field_errors': ['Token must differ from the device id.']})
+        self.assertEqual(set(errors[3]), {'non_field_errors'})
+        self.assertEqual(errors[4], {})
+        self.assertIs(errors.serializer, serializer)
+
+    def test_payload_errors_keep_their_keys(self):
+        serializer = CheckedDevicesSerializer(data=self.device(), many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(set(serializer.errors), {'non_field_errors'})
+
+    def test_many_uses_atomic_list_serializer(self):
+        self.assertIsInstance(UsersDevicesSerializer(many=True), AtomicListSerializer)
+        self.assertIsInstance(CheckedDevicesSerializer(many=True), AtomicListSerializer)
@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of blacklisted jtis scored by their expiry (epoch seconds)
+BLACKLIST_KEY = 'atomic:token-blacklist'
+# Member scored +inf, present once the set holds every blacklisted token of the database.
+# It lives in the same key, so an evicted or flushed set is never mistaken for a complete one.
+BLACKLIST_COMPLETE_MEMBER = '*'
+BLACKLIST_LOAD_LOCK_KEY = 'atomic:token-blacklist-loading'
+BLACKLIST_LOAD_LOCK_TTL = 60 * 10
+BLACKLIST_LOAD_CHUNK_SIZE = 5000
+
+# Default for settings.ATOMIC_TOKEN_PURGE_BATCH_SIZE
+TOKEN_PURGE_BATCH_SIZE = 5000
+
+
+def get_blacklist_client():
+    # raw redis connection of the default cache, None when the cache is not django_redis
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def blacklist_key():
+    return cache.make_key(BLACKLIST_KEY)
+
+
+def blacklist_contains(jti):
+    """
+    True when the jti may be blacklisted, False when it is certainly not and
+    None when the set cannot tell (no redis, not loaded yet, redis errors).
+    """
+    client = get_blacklist_client()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.zscore(blacklist_key(), jti)
+        pipe.zscore(blacklist_key(), BLACKLIST_COMPLETE_MEMBER)
+        score, complete = pipe.execute()
+    except RedisError as e:
+        logger.warning("token blacklist lookup failed: %s", e)
+        return None
+    if score is not None:
+        return True
+    if complete is None:
+        request_blacklist_load()
+        return None
+    return False
+
+
+def add_to_blacklist(tokens):
+    # tokens: iterable of (jti, expiry epoch seconds)
+    client = get_blacklist_client()
+    if client is None:
+        return
+    mapping = {jti: exp for jti, exp in tokens}
+    if not mapping:
+        return
+    try:
+        client.zadd(blacklist_key(), mapping)
+    except RedisError as e:
+        logger.warning("token blacklist update failed: %s", e)
+        # the set misses this token: no longer complete, lookups go to the database until it is reloaded
+        try:
+            client.zrem(blacklist_key(), BLACKLIST_COMPLETE_MEMBER)
+        except RedisError as e:
+            logger.error("token blacklist left marked complete: %s", e)
+
+
+def load_blacklist():
+    """
+    Adds every unexpired blacklisted token of the database to the set and
+    marks it complete. Entries are only added, tokens blacklisted while the
+    load runs are kept.
+    """
+    client = get_blacklist_client()
+    if client is None:
+        return 0
+    rows = (
+        BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+        .values_list('token__jti', 'token__expires_at')
+        .iterator(chunk_size=BLACKLIST_LOAD_CHUNK_SIZE)
+    )
+    count = 0
+    pipe = client.pipeline(transaction=False)
+    for jti, expires_at in rows:
+        pipe.zadd(blacklist_key(), {jti: expires_at.timestamp()})
+        count += 1
+        if count % BLACKLIST_LOAD_CHUNK_SIZE == 0:
+            pipe.execute()
+    pipe.zremrangebyscore(blacklist_key(), '-inf', timezone.now().timestamp())
+    pipe.zadd(blacklist_key(), {BLACKLIST_COMPLETE_MEMBER: float('inf')})
+    pipe.execute()
+    return count
+
+
+def request_blacklist_load():
+    if not cache.add(BLACKLIST_LOAD_LOCK_KEY, 1, BLACKLIST_LOAD_LOCK_TTL):
+        return
+    from atomicloops.tasks import load_token_blacklist
+    try:
+        load_token_blacklist.delay()
+    except Exception as e:
+        cache.delete(BLACKLIST_LOAD_LOCK_KEY)
+        logger.warning("token blacklist load not scheduled: %s", e)
+
+
+def delete_expired_tokens(batch_size=None):
+    """
+    Deletes expired blacklisted and outstanding tokens, `batch_size` rows per
+    statement and transaction, and drops them from the redis set.
+    """
+    batch_size = batch_size or getattr(settings, 'ATOMIC_TOKEN_PURGE_BATCH_SIZE', TOKEN_PURGE_BATCH_SIZE)
+    now = timezone.now()
+    blacklisted = connection.ops.quote_name(BlacklistedToken._meta.db_table)
+    outstanding = connection.ops.quote_name(OutstandingToken._meta.db_table)
+    statements = (
+        ('blacklisted', """
+            DELETE FROM {blacklisted} WHERE id IN (
+                SELECT b.id FROM {blacklisted} b JOIN {outstanding} o ON o.id = b.token_id
+                WHERE o.expires_at <= %s LIMIT %s
+            )
+        """),
+        ('outstanding', """
+            DELETE FROM {outstanding} WHERE id IN (
+                SELECT o.id FROM {outstanding} o
+                WHERE o.expires_at <= %s AND NOT EXISTS (SELECT 1 FROM {blacklisted} b WHERE b.token_id = o.id)
+                LIMIT %s
+            )
+        """),
+    )
+    deleted = {}
+    for name, sql in statements:
+        deleted[name] = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql.format(blacklisted=blacklisted, outstanding=outstanding), [now, batch_size])
+                count = cursor.rowcount
+            deleted[name] += count
+            if count < batch_size:
+                break
+    client = get_blacklist_client()
+    if client is not None:
+        try:
+            client.zremrangebyscore(blacklist_key(), '-inf', now.timestamp())
+        except RedisError as e:
+            logger.warning("token blacklist purge failed: %s", e)
+    return deleted
+
+
+class AtomicRefreshToken(RefreshToken):
+    """
+    Refresh token whose blacklist check goes to the database only when the
+    redis set reports a possible hit or cannot answer.
+    """
+
+    def check_blacklist(self):
+        if blacklist_contains(self.payload[api_settings.JTI_CLAIM]) is False:
+            return
+        super().check_blacklist()
+
+    def blacklist(self):
+        # added before the database write, a rolled back blacklist only costs a database check
+        add_to_blacklist([(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])])
+        return super().blacklist()
@@ -4,9 +4,30 @@ from rest_framework import status
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from rest_framework.decorators import action
-from users.models import Users
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import transaction
+from users.models import Users, ExportData, ImportData
+from users.serializers import ExportDataSerializer, ImportDataSerializer
 import django
-from atomicloops.tasks import export_data
+import os
+import uuid
+from atomicloops.exporters import EXPORT_FORMATS, get_export_columns, get_export_filters, get_watermark_field
+from atomicloops.importers import IMPORT_ASYNC_SIZE, AtomicImporter, bulk_create_validated, find_existing_indexes, get_delimiter
+from atomicloops.tasks import export_data, import_file
+from utils.iterables import chunked
+
+# Defaults for settings.ATOMIC_BULK_MAX_ITEMS / ATOMIC_BULK_BATCH_SIZE
+BULK_MAX_ITEMS = 5000
+BULK_BATCH_SIZE = 1000
+
+
+def is_valid_uuid(value):
+    try:
+        uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return True
 
 
 # Atomic View
@@ -25,50 +46,138 @@ class AtomicViewSet(ModelViewSet):
     #     if self.request.user_level == 5:
     #         return self.serializer_class.Meta.model.objects.exclude(userId__user_level=0)
     #     return self.serializer_class.Meta.model.objects.exclude(userId__is_active=False).exclude(userId__user_level=0)
+    # Upper bound of list elements accepted by the bulk endpoints and rows per bulk query
+    bulk_max_items = None
+    bulk_batch_size = None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # only the columns of the serializer's list_fields
+            serializer_class = self.get_serializer_class()
+            columns = serializer_class.get_projection_columns('list') if hasattr(serializer_class, 'get_projection_columns') else None
+            if columns:
+                queryset = queryset.only(*columns)
+        return queryset
+
+    def get_bulk_max_items(self):
+        return self.bulk_max_items or getattr(settings, 'ATOMIC_BULK_MAX_ITEMS', BULK_MAX_ITEMS)
+
+    def get_bulk_batch_size(self):
+        return self.bulk_batch_size or getattr(settings, 'ATOMIC_BULK_BATCH_SIZE', BULK_BATCH_SIZE)
+
+    def validate_bulk_request(self, data):
+        if not isinstance(data, list):
+            raise ValidationError('Request body must be a list')
+        if data == []:
+            raise ValidationError('Empty data not permitted')
+        max_items = self.get_bulk_max_items()
+        if len(data) > max_items:
+            raise ValidationError(f'Number of list elements must not be greater than {max_items}')
+
+    def get_bulk_field(self, model, name):
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValidationError(f'Unknown field: {name}')
+
     def validate_data(self, data):
         serializer_class = self.serializer_class or self.get_serializer_class()
-        if serializer_class.Meta.model == Users:
+        model = serializer_class.Meta.model
+        if model == Users:
             for item in data:
                 if "email" not in item:
                     raise serializers.ValidationError(f'This Email field not provided for: {item}')
-                email_check = {"email": item["email"]}
-                if serializer_class.Meta.model.objects.filter(**email_check).exists():
+            taken = set(model.objects.filter(email__in=[item["email"] for item in data]).values_list('email', flat=True))
+            for item in data:
+                if item["email"] in taken:
                     raise serializers.ValidationError(f'This data already exists: {item}')
+                taken.add(item["email"])
         else:
-            for item in data:
-                if serializer_class.Meta.model.objects.filter(**item).exists():
+            for chunk in chunked(data, self.get_bulk_batch_size()):
+                item = self.find_existing_item(model, chunk)
+                if item is not None:
                     raise serializers.ValidationError(f'This data already exists: {item}')
 
+    def find_existing_item(self, model, data):
+        for item in data:
+            for name in item:
+                self.get_bulk_field(model, name)
+        indexes = find_existing_indexes(model, data)
+        return data[indexes[0]] if indexes else None
+
     def validate_ids(self, data, field="id", unique=True):
-        # new_data = []
         serializer_class = self.serializer_class or self.get_serializer_class()
+        model = serializer_class.Meta.model
         for item in data:
             if "id" not in item:
                 raise serializers.ValidationError(f'Id Not provided {item}')
-
-            if not serializer_class.Meta.model.objects.filter(id=item['id']).exists():
+        pk_field = model._meta.pk
+        try:
+            ids = [pk_field.to_python(item["id"]) for item in data]
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        if unique and len(set(ids)) < len(ids):
+            raise serializers.ValidationError('Duplicate ids provided')
+        existing = set()
+        for chunk in chunked(ids, self.get_bulk_batch_size()):
+            existing.update(model.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+        for item, pk in zip(data, ids):
+            if pk not in existing:
                 raise serializers.ValidationError(f'Id does not Exists {item}')
-            else:
-                serializer_class.Meta.model.objects.filter(id=item['id']).update(**item)
         return [x[field] for x in data]
 
+    def bulk_update_items(self, model, data, fields=None):
+        """
+        Applies every item ({"id": ..., field: value}) to its row with one
+        locking fetch and one bulk_update limited to the fields that were sent.
+        `fields` restricts the updatable fields. Returns the updated instances
+        in request order.
+        """
+        ids = self.validate_ids(data)
+        instances = model.objects.select_for_update().in_bulk(ids)
+        touched = set()
+        for item in data:
+            instance = instances[model._meta.pk.to_python(item["id"])]
+            for name, value in item.items():
+                if name == "id":
+                    continue
+                field = self.get_bulk_field(model, name)
+                if fields is not None and name not in fields or not field.concrete or field.primary_key:
+                    raise ValidationError(f'Field can not be updated: {name}')
+                setattr(instance, field.attname, value if field.is_relation else field.to_python(value))
+                touched.add(field.name)
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                for instance in instances.values():
+                    field.pre_save(instance, add=False)
+                touched.add(field.name)
+        if touched:
+            model.objects.bulk_update(instances.values(), touched, batch_size=self.get_bulk_batch_size())
+        return [instances[model._meta.pk.to_python(item["id"])] for item in data]
+
+    def perform_bulk_create(self, serializer):
+        bulk_create_validated(serializer, self.get_bulk_batch_size())
+
+    def bulk_create_items(self, data):
+        serializer_class = self.serializer_class or self.get_serializer_class()
+        with transaction.atomic():
+            self.validate_data(data)
+            serializers = serializer_class(data=data, many=True, context={'request': self.request, 'view': self})
+            if not serializers.is_valid():
+                return Response(serializers.errors, status=status.HTTP_400_BAD_REQUEST)
+            self.perform_bulk_create(serializers)
+        return Response(serializers.data, status=status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['post'], url_path='multiple-update')
     def multiple_update(self, request, *args, **kwargs):
         try:
             serializer_class = self.serializer_class or self.get_serializer_class()
             if not request.user.is_superuser:
                 return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
-            if not isinstance(request.data, list):
-                raise ValidationError('Request body must be a list')
-            if request.data == []:
-                raise ValidationError('Empty data not permitted')
-            if len(request.data) > 100:
-                raise ValidationError('Number of list elements must not be greater than 100')
-            ids = self.validate_ids(request.data)
-            instances = serializer_class.Meta.model.objects.filter(id__in=ids)
-            fields = [f.name for f in serializer_class.Meta.model._meta.concrete_fields]
-            fields.remove('id')
-            _ = serializer_class.Meta.model.objects.bulk_update(instances, fields)
+            self.validate_bulk_request(request.data)
+            with transaction.atomic():
+                instances = self.bulk_update_items(serializer_class.Meta.model, request.data)
             serializer = serializer_class(instances, many=True, partial=True, context={'request': self.request, 'view': self})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
@@ -76,37 +185,21 @@ class AtomicViewSet(ModelViewSet):
 
     @action(detail=False, methods=['post'], url_path='multiple-create')
     def multiple_create(self, request, *args, **kwargs):
-        serializer_class = self.serializer_class or self.get_serializer_class()
         if not request.user.is_superuser:
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
-        if not isinstance(request.data, list):
-            raise ValidationError('Request body must be a list')
-        if request.data == []:
-            raise ValidationError('Empty data not permitted')
-        if len(request.data) > 100:
-            raise ValidationError('Number of list elements must not be greater than 100')
-        # Check data
-        self.validate_data(request.data)
-        serializers = serializer_class(data=request.data, many=True, context={'request': self.request, 'view': self})
-        if serializers.is_valid():
-            serializers.save()
-            return Response(serializers.data, status=status.HTTP_201_CREATED)
-        return Response(serializers.errors, status=status.HTTP_400_BAD_REQUEST)
+        self.validate_bulk_request(request.data)
+        return self.bulk_create_items(request.data)
 
     @action(detail=False, methods=['post'], url_path='multiple-delete')
     def multiple_delete(self, request, *args, **kwargs):
         serializer_class = self.serializer_class or self.get_serializer_class()
         if not request.user.is_superuser:
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
-        if not isinstance(request.data, list):
-            raise ValidationError('Request body must be a list')
-        if request.data == []:
-            raise ValidationError('Empty data not permitted')
-        if len(request.data) > 100:
-            raise ValidationError('Number of list elements must not be greater than 100')
-        ids = self.validate_ids(request.data)
-        instances = serializer_class.Meta.model.objects.filter(id__in=ids)
-        instances.delete()
+        self.validate_bulk_request(request.data)
+        with transaction.atomic():
+            ids = self.validate_ids(request.data)
+            instances = serializer_class.Meta.model.objects.filter(id__in=ids)
+            instances.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def destroy(self, request, *args, **kwargs):
@@ -133,31 +226,47 @@ class AtomicViewSet(ModelViewSet):
             return Response(
                 {"message": "File Not Provided"}, status.HTTP_400_BAD_REQUEST
             )
-
-        # read lines from tsv files
-        data = (line.decode('utf-8').strip().replace('\n', '').split('\\t') for line in file.readlines())
-        headers = data.__next__()
-        qs = []
-        for row in data:
-            _object_dict = {key: value for key, value in zip(headers, row)}
-            qs.append(_object_dict)
-
-        serializer_class = self.serializer_class or self.get_serializer_class()
         if not request.user.is_superuser:
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
-        # if not isinstance(qs, list):
-        #     raise ValidationError('Request body must be a list')
-        if qs == []:
-            raise ValidationError('Empty data not permitted')
-        if len(qs) > 100:
-            raise ValidationError('Number of list elements must not be greater than 100')
-        self.validate_data(qs)
 
-        serializers = serializer_class(data=qs, many=True, context={'request': self.request, 'view': self})
-        if serializers.is_valid():
-            serializers.save()
-            return Response(serializers.data, status=status.HTTP_201_CREATED)
-        return Response(serializers.errors, status=status.HTTP_400_BAD_REQUEST)
+        serializer_class = self.serializer_class or self.get_serializer_class()
+        import_record = ImportData.objects.create(
+            userId=request.user, modelName=serializer_class.Meta.model.__name__, fileName=file.name
+        )
+        delimiter = get_delimiter(file.name)
+
+        # large uploads are imported by a celery worker, the response only carries the import record
+        if file.size > getattr(settings, 'ATOMIC_IMPORT_ASYNC_SIZE', IMPORT_ASYNC_SIZE):
+            path = os.path.join(settings.IMPORT_DIR, f'{import_record.id}{os.path.splitext(file.name)[1]}')
+            with open(path, 'wb') as f:
+                for chunk in file.chunks():
+                    f.write(chunk)
+            import_file.delay(
+                str(import_record.id), f'{serializer_class.__module__}.{serializer_class.__qualname__}', path, delimiter
+            )
+            return Response(ImportDataSerializer(import_record).data, status=status.HTTP_202_ACCEPTED)
+
+        importer = AtomicImporter(
+            serializer_class, context={'request': self.request, 'view': self},
+            chunk_size=self.get_bulk_batch_size(), delimiter=delimiter,
+        )
+        summary = importer.import_file(file)
+        import_record.finish(summary)
+        data = ImportDataSerializer(import_record).data
+        # chunks are committed as they go: any imported row makes the import a (partial) success,
+        # the response carries the imported and failed counts
+        if summary['failedRows'] and not summary['importedRows']:
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path=r'import-data/(?P<import_id>[^/.]+)')
+    def import_status(self, request, import_id=None, *args, **kwargs):
+        import_record = ImportData.objects.filter(id=import_id).first() if is_valid_uuid(import_id) else None
+        if import_record is None:
+            return Response("Import not found", status=status.HTTP_404_NOT_FOUND)
+        if not request.user.is_superuser and import_record.userId_id != request.user.id:
+            return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
+        return Response(ImportDataSerializer(import_record).data, status=status.HTTP_200_OK)
 
     # export data api
     @action(detail=False, methods=['post'], url_path='export-data')
@@ -166,8 +275,32 @@ class AtomicViewSet(ModelViewSet):
             return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
 
         serializer_class = self.serializer_class or self.get_serializer_class()
-        model = serializer_class.Meta.model.__name__
-        app_name = serializer_class.Meta.model._meta.app_label
+        model = serializer_class.Meta.model
+        # optional {"format": "tsv" | "parquet" | "arrow", "columns": [...], "filters": {"field__lookup": value},
+        # "incremental": true} where incremental only exports the rows changed since the last incremental export
+        export_format = request.data.get('format', 'tsv')
+        if export_format not in EXPORT_FORMATS:
+            return Response({"format": [f"Expected one of {', '.join(EXPORT_FORMATS)}"]}, status=status.HTTP_400_BAD_REQUEST)
+        incremental = request.data.get('incremental') in (True, 'true', '1')
+        if incremental and get_watermark_field(model) is None:
+            return Response({"incremental": ["This model does not support incremental exports"]}, status=status.HTTP_400_BAD_REQUEST)
+        export_record = ExportData.objects.create(
+            userId=request.user,
+            modelName=model.__name__,
+            appName=model._meta.app_label,
+            format=export_format,
+            columns=get_export_columns(model, request.data.get('columns')),
+            filters=get_export_filters(model, request.data.get('filters')),
+            incremental=incremental,
+        )
+        export_data.delay(str(export_record.id))
+        return Response(ExportDataSerializer(export_record).data, status=status.HTTP_202_ACCEPTED)
 
-        export_data.delay(model, app_name, userId=request.user.id)
-        return Response('In process!', status=status.HTTP_200_OK)
+    @action(detail=False, methods=['get'], url_path=r'export-data/(?P<export_id>[^/.]+)')
+    def export_status(self, request, export_id=None, *args, **kwargs):
+        export_record = ExportData.objects.filter(id=export_id).first() if is_valid_uuid(export_id) else None
+        if export_record is None:
+            return Response("Export not found", status=status.HTTP_404_NOT_FOUND)
+        if not request.user.is_superuser and export_record.userId_id != request.user.id:
+            return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
+        return Response(ExportDataSerializer(export_record).data, status=status.HTTP_200_OK)
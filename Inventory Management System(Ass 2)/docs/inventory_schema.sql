@@ -23,9 +23,9 @@ CREATE TABLE IF NOT EXISTS warehouses (
     created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     UNIQUE (company_id, name)
 );
-CREATE INDEX IF NOT EXISTS i
-
-dx_warehouses_company ON warehouses(company_id);
+CREATE INDEX IF NOT EXISTS idx_warehouses_company ON warehouses(company_id);
+-- Convenience unique for composite FKs
+CREATE UNIQUE INDEX IF NOT EXISTS ux_warehouses_company_id_id ON warehouses(company_id, id);
 
 CREATE TABLE IF NOT EXISTS products (
     id             BIGSERIAL PRIMARY KEY,
@@ -80,6 +80,8 @@ CREATE TABLE IF NOT EXISTS inventory (
 );
 CREATE INDEX IF NOT EXISTS idx_inventory_company_product ON inventory(company_id, product_id);
 CREATE INDEX IF NOT EXISTS idx_inventory_company_warehouse ON inventory(company_id, warehouse_id);
+-- Watermark range scans of incremental exports
+CREATE INDEX IF NOT EXISTS idx_inventory_updated_at ON inventory(updated_at);
 
 -- Inventory transactions history
 CREATE TABLE IF NOT EXISTS inventory_transactions (
@@ -96,6 +98,7 @@ CREATE TABLE IF NOT EXISTS inventory_transactions (
 );
 CREATE INDEX IF NOT EXISTS idx_tx_company_product_date ON inventory_transactions(company_id, product_id, occurred_at DESC);
 CREATE INDEX IF NOT EXISTS idx_tx_company_warehouse_date ON inventory_transactions(company_id, warehouse_id, occurred_at DESC);
+CREATE INDEX IF NOT EXISTS idx_tx_occurred_at ON inventory_transactions(occurred_at);
 
 -- Sales activity (used for alert logic)
 CREATE TABLE IF NOT EXISTS sales (
@@ -110,6 +113,59 @@ CREATE TABLE IF NOT EXISTS sales (
 );
 CREATE INDEX IF NOT EXISTS idx_sales_company_product_date ON sales(company_id, product_id, sale_date DESC);
 CREATE INDEX IF NOT EXISTS idx_sales_company_warehouse_date ON sales(company_id, warehouse_id, sale_date DESC);
+CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales(sale_date);
+
+-- Daily sales rollup per company/warehouse/product (UTC days), used for windowed sales velocity.
+-- Maintained incrementally by the statement level triggers below and reconciled nightly by
+-- inventory.tasks.reconcile_sales_rollup.
+CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+    id             BIGSERIAL PRIMARY KEY,
+    company_id     BIGINT NOT NULL,
+    warehouse_id   BIGINT NOT NULL,
+    product_id     BIGINT NOT NULL,
+    sale_day       DATE NOT NULL,
+    quantity_sold  BIGINT NOT NULL DEFAULT 0,
+    UNIQUE (company_id, warehouse_id, product_id, sale_day),
+    FOREIGN KEY (company_id, warehouse_id) REFERENCES warehouses(company_id, id) ON DELETE CASCADE,
+    FOREIGN KEY (company_id, product_id) REFERENCES products(company_id, id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_sales_rollup_company_day ON sales_daily_rollup(company_id, sale_day DESC);
+
+CREATE OR REPLACE FUNCTION sales_rollup_apply() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO sales_daily_rollup (company_id, warehouse_id, product_id, sale_day, quantity_sold)
+        SELECT company_id, warehouse_id, product_id, (sale_date AT TIME ZONE 'UTC')::date, -SUM(quantity_sold)
+        FROM old_rows
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (company_id, warehouse_id, product_id, sale_day)
+        DO UPDATE SET quantity_sold = sales_daily_rollup.quantity_sold + EXCLUDED.quantity_sold;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO sales_daily_rollup (company_id, warehouse_id, product_id, sale_day, quantity_sold)
+        SELECT company_id, warehouse_id, product_id, (sale_date AT TIME ZONE 'UTC')::date, SUM(quantity_sold)
+        FROM new_rows
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (company_id, warehouse_id, product_id, sale_day)
+        DO UPDATE SET quantity_sold = sales_daily_rollup.quantity_sold + EXCLUDED.quantity_sold;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables allow a single event per trigger, so each event gets its own statement trigger.
+DROP TRIGGER IF EXISTS trg_sales_rollup_insert ON sales;
+CREATE TRIGGER trg_sales_rollup_insert AFTER INSERT ON sales
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_apply();
+DROP TRIGGER IF EXISTS trg_sales_rollup_update ON sales;
+CREATE TRIGGER trg_sales_rollup_update AFTER UPDATE ON sales
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_apply();
+DROP TRIGGER IF EXISTS trg_sales_rollup_delete ON sales;
+CREATE TRIGGER trg_sales_rollup_delete AFTER DELETE ON sales
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_apply();
 
 -- Optional: ensure bundles are flagged correctly (not enforced via constraint, but recommended)
 -- Application should set products.is_bundle = TRUE for bundle_product_id rows present in bundle_components.
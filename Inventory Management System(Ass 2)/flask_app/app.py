@@ -1,5 +1,5 @@
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
 from flask import Flask, jsonify
@@ -100,6 +100,37 @@ class Sale(db.Model):
     sale_date = db.Column(db.DateTime, nullable=False)
 
 
+# Daily (UTC) sales buckets maintained by the sales triggers in docs/inventory_schema.sql
+class SaleDailyRollup(db.Model):
+    __tablename__ = "sales_daily_rollup"
+    id = db.Column(db.BigInteger, primary_key=True)
+    company_id = db.Column(db.BigInteger, nullable=False)
+    warehouse_id = db.Column(db.BigInteger, nullable=False)
+    product_id = db.Column(db.BigInteger, nullable=False)
+    sale_day = db.Column(db.Date, nullable=False)
+    quantity_sold = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+def windowed_sales_totals(company_id, window_start):
+    # Whole days from the rollup, only the partial first day of the window from sales
+    boundary_day = window_start.date()
+    boundary_end = datetime.combine(boundary_day + timedelta(days=1), time.min)
+    totals = {}
+    queries = (
+        db.session.query(SaleDailyRollup.product_id, SaleDailyRollup.warehouse_id, db.func.sum(SaleDailyRollup.quantity_sold))
+        .filter(SaleDailyRollup.company_id == company_id, SaleDailyRollup.sale_day > boundary_day)
+        .group_by(SaleDailyRollup.product_id, SaleDailyRollup.warehouse_id),
+        db.session.query(Sale.product_id, Sale.warehouse_id, db.func.sum(Sale.quantity_sold))
+        .filter(Sale.company_id == company_id, Sale.sale_date >= window_start, Sale.sale_date < boundary_end)
+        .group_by(Sale.product_id, Sale.warehouse_id),
+    )
+    for query in queries:
+        for product_id, warehouse_id, total in query.all():
+            key = (product_id, warehouse_id)
+            totals[key] = totals.get(key, 0) + int(total or 0)
+    return totals
+
+
 def seed_demo_data():
     # Seed only if using sqlite memory DB
     if not db_url.startswith("sqlite"):
@@ -119,10 +150,12 @@ def seed_demo_data():
     db.session.add(Inventory(company_id=1, warehouse_id=1, product_id=102, quantity_on_hand=0))
     db.session.commit()
 
-    # Sales in last 30 days
+    # Sales in last 30 days (sqlite has no rollup trigger, so buckets are written alongside)
     now_dt = datetime.utcnow()
     for d in range(1, 6):
-        db.session.add(Sale(company_id=1, warehouse_id=1, product_id=101, quantity_sold=2, sale_date=now_dt - timedelta(days=d)))
+        sale_date = now_dt - timedelta(days=d)
+        db.session.add(Sale(company_id=1, warehouse_id=1, product_id=101, quantity_sold=2, sale_date=sale_date))
+        db.session.add(SaleDailyRollup(company_id=1, warehouse_id=1, product_id=101, sale_day=sale_date.date(), quantity_sold=2))
     db.session.commit()
 
 
@@ -142,13 +175,7 @@ def low_stock_alerts(company_id: int):
         return jsonify({"detail": "Company not found"}), 404
 
     # Recent sales totals per product+warehouse
-    rs = (
-        db.session.query(Sale.product_id, Sale.warehouse_id, db.func.sum(Sale.quantity_sold).label("total_sold"))
-        .filter(Sale.company_id == company_id, Sale.sale_date >= window_start)
-        .group_by(Sale.product_id, Sale.warehouse_id)
-        .all()
-    )
-    sales_map = {(r.product_id, r.warehouse_id): int(r.total_sold or 0) for r in rs}
+    sales_map = windowed_sales_totals(company_id, window_start)
 
     alerts = []
 
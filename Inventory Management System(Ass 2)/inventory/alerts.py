@@ -0,0 +1,247 @@
+import heapq
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import F
+from django.utils.timezone import now
+
+from utils.iterables import chunked
+
+from .bundles import BundleResolver
+from .models import Inventory, Product, ProductSupplier, Warehouse
+from .sales import windowed_sales_subquery, windowed_sales_totals
+
+
+EMPTY_SUPPLIER = {"id": None, "name": None, "contact_email": None}
+
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_CHUNK_SIZE = 2000
+
+
+def alert_sort_key(alert):
+    return (alert["warehouse_id"], alert["product_id"])
+
+
+def days_until_stockout(current_stock, total_sold, window_days):
+    # Kept in Decimal so the integer result matches the original per-row computation
+    avg_daily = Decimal(total_sold) / Decimal(window_days)
+    return int(Decimal(current_stock) / avg_daily) if avg_daily > 0 else None
+
+
+def days_until_stockout_array(current_stock, total_sold, window_days):
+    """
+    days_until_stockout over int64 arrays (current_stock >= 0), -1 where nothing
+    was sold. Integer division gives the Decimal result except when it is exact:
+    the Decimal quotient can then round just below, those rows use the Decimal
+    computation itself.
+    """
+    days = np.full(len(current_stock), -1, dtype=np.int64)
+    sold = np.flatnonzero(total_sold > 0)
+    numerator = current_stock[sold] * window_days
+    quotient, remainder = np.divmod(numerator, total_sold[sold])
+    days[sold] = quotient
+    for index in sold[(remainder == 0) & (numerator != 0)].tolist():
+        days[index] = days_until_stockout(int(current_stock[index]), int(total_sold[index]), window_days)
+    return days
+
+
+def build_alert(product, warehouse, current_stock, threshold, days):
+    return {
+        "product_id": product["id"],
+        "product_name": product["name"],
+        "sku": product["sku"],
+        "warehouse_id": warehouse["id"],
+        "warehouse_name": warehouse["name"],
+        "current_stock": int(current_stock),
+        "threshold": int(threshold),
+        "days_until_stockout": days if days >= 0 else None,
+        "supplier": product["supplier"],
+    }
+
+
+class LowStockAlertEngine:
+    """
+    Set based low-stock alert computation for a single company.
+
+    Every step (windowed sales, threshold comparison, supplier resolution and
+    bundle stock) is one aggregated/joined query, so the number of queries does
+    not depend on the number of products, warehouses or bundles. Windowed sales
+    are read from the sales_daily_rollup buckets (see inventory.sales).
+    """
+
+    def __init__(self, company_id, window_days, warehouse_ids=None, window_start=None):
+        self.company_id = company_id
+        self.window_days = window_days
+        # a partition of the company's warehouses (see inventory.batch), None for all of them
+        self.warehouse_ids = None if warehouse_ids is None else list(warehouse_ids)
+        self.window_start = window_start or now() - timedelta(days=window_days)
+
+    def warehouses(self):
+        queryset = Warehouse.objects.filter(company_id=self.company_id, active=True)
+        if self.warehouse_ids is not None:
+            queryset = queryset.filter(id__in=self.warehouse_ids)
+        return queryset
+
+    def total_sold_subquery(self):
+        return windowed_sales_subquery(self.company_id, self.window_start)
+
+    # Inventory rows below threshold with sales in the window (query 1)
+    def product_rows(self):
+        queryset = Inventory.objects.all()
+        if self.warehouse_ids is not None:
+            queryset = queryset.filter(warehouse_id__in=self.warehouse_ids)
+        return (
+            queryset
+            .filter(
+                company_id=self.company_id,
+                product__company_id=self.company_id,
+                warehouse__company_id=self.company_id,
+                product__active=True,
+                warehouse__active=True,
+                quantity_on_hand__lt=F("product__threshold"),
+            )
+            .annotate(total_sold=self.total_sold_subquery())
+            .filter(total_sold__gt=0)
+            .values(
+                "quantity_on_hand",
+                "total_sold",
+                "product_id",
+                "product__name",
+                "product__sku",
+                "product__threshold",
+                "product__supplier__id",
+                "product__supplier__name",
+                "product__supplier__contact_email",
+                "warehouse_id",
+                "warehouse__name",
+            )
+        )
+
+    def product_alerts(self, rows=None):
+        # every row already alerts (filtered in SQL), stockout days computed for all of them at once
+        rows = list(self.product_rows() if rows is None else rows)
+        days = days_until_stockout_array(
+            np.fromiter((row["quantity_on_hand"] for row in rows), np.int64, len(rows)),
+            np.fromiter((row["total_sold"] for row in rows), np.int64, len(rows)),
+            self.window_days,
+        )
+        alerts = []
+        for row, row_days in zip(rows, days.tolist()):
+            product = {
+                "id": row["product_id"],
+                "name": row["product__name"],
+                "sku": row["product__sku"],
+                "supplier": self.supplier_from_row(row, "product__supplier__"),
+            }
+            warehouse = {"id": row["warehouse_id"], "name": row["warehouse__name"]}
+            alerts.append(build_alert(product, warehouse, row["quantity_on_hand"], row["product__threshold"], row_days))
+        return alerts
+
+    # Bundles: products, warehouses, buildable stock and sales (bundle graph is cached, see inventory.bundles)
+    def bundle_products(self):
+        return Product.objects.filter(company_id=self.company_id, is_bundle=True, active=True)
+
+    def bundle_alerts(self):
+        resolver = BundleResolver(self.company_id)
+        bundles = {
+            row["id"]: {
+                "id": row["id"],
+                "name": row["name"],
+                "sku": row["sku"],
+                "threshold": row["threshold"],
+                "supplier": self.supplier_from_row(row, "supplier__"),
+            }
+            for row in self.bundle_products().values(
+                "id", "name", "sku", "threshold", "supplier__id", "supplier__name", "supplier__contact_email"
+            )
+            if row["id"] in resolver.graph.components
+        }
+        if not bundles:
+            return []
+
+        warehouses = {
+            row["id"]: row
+            for row in self.warehouses().values("id", "name")
+        }
+        if not warehouses:
+            return []
+        columns = {warehouse_id: index for index, warehouse_id in enumerate(warehouses)}
+        rows, buildable = resolver.buildable_matrix(columns.keys())
+        bundle_sales = windowed_sales_totals(
+            self.company_id, self.window_start,
+            product_id__in=bundles.keys(), warehouse_id__in=warehouses.keys(),
+        )
+        if not bundle_sales:
+            return []
+
+        # one entry per (bundle, warehouse) with sales, masked down to the alerting pairs
+        keys = list(bundle_sales)
+        count = len(keys)
+        total_sold = np.fromiter(bundle_sales.values(), np.int64, count)
+        bundle_stock = buildable[
+            np.fromiter((rows[bundle_id] for bundle_id, _ in keys), np.intp, count),
+            np.fromiter((columns[warehouse_id] for _, warehouse_id in keys), np.intp, count),
+        ]
+        threshold = np.fromiter((bundles[bundle_id]["threshold"] for bundle_id, _ in keys), np.int64, count)
+        alerting = np.flatnonzero((total_sold > 0) & (bundle_stock < threshold))
+        days = days_until_stockout_array(bundle_stock[alerting], total_sold[alerting], self.window_days)
+
+        alerts = []
+        for index, bundle_days in zip(alerting.tolist(), days.tolist()):
+            bundle_id, warehouse_id = keys[index]
+            bundle = bundles[bundle_id]
+            alerts.append(build_alert(
+                bundle, warehouses[warehouse_id], bundle_stock[index], bundle["threshold"], bundle_days,
+            ))
+        return alerts
+
+    # Supplier resolution: direct supplier from the join, ProductSupplier fallback in one query
+    @staticmethod
+    def supplier_from_row(row, prefix):
+        if row[prefix + "id"] is None:
+            return None
+        return {
+            "id": row[prefix + "id"],
+            "name": row[prefix + "name"],
+            "contact_email": row[prefix + "contact_email"],
+        }
+
+    def resolve_fallback_suppliers(self, alerts):
+        missing = {alert["product_id"] for alert in alerts if alert["supplier"] is None}
+        fallback = {}
+        if missing:
+            for row in (
+                ProductSupplier.objects
+                .filter(product_id__in=missing)
+                .order_by("product_id", "supplier_id")
+                .values("product_id", "supplier__id", "supplier__name", "supplier__contact_email")
+            ):
+                if row["product_id"] not in fallback:
+                    fallback[row["product_id"]] = self.supplier_from_row(row, "supplier__")
+        for alert in alerts:
+            if alert["supplier"] is None:
+                alert["supplier"] = dict(fallback.get(alert["product_id"]) or EMPTY_SUPPLIER)
+        return alerts
+
+    def alerts(self):
+        alerts = self.product_alerts() + self.bundle_alerts()
+        self.resolve_fallback_suppliers(alerts)
+        alerts.sort(key=alert_sort_key)
+        return alerts
+
+    def iter_product_alerts(self, chunk_size):
+        # Server-side cursor, already in (warehouse_id, product_id) order; suppliers resolved per chunk
+        rows = self.product_rows().order_by("warehouse_id", "product_id").iterator(chunk_size=chunk_size)
+        for chunk in chunked(rows, chunk_size):
+            yield from self.resolve_fallback_suppliers(self.product_alerts(chunk))
+
+    def iter_alerts(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Yields the same alerts as alerts(), in the same order, without holding
+        the product alerts in memory. Bundle alerts (one per bundle/warehouse
+        pair at most) are computed on the first iteration and merged into the stream.
+        """
+        bundle_alerts = self.resolve_fallback_suppliers(self.bundle_alerts())
+        bundle_alerts.sort(key=alert_sort_key)
+        yield from heapq.merge(self.iter_product_alerts(chunk_size), bundle_alerts, key=alert_sort_key)
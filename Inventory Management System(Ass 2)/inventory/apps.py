@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "inventory"
-    verbose_name = "Inventory"
\ No newline at end of file
+    verbose_name = "Inventory"
+
+    def ready(self):
+        from . import signals  # noqa: F401
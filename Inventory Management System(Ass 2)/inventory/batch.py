@@ -0,0 +1,171 @@
+import heapq
+import logging
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import repeat
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from .alerts import LowStockAlertEngine, alert_sort_key
+from .cache import alerts_cache_ttl, alerts_version, serialize_alerts, store_alerts
+from .models import Warehouse
+
+logger = logging.getLogger(__name__)
+
+# Partitions per process: warehouses differ in size, smaller partitions keep every process busy
+PARTITIONS_PER_WORKER = 4
+# Default partitions of a batch fanned out to the celery workers
+BATCH_PARTITIONS = 16
+
+BATCH_PARTITION_KEY = "inventory:alerts-batch:{batch_id}:{index}"
+BATCH_DONE_KEY = "inventory:alerts-batch:{batch_id}:done"
+
+
+def get_counter_client():
+    # raw redis connection of the default cache, None when the cache is not django_redis
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def increment_done(done_key, ttl):
+    """
+    Counts a finished partition and returns the count. On redis, INCR creates
+    the key and EXPIRE sets its lifetime in one MULTI/EXEC transaction.
+    """
+    client = get_counter_client()
+    if client is None:
+        cache.add(done_key, 0, ttl)
+        return cache.incr(done_key)
+    pipe = client.pipeline(transaction=True)
+    pipe.incr(cache.make_key(done_key))
+    pipe.expire(cache.make_key(done_key), ttl)
+    count, _ = pipe.execute()
+    return count
+
+
+def batch_workers():
+    return getattr(settings, "LOW_STOCK_ALERTS_BATCH_WORKERS", None) or os.cpu_count() or 1
+
+
+def batch_partitions():
+    return getattr(settings, "LOW_STOCK_ALERTS_BATCH_PARTITIONS", BATCH_PARTITIONS)
+
+
+def partition_warehouses(company_id, partitions):
+    """
+    Splits the company's active warehouses into at most `partitions` sorted
+    lists of ids, balanced on their number of inventory rows.
+    """
+    sizes = (
+        Warehouse.objects
+        .filter(company_id=company_id, active=True)
+        .annotate(rows=Count("inventory"))
+        .order_by("-rows", "id")
+        .values_list("id", "rows")
+    )
+    # largest warehouses first, each to the lightest partition so far
+    heap = [(0, index, []) for index in range(max(partitions, 1))]
+    for warehouse_id, rows in sizes:
+        total, index, warehouse_ids = heapq.heappop(heap)
+        warehouse_ids.append(warehouse_id)
+        heapq.heappush(heap, (total + rows, index, warehouse_ids))
+    return [sorted(warehouse_ids) for _, _, warehouse_ids in sorted(heap, key=lambda part: part[1]) if warehouse_ids]
+
+
+def compute_partition(company_id, days, window_start, warehouse_ids):
+    # alerts of a partition, already in (warehouse_id, product_id) order
+    engine = LowStockAlertEngine(company_id, days, warehouse_ids=warehouse_ids, window_start=window_start)
+    return engine.alerts()
+
+
+def merge_partitions(partitions):
+    # warehouses never span two partitions, so the merge gives the order of LowStockAlertEngine.alerts()
+    return list(heapq.merge(*partitions, key=alert_sort_key))
+
+
+def init_worker():
+    # spawned children start without the app registry
+    django.setup()
+
+
+def run_alerts_batch(company_id, days, workers=None, partitions=None):
+    """
+    Computes a company's alerts over a process pool, one warehouse partition
+    per task, each process querying over its own database connection. The
+    merged result primes the alert cache (inventory.cache).
+    Returns (response data, number of partitions).
+    """
+    workers = workers or batch_workers()
+    version = alerts_version(company_id)
+    window_start = now() - timedelta(days=days)
+    parts = partition_warehouses(company_id, partitions or workers * PARTITIONS_PER_WORKER)
+    if workers > 1 and len(parts) > 1:
+        # forked children would otherwise share the parent's connection sockets
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=min(workers, len(parts)), initializer=init_worker) as pool:
+            results = list(pool.map(compute_partition, repeat(company_id), repeat(days), repeat(window_start), parts))
+    else:
+        results = [compute_partition(company_id, days, window_start, warehouse_ids) for warehouse_ids in parts]
+    data = serialize_alerts(merge_partitions(results))
+    store_alerts(company_id, days, version, data)
+    return data, len(parts)
+
+
+def dispatch_alerts_batch(company_id, days, partitions=None):
+    """
+    Fans a company's alerts out to the celery workers, one
+    low_stock_alerts_partition task per warehouse partition. Partitions are
+    collected in the cache, the last one to finish merges them and primes the
+    alert cache. Returns the batch description the tasks receive.
+    """
+    from .tasks import low_stock_alerts_partition
+
+    parts = partition_warehouses(company_id, partitions or batch_partitions())
+    batch = {
+        "id": uuid.uuid4().hex,
+        "company_id": company_id,
+        "days": days,
+        "version": alerts_version(company_id),
+        "window_start": (now() - timedelta(days=days)).isoformat(),
+        "partitions": len(parts),
+    }
+    if not parts:
+        store_alerts(company_id, days, batch["version"], serialize_alerts([]))
+    for index, warehouse_ids in enumerate(parts):
+        low_stock_alerts_partition.delay(batch, index, warehouse_ids)
+    return batch
+
+
+def run_batch_partition(batch, index, warehouse_ids):
+    """
+    Computes one partition of a dispatched batch and stores it; returns the
+    merged response data when this was the last partition, None otherwise.
+    """
+    alerts = compute_partition(batch["company_id"], batch["days"], parse_datetime(batch["window_start"]), warehouse_ids)
+    ttl = alerts_cache_ttl()
+    cache.set(BATCH_PARTITION_KEY.format(batch_id=batch["id"], index=index), alerts, ttl)
+    done_key = BATCH_DONE_KEY.format(batch_id=batch["id"])
+    if increment_done(done_key, ttl) < batch["partitions"]:
+        return None
+
+    keys = [BATCH_PARTITION_KEY.format(batch_id=batch["id"], index=part) for part in range(batch["partitions"])]
+    stored = cache.get_many(keys)
+    cache.delete_many(keys + [done_key])
+    if len(stored) < len(keys):
+        # evicted meanwhile, the cache is left to the regular refresh
+        logger.warning("alerts batch %s lost %d partitions", batch["id"], len(keys) - len(stored))
+        return None
+    data = serialize_alerts(merge_partitions(stored[key] for key in keys))
+    store_alerts(batch["company_id"], batch["days"], batch["version"], data)
+    return data
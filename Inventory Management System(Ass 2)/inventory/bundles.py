@@ -0,0 +1,220 @@
+from collections import deque
+from decimal import Decimal
+from fractions import Fraction
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import BundleComponent, Inventory
+
+
+# v2: graphs carry their flattened requirements, entries cached before are not read
+BUNDLE_GRAPH_CACHE_KEY = "inventory:bundle-graph:v2:{company_id}"
+
+
+def bundle_graph_cache_key(company_id):
+    return BUNDLE_GRAPH_CACHE_KEY.format(company_id=company_id)
+
+
+def invalidate_bundle_graph(company_id):
+    cache.delete(bundle_graph_cache_key(company_id))
+
+
+def divide_down(available, quantity):
+    # int(Decimal(a) / quantity) for every a >= 0 of an int64 array, exact for any Decimal or Fraction quantity
+    ratio = Fraction(quantity)
+    return available * ratio.denominator // ratio.numerator
+
+
+class BundleGraph:
+    """
+    Bill of materials of one company: {bundle_id: [(component_id, quantity_per_bundle)]}
+    with the bundles in topological order (a bundle always comes after the bundles it contains).
+    Bundles that take part in a cycle cannot be ordered and are appended at the end.
+
+    Every bundle is also flattened into `requirements`, {product_id: Fraction}
+    of the non-bundle products one unit uses through all its sub-bundles, and
+    `nested`, its sub-bundles with the outermost first. Bundles of a cycle are
+    never expanded, they only count as their on-hand stock.
+    """
+
+    def __init__(self, components):
+        self.components = components
+        self.order, self.cyclic = self.topological_order(components)
+        self.component_ids = {
+            component_id for items in components.values() for component_id, _ in items
+        }
+        self.requirements, self.nested = self.flatten()
+
+    def expands(self, product_id):
+        return product_id in self.components and product_id not in self.cyclic
+
+    def flatten(self):
+        # quantities multiplied along every path, sub-bundles come first in the topological order
+        requirements, nested = {}, {}
+        position = {bundle_id: index for index, bundle_id in enumerate(self.order)}
+        for bundle_id in self.order:
+            totals, inner = {}, set()
+            for component_id, quantity in self.components[bundle_id]:
+                if self.expands(component_id):
+                    inner.add(component_id)
+                    inner.update(nested[component_id])
+                    parts = requirements[component_id].items()
+                else:
+                    parts = [(component_id, 1)]
+                for product_id, per_unit in parts:
+                    totals[product_id] = totals.get(product_id, 0) + Fraction(quantity) * per_unit
+            requirements[bundle_id] = totals
+            nested[bundle_id] = sorted(inner, key=position.get, reverse=True)
+        return requirements, nested
+
+    def can_build(self, bundle_id, count, stock):
+        """
+        True when `count` units of the bundle can be built from `stock`
+        ({product_id: quantity} of one warehouse). Sub-bundles are taken from
+        their stock first and only the shortfall is built from their components.
+        """
+        needed = {bundle_id: Fraction(count)}
+        for node_id in [bundle_id] + self.nested[bundle_id]:
+            required = needed.pop(node_id, 0)
+            build = required if node_id == bundle_id else max(required - stock.get(node_id, 0), 0)
+            if not build:
+                continue
+            for component_id, quantity in self.components[node_id]:
+                needed[component_id] = needed.get(component_id, 0) + build * Fraction(quantity)
+        return all(required <= stock.get(product_id, 0) for product_id, required in needed.items())
+
+    @classmethod
+    def load(cls, company_id):
+        components = {}
+        for bundle_id, component_id, quantity in (
+            BundleComponent.objects
+            .filter(company_id=company_id)
+            .order_by("bundle_product_id", "component_product_id")
+            .values_list("bundle_product_id", "component_product_id", "quantity_per_bundle")
+        ):
+            components.setdefault(bundle_id, []).append((component_id, Decimal(quantity)))
+        return cls(components)
+
+    @staticmethod
+    def topological_order(components):
+        # Kahn's algorithm over bundle -> sub-bundle edges
+        pending = {
+            bundle_id: {component_id for component_id, _ in items if component_id in components}
+            for bundle_id, items in components.items()
+        }
+        parents = {}
+        for bundle_id, children in pending.items():
+            for child_id in children:
+                parents.setdefault(child_id, []).append(bundle_id)
+
+        ready = deque(sorted(bundle_id for bundle_id, children in pending.items() if not children))
+        order = []
+        while ready:
+            bundle_id = ready.popleft()
+            order.append(bundle_id)
+            for parent_id in parents.get(bundle_id, ()):
+                pending[parent_id].discard(bundle_id)
+                if not pending[parent_id]:
+                    ready.append(parent_id)
+
+        resolved = set(order)
+        cyclic = sorted(bundle_id for bundle_id in components if bundle_id not in resolved)
+        return order + cyclic, set(cyclic)
+
+
+class BundleResolver:
+    """
+    Buildable bundle quantities for every (bundle, warehouse) pair of a company.
+
+    The bundle graph is loaded once and cached (invalidated by inventory.signals
+    when bundle_components change); stock is read with one inventory query and
+    bundles are resolved column-wise over all warehouses from their flattened
+    requirements. A product shared by a bundle and its sub-bundles is counted
+    once per use. In the warehouses where sub-bundles are in stock, that stock
+    is used first and the count is searched with BundleGraph.can_build.
+    """
+
+    def __init__(self, company_id):
+        self.company_id = company_id
+        self._graph = None
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            key = bundle_graph_cache_key(self.company_id)
+            graph = cache.get(key)
+            if graph is None:
+                graph = BundleGraph.load(self.company_id)
+                cache.set(key, graph, getattr(settings, "CACHE_TTL", 60 * 5))
+            self._graph = graph
+        return self._graph
+
+    def stock_matrix(self, warehouse_ids):
+        # {product_id: quantity_on_hand per warehouse column (int64 array)} for every product used as a component
+        columns = {warehouse_id: index for index, warehouse_id in enumerate(warehouse_ids)}
+        matrix = {}
+        if not columns or not self.graph.component_ids:
+            return matrix
+        for warehouse_id, product_id, quantity in (
+            Inventory.objects
+            .filter(
+                company_id=self.company_id,
+                warehouse_id__in=columns.keys(),
+                product_id__in=self.graph.component_ids,
+            )
+            .values_list("warehouse_id", "product_id", "quantity_on_hand")
+        ):
+            if product_id not in matrix:
+                matrix[product_id] = np.zeros(len(columns), dtype=np.int64)
+            matrix[product_id][columns[warehouse_id]] = quantity
+        return matrix
+
+    def buildable_matrix(self, warehouse_ids):
+        """
+        Returns (rows, matrix): matrix[rows[bundle_id]] is the buildable quantity
+        of the bundle per warehouse, aligned with warehouse_ids. Each bundle is
+        resolved for all warehouses at once with array operations.
+        """
+        warehouse_ids = list(warehouse_ids)
+        width = len(warehouse_ids)
+        zeros = np.zeros(width, dtype=np.int64)
+        on_hand = self.stock_matrix(warehouse_ids)
+        rows = {bundle_id: index for index, bundle_id in enumerate(self.graph.order)}
+        matrix = np.zeros((len(rows), width), dtype=np.int64)
+        for bundle_id in self.graph.order:
+            # exact while no sub-bundle is in stock: every unit is built from the non-bundle products
+            limit = None
+            for product_id, quantity in self.graph.requirements[bundle_id].items():
+                built = divide_down(on_hand.get(product_id, zeros), quantity)
+                limit = built if limit is None else np.minimum(limit, built)
+            nested = self.graph.nested[bundle_id]
+            if nested:
+                stocked = np.flatnonzero(np.any([on_hand.get(sub_id, zeros) > 0 for sub_id in nested], axis=0))
+                for column in stocked.tolist():
+                    limit[column] = self.search_buildable(bundle_id, on_hand, column, int(limit[column]))
+            matrix[rows[bundle_id]] = limit
+        return rows, matrix
+
+    def search_buildable(self, bundle_id, on_hand, column, low):
+        # `low` units can be built without the sub-bundle stock: grow, then bisect with can_build
+        products = [*self.graph.nested[bundle_id], *self.graph.requirements[bundle_id]]
+        stock = {product_id: int(on_hand[product_id][column]) for product_id in products if product_id in on_hand}
+        high = low + 1
+        while self.graph.can_build(bundle_id, high, stock):
+            low, high = high, high * 2
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.graph.can_build(bundle_id, middle, stock):
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def buildable(self, warehouse_ids):
+        """
+        Returns {bundle_id: [buildable quantity per warehouse]} aligned with warehouse_ids.
+        """
+        rows, matrix = self.buildable_matrix(warehouse_ids)
+        return {bundle_id: matrix[row].tolist() for bundle_id, row in rows.items()}
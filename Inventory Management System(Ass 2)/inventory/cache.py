@@ -0,0 +1,137 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from kombu.exceptions import OperationalError
+
+from .alerts import LowStockAlertEngine
+from .serializers import LowStockAlertsResponseSerializer
+
+
+ALERTS_VERSION_KEY = "inventory:alerts-version:{company_id}"
+ALERTS_CACHE_KEY = "inventory:low-stock-alerts:{company_id}:{days}"
+ALERTS_LOCK_KEY = "inventory:low-stock-alerts-lock:{company_id}:{days}"
+
+# Entries outlive their version so stale results can be served while a refresh runs;
+# the TTL also bounds staleness for writes that bypass the ORM signals.
+ALERTS_CACHE_TTL = 60 * 60
+ALERTS_LOCK_TTL = 60
+# How long a cold request waits for another worker's computation before doing its own;
+# kept short, the request holds a gunicorn worker while it sleeps
+ALERTS_WAIT_TIMEOUT = 0.5
+ALERTS_WAIT_INTERVAL = 0.05
+
+# Product columns that feed the alert payload
+ALERT_PRODUCT_FIELDS = {"supplier", "supplier_id", "sku", "name", "is_bundle", "threshold", "active"}
+
+HIT, STALE, MISS = "HIT", "STALE", "MISS"
+
+
+def alerts_cache_ttl():
+    return getattr(settings, "LOW_STOCK_ALERTS_CACHE_TTL", ALERTS_CACHE_TTL)
+
+
+def alerts_version(company_id):
+    key = ALERTS_VERSION_KEY.format(company_id=company_id)
+    version = cache.get(key)
+    if version is None:
+        # Seeded with a timestamp so an evicted version never matches an older entry
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_alerts(company_id):
+    key = ALERTS_VERSION_KEY.format(company_id=company_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def serialize_alerts(alerts):
+    ser = LowStockAlertsResponseSerializer(data={"alerts": alerts, "total_alerts": len(alerts)})
+    ser.is_valid(raise_exception=True)
+    return dict(ser.data)
+
+
+def compute_alerts(company_id, days):
+    return serialize_alerts(LowStockAlertEngine(company_id, days).alerts())
+
+
+def store_alerts(company_id, days, version, data):
+    # version must be read before the computation, a write that lands meanwhile leaves the entry stale
+    cache.set(
+        ALERTS_CACHE_KEY.format(company_id=company_id, days=days),
+        {"version": version, "data": data},
+        alerts_cache_ttl(),
+    )
+
+
+def refresh_alerts(company_id, days):
+    """
+    Computes the alerts and stores them with the version read before the
+    computation, so a write that lands meanwhile leaves the entry stale.
+    """
+    version = alerts_version(company_id)
+    data = compute_alerts(company_id, days)
+    store_alerts(company_id, days, version, data)
+    return data
+
+
+def release_refresh_lock(company_id, days):
+    cache.delete(ALERTS_LOCK_KEY.format(company_id=company_id, days=days))
+
+
+def acquire_refresh_lock(company_id, days):
+    return cache.add(ALERTS_LOCK_KEY.format(company_id=company_id, days=days), 1, ALERTS_LOCK_TTL)
+
+
+def schedule_refresh(company_id, days):
+    from .tasks import refresh_low_stock_alerts
+
+    if not acquire_refresh_lock(company_id, days):
+        return
+    try:
+        refresh_low_stock_alerts.delay(company_id, days)
+    except OperationalError:
+        # broker unavailable, let the next poller retry
+        release_refresh_lock(company_id, days)
+
+
+def wait_for_entry(key):
+    deadline = time.monotonic() + ALERTS_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(ALERTS_WAIT_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def get_low_stock_alerts(company_id, days):
+    """
+    Stale-while-revalidate lookup of a company's alerts for a window.
+
+    Returns (data, state) where state is HIT (current), STALE (served while one
+    background task recomputes) or MISS (computed by this request, or by the
+    concurrent request holding the lock).
+    """
+    key = ALERTS_CACHE_KEY.format(company_id=company_id, days=days)
+    entry = cache.get(key)
+    if entry is not None:
+        if entry["version"] == alerts_version(company_id):
+            return entry["data"], HIT
+        schedule_refresh(company_id, days)
+        return entry["data"], STALE
+
+    if acquire_refresh_lock(company_id, days):
+        try:
+            return refresh_alerts(company_id, days), MISS
+        finally:
+            release_refresh_lock(company_id, days)
+
+    entry = wait_for_entry(key)
+    if entry is not None:
+        return entry["data"], MISS
+    return refresh_alerts(company_id, days), MISS
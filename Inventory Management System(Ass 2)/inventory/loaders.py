@@ -0,0 +1,365 @@
+import csv
+import tempfile
+
+from django.conf import settings
+from django.db import DataError, connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from atomicloops.importers import IMPORT_MAX_ERRORS
+from .cache import invalidate_alerts
+from .models import Inventory, InventoryTransaction, Sale
+
+
+# Same values as the CHECK constraint on inventory_transactions.change_type
+CHANGE_TYPES = ("sale", "restock", "adjustment", "transfer_in", "transfer_out", "bundle_assembly", "bundle_disassembly")
+
+# Value checks for servers without pg_input_is_valid (PostgreSQL < 16)
+INTEGER_PATTERNS = {
+    "integer": r"^\s*[+-]?\d{1,9}\s*$",
+    "bigint": r"^\s*[+-]?\d{1,18}\s*$",
+}
+
+# Bytes of a re-staged file (see CopyLoader.restage) kept in memory before spilling to disk
+RESTAGE_MEMORY_SIZE = 8 * 1024 * 1024
+
+TIMESTAMPTZ_CHECK_SQL = """
+    CREATE OR REPLACE FUNCTION pg_temp.is_timestamptz(value TEXT) RETURNS BOOLEAN AS $$
+    BEGIN
+        PERFORM value::timestamptz;
+        RETURN TRUE;
+    EXCEPTION WHEN others THEN
+        RETURN FALSE;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+
+def read_lines(file, invalid):
+    # text lines of a binary or text file; lines that are not UTF-8 are decoded with
+    # replacement characters and flagged in `invalid`
+    while True:
+        line = file.readline()
+        if not line:
+            return
+        if isinstance(line, bytes):
+            try:
+                line = line.decode("utf-8")
+            except UnicodeDecodeError:
+                invalid.append(True)
+                line = line.decode("utf-8", "replace")
+        yield line
+
+
+class CopyLoader:
+    """
+    Bulk load of a TSV/CSV file into one inventory table through COPY.
+
+    The file is streamed with COPY FROM STDIN into a text-only staging table, so
+    a malformed value never aborts the load. A file COPY cannot split (wrong
+    number of columns, unterminated quote, invalid UTF-8) is staged again
+    through the csv module, which marks those lines instead. Values, the composite company
+    foreign keys and the table constraints are then checked with a handful of
+    set based statements that mark the offending lines, and the remaining rows
+    are written with a single INSERT ... SELECT. Products can be referenced by
+    `product_id` or by `sku`. Everything runs in one transaction.
+    """
+
+    model = None
+    # (column, type) written to the target table, in insert order
+    columns = ()
+    required = ()
+    # (condition on the typed row, error) for the table's CHECK constraints
+    checks = ()
+    invalidates_alerts = False
+
+    def __init__(self, company_id=None, delimiter="\t", max_errors=None):
+        if delimiter not in (",", "\t"):
+            raise ValueError("delimiter must be ',' or a tab")
+        self.company_id = company_id
+        self.delimiter = delimiter
+        if max_errors is None:
+            max_errors = getattr(settings, "ATOMIC_IMPORT_MAX_ERRORS", IMPORT_MAX_ERRORS)
+        self.max_errors = max_errors
+
+    @classmethod
+    def record_name(cls, company_id):
+        # ImportData.modelName of the loads into a company, InventoryLoadStatusView looks them up by it
+        return "{}:{}".format(cls.model.__name__, company_id)
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def file_columns(self):
+        return [name for name, _ in self.columns] + ["sku"]
+
+    def read_header(self, file):
+        line = file.readline()
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig")
+        header = [name.strip().lower() for name in next(csv.reader([line], delimiter=self.delimiter), [])]
+        errors = []
+        unknown = [name for name in header if name not in self.file_columns]
+        if unknown:
+            errors.append("Unknown columns: {}".format(", ".join(unknown)))
+        if len(set(header)) != len(header):
+            errors.append("Duplicated columns")
+        missing = [
+            name for name in self.required
+            if name not in header and not (name == "company_id" and self.company_id is not None)
+        ]
+        if "product_id" not in header and "sku" not in header:
+            missing.append("product_id or sku")
+        if missing:
+            errors.append("Missing columns: {}".format(", ".join(missing)))
+        if errors:
+            raise ValidationError({"file": errors})
+        return header
+
+    def value_check(self, name, type_):
+        if connection.pg_version >= 160000:
+            return "pg_input_is_valid({}, '{}')".format(name, type_)
+        if type_ == "timestamptz":
+            return "pg_temp.is_timestamptz({})".format(name)
+        return "{} ~ '{}'".format(name, INTEGER_PATTERNS[type_])
+
+    def typed_rows_sql(self):
+        # one pass over the staging table: first failing column wins, casts only run on valid values
+        errors = []
+        values = []
+        for name, type_ in self.columns:
+            check = self.value_check(name, type_) if type_ != "text" else "TRUE"
+            if name in self.required:
+                errors.append("WHEN {} IS NULL THEN '{} is required'".format(name, name))
+            if type_ != "text":
+                errors.append("WHEN {} IS NOT NULL AND NOT {} THEN '{} is not a valid {}'".format(name, check, name, type_))
+            values.append("CASE WHEN {} THEN {}::{} END AS {}".format(check, name, type_, name))
+        errors.insert(0, "WHEN load_error IS NOT NULL THEN load_error")
+        errors.append("WHEN product_id IS NULL AND sku IS NULL THEN 'product_id or sku is required'")
+        return """
+            CREATE TEMP TABLE load_rows ON COMMIT DROP AS
+            SELECT line + 1 AS line, sku, CASE {} END AS error, {}
+            FROM load_staging
+        """.format(" ".join(errors), ", ".join(values))
+
+    def check_rows_sql(self):
+        checks = list(self.checks)
+        if self.company_id is not None:
+            checks.insert(0, ("company_id <> {}".format(int(self.company_id)), "company_id does not match the company being loaded"))
+        return """
+            UPDATE load_rows SET error = CASE {} END
+            WHERE error IS NULL AND ({})
+        """.format(
+            " ".join("WHEN {} THEN '{}'".format(condition, error) for condition, error in checks),
+            " OR ".join("({})".format(condition) for condition, _ in checks),
+        )
+
+    def validate(self, cursor):
+        if self.checks or self.company_id is not None:
+            cursor.execute(self.check_rows_sql())
+        cursor.execute("""
+            UPDATE load_rows r SET product_id = p.id
+            FROM products p
+            WHERE r.error IS NULL AND r.product_id IS NULL AND p.company_id = r.company_id AND p.sku = r.sku
+        """)
+        # composite company foreign keys, checked for the whole file at once
+        cursor.execute("""
+            UPDATE load_rows r SET error = 'warehouse_id does not exist in this company'
+            WHERE r.error IS NULL
+              AND NOT EXISTS (SELECT 1 FROM warehouses w WHERE w.company_id = r.company_id AND w.id = r.warehouse_id)
+        """)
+        cursor.execute("""
+            UPDATE load_rows r SET error = CASE
+                WHEN r.product_id IS NULL THEN 'sku does not exist in this company'
+                ELSE 'product_id does not exist in this company' END
+            WHERE r.error IS NULL
+              AND NOT EXISTS (SELECT 1 FROM products p WHERE p.company_id = r.company_id AND p.id = r.product_id)
+        """)
+
+    def merge(self, cursor):
+        names = ", ".join(name for name, _ in self.columns)
+        cursor.execute(
+            "INSERT INTO {table} ({names}) SELECT {names} FROM load_rows WHERE error IS NULL".format(table=self.table, names=names)
+        )
+
+    def summary(self, cursor):
+        cursor.execute("SELECT COUNT(*), COUNT(error) FROM load_rows")
+        total, failed = cursor.fetchone()
+        cursor.execute("SELECT line, error FROM load_rows WHERE error IS NOT NULL ORDER BY line LIMIT %s", [self.max_errors])
+        return {
+            "totalRows": total,
+            "importedRows": total - failed,
+            "failedRows": failed,
+            "errors": [{"line": line, "error": error} for line, error in cursor.fetchall()],
+        }
+
+    def copy_sql(self, columns, delimiter):
+        return "COPY load_staging ({}) FROM STDIN WITH (FORMAT csv, DELIMITER '{}')".format(", ".join(columns), delimiter)
+
+    def copy(self, cursor, header, file):
+        start = file.tell()
+        try:
+            # copy_expert is passed through without Django's translation of the driver's errors
+            with transaction.atomic(), connection.wrap_database_errors:
+                cursor.copy_expert(self.copy_sql(header, self.delimiter), file)
+        except DataError:
+            # line numbers are written explicitly, the rolled back COPY already used up the sequence
+            file.seek(start)
+            with self.restage(file, header) as staged:
+                cursor.copy_expert(self.copy_sql(["line", "load_error"] + header, ","), staged)
+
+    def restage(self, file, header):
+        """
+        Rewrites the rows of `file` as a well-formed CSV for COPY, every record
+        prefixed with its line number and an error, set (values left empty) for
+        the records the csv module cannot split into len(header) columns.
+        """
+        staged = tempfile.SpooledTemporaryFile(max_size=RESTAGE_MEMORY_SIZE, mode="w+", newline="", encoding="utf-8")
+        writer = csv.writer(staged)
+        empty = [None] * len(header)
+        for line, (values, error) in enumerate(self.read_records(file, len(header)), start=1):
+            writer.writerow([line, error] + (values or empty))
+        staged.seek(0)
+        return staged
+
+    def read_records(self, file, width):
+        # (values, error) per record; the csv module reads a quoted field over several lines as COPY does
+        invalid = []
+        reader = csv.reader(read_lines(file, invalid), delimiter=self.delimiter, strict=True)
+        while True:
+            try:
+                values = next(reader)
+                error = None
+            except StopIteration:
+                return
+            except csv.Error as e:
+                values, error = None, "malformed line: {}".format(e)
+            if invalid:
+                invalid.clear()
+                error = "line is not valid UTF-8"
+            elif error is None and len(values) != width:
+                error = "expected {} columns, found {}".format(width, len(values))
+            # COPY reads unquoted empty values as NULL
+            yield (None if error else [value if value != "" else None for value in values]), error
+
+    def load(self, file):
+        """
+        Loads `file` (binary or text, starting with a header line) and returns
+        the import summary: {totalRows, importedRows, failedRows, errors}.
+        """
+        header = self.read_header(file)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE load_staging (line BIGSERIAL, load_error TEXT, {}) ON COMMIT DROP".format(
+                ", ".join("{} TEXT".format(name) for name in self.file_columns)
+            ))
+            self.copy(cursor, header, file)
+            if self.company_id is not None:
+                cursor.execute("UPDATE load_staging SET company_id = %s WHERE company_id IS NULL", [str(self.company_id)])
+            if connection.pg_version < 160000:
+                cursor.execute(TIMESTAMPTZ_CHECK_SQL)
+            cursor.execute(self.typed_rows_sql())
+            cursor.execute("ANALYZE load_rows")
+            self.validate(cursor)
+            self.merge(cursor)
+            if self.invalidates_alerts:
+                # the raw SQL writes bypass the model signals
+                cursor.execute("SELECT DISTINCT company_id FROM load_rows WHERE error IS NULL")
+                for (company_id,) in cursor.fetchall():
+                    transaction.on_commit(lambda company_id=company_id: invalidate_alerts(company_id))
+            summary = self.summary(cursor)
+            # dropped right away as well, the surrounding transaction may run another load
+            cursor.execute("DROP TABLE load_staging, load_rows")
+        return summary
+
+
+class SalesLoader(CopyLoader):
+    # appended; the rollup triggers run once for the whole INSERT ... SELECT
+    model = Sale
+    columns = (
+        ("company_id", "bigint"),
+        ("warehouse_id", "bigint"),
+        ("product_id", "bigint"),
+        ("quantity_sold", "integer"),
+        ("sale_date", "timestamptz"),
+    )
+    required = ("company_id", "warehouse_id", "quantity_sold", "sale_date")
+    checks = (("quantity_sold <= 0", "quantity_sold must be greater than 0"),)
+    invalidates_alerts = True
+
+
+class InventoryTransactionLoader(CopyLoader):
+    model = InventoryTransaction
+    columns = (
+        ("company_id", "bigint"),
+        ("warehouse_id", "bigint"),
+        ("product_id", "bigint"),
+        ("change_qty", "integer"),
+        ("change_type", "text"),
+        ("reference", "text"),
+        ("occurred_at", "timestamptz"),
+    )
+    required = ("company_id", "warehouse_id", "change_qty", "change_type")
+    checks = (
+        ("change_type NOT IN ({})".format(", ".join("'{}'".format(value) for value in CHANGE_TYPES)), "change_type is not valid"),
+        ("length(reference) > 255", "reference is longer than 255 characters"),
+    )
+
+    def merge(self, cursor):
+        cursor.execute("""
+            INSERT INTO inventory_transactions
+                (company_id, warehouse_id, product_id, change_qty, change_type, reference, occurred_at)
+            SELECT company_id, warehouse_id, product_id, change_qty, change_type, reference, COALESCE(occurred_at, NOW())
+            FROM load_rows WHERE error IS NULL
+        """)
+
+
+class InventorySnapshotLoader(CopyLoader):
+    """
+    Stock count snapshot: quantity_on_hand per (warehouse, product) is upserted,
+    rows whose quantity did not change are left untouched. When the file lists
+    a pair more than once the last line wins and the earlier ones are rejected.
+    """
+
+    model = Inventory
+    columns = (
+        ("company_id", "bigint"),
+        ("warehouse_id", "bigint"),
+        ("product_id", "bigint"),
+        ("quantity_on_hand", "integer"),
+    )
+    required = ("company_id", "warehouse_id", "quantity_on_hand")
+    checks = (("quantity_on_hand < 0", "quantity_on_hand cannot be negative"),)
+    invalidates_alerts = True
+
+    def validate(self, cursor):
+        super().validate(cursor)
+        cursor.execute("""
+            UPDATE load_rows r SET error = 'superseded by line ' || d.last_line
+            FROM (
+                SELECT line, MAX(line) OVER (PARTITION BY warehouse_id, product_id) AS last_line
+                FROM load_rows WHERE error IS NULL
+            ) d
+            WHERE r.line = d.line AND d.line <> d.last_line
+        """)
+
+    def merge(self, cursor):
+        cursor.execute("""
+            INSERT INTO inventory (company_id, warehouse_id, product_id, quantity_on_hand, updated_at)
+            SELECT company_id, warehouse_id, product_id, quantity_on_hand, NOW()
+            FROM load_rows WHERE error IS NULL
+            ON CONFLICT (warehouse_id, product_id)
+            DO UPDATE SET quantity_on_hand = EXCLUDED.quantity_on_hand, updated_at = EXCLUDED.updated_at
+            WHERE inventory.quantity_on_hand <> EXCLUDED.quantity_on_hand
+        """)
+
+
+LOADERS = {
+    "sales": SalesLoader,
+    "inventory_transactions": InventoryTransactionLoader,
+    "inventory": InventorySnapshotLoader,
+}
+
+
+def load_record_names(company_id):
+    return [loader_class.record_name(company_id) for loader_class in LOADERS.values()]
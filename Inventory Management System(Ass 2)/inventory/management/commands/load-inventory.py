@@ -0,0 +1,40 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from atomicloops.importers import get_delimiter
+from inventory.loaders import LOADERS
+
+
+class Command(BaseCommand):
+    help = 'bulk load a sales, inventory_transactions or inventory snapshot file (TSV, or CSV when named *.csv) through COPY'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(LOADERS))
+        parser.add_argument('path')
+        parser.add_argument('--company', type=int, default=None, help='company of every row, company_id may then be omitted')
+        parser.add_argument('--delimiter', choices=['tab', 'comma'], default=None)
+        parser.add_argument('--max-errors', type=int, default=None, help='rejected lines reported')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['delimiter'] is None:
+            delimiter = get_delimiter(kwargs['path'])
+        else:
+            delimiter = '\t' if kwargs['delimiter'] == 'tab' else ','
+        loader = LOADERS[kwargs['kind']](company_id=kwargs['company'], delimiter=delimiter, max_errors=kwargs['max_errors'])
+
+        start = time.perf_counter()
+        try:
+            with open(kwargs['path'], 'rb') as file:
+                summary = loader.load(file)
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValidationError as e:
+            raise CommandError('; '.join(e.detail['file']))
+
+        for error in summary['errors']:
+            sys.stdout.write(f"line {error['line']}: {error['error']}\n")
+        sys.stdout.write(
+            f"{summary['importedRows']}/{summary['totalRows']} rows loaded into {loader.table}, "
+            f"{summary['failedRows']} rejected in {time.perf_counter() - start:.2f}s\n"
+        )
@@ -0,0 +1,36 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from inventory.batch import batch_workers, dispatch_alerts_batch, run_alerts_batch
+from inventory.models import Company
+
+
+class Command(BaseCommand):
+    help = 'compute the low-stock alerts of a company partitioned by warehouse, over a process pool or the celery workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int)
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--workers', type=int, default=None, help='processes, defaults to the number of cores')
+        parser.add_argument('--partitions', type=int, default=None, help='warehouse partitions, defaults to 4 per process')
+        parser.add_argument('--celery', action='store_true', help='fan the partitions out to the celery workers and return')
+
+    def handle(self, *args, **kwargs):
+        company_id, days = kwargs['company'], kwargs['days']
+        if days <= 0:
+            raise CommandError('--days must be positive')
+        if not Company.objects.filter(id=company_id).exists():
+            raise CommandError(f'company {company_id} not found')
+
+        if kwargs['celery']:
+            batch = dispatch_alerts_batch(company_id, days, kwargs['partitions'])
+            sys.stdout.write(f"batch {batch['id']}: {batch['partitions']} partitions queued\n")
+            return
+
+        workers = kwargs['workers'] or batch_workers()
+        start = time.perf_counter()
+        data, partitions = run_alerts_batch(company_id, days, workers, kwargs['partitions'])
+        sys.stdout.write(
+            f"{data['total_alerts']} alerts for company {company_id} ({days} days) from {partitions} partitions "
+            f"over {min(workers, max(partitions, 1))} processes in {time.perf_counter() - start:.2f}s\n"
+        )
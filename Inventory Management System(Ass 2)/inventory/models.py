@@ -80,6 +80,9 @@ class Inventory(models.Model):
     quantity_on_hand = models.IntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # incremental export-data watermark (atomicloops.exporters)
+    export_watermark_field = "updated_at"
+
     class Meta:
         db_table = "inventory"
         managed = False
@@ -87,6 +90,7 @@ class Inventory(models.Model):
         indexes = [
             models.Index(fields=["company", "product"], name="idx_inventory_company_product"),
             models.Index(fields=["company", "warehouse"], name="idx_inventory_company_warehouse"),
+            models.Index(fields=["updated_at"], name="idx_inventory_updated_at"),
         ]
 
 
@@ -99,12 +103,15 @@ class InventoryTransaction(models.Model):
     reference = models.CharField(max_length=255, null=True, blank=True)
     occurred_at = models.DateTimeField()
 
+    export_watermark_field = "occurred_at"
+
     class Meta:
         db_table = "inventory_transactions"
         managed = False
         indexes = [
             models.Index(fields=["company", "product", "occurred_at"], name="idx_tx_company_product_date"),
             models.Index(fields=["company", "warehouse", "occurred_at"], name="idx_tx_company_warehouse_date"),
+            models.Index(fields=["occurred_at"], name="idx_tx_occurred_at"),
         ]
 
 
@@ -115,10 +122,29 @@ class Sale(models.Model):
     quantity_sold = models.IntegerField()
     sale_date = models.DateTimeField()
 
+    export_watermark_field = "sale_date"
+
     class Meta:
         db_table = "sales"
         managed = False
         indexes = [
             models.Index(fields=["company", "product", "sale_date"], name="idx_sales_company_product_date"),
             models.Index(fields=["company", "warehouse", "sale_date"], name="idx_sales_company_warehouse_date"),
+            models.Index(fields=["sale_date"], name="idx_sales_sale_date"),
+        ]
+
+
+class SaleDailyRollup(models.Model):
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    sale_day = models.DateField()
+    quantity_sold = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = "sales_daily_rollup"
+        managed = False
+        unique_together = ("company", "warehouse", "product", "sale_day")
+        indexes = [
+            models.Index(fields=["company", "sale_day"], name="idx_sales_rollup_company_day"),
         ]
@@ -0,0 +1,62 @@
+import logging
+
+from django.db import DatabaseError
+from rest_framework.renderers import JSONRenderer
+
+from atomicloops.renderers import AtomicJsonRenderer, dumps
+from utils.iterables import chunked
+
+logger = logging.getLogger(__name__)
+
+# Alerts encoded per yielded chunk of the streaming response
+STREAM_BATCH_SIZE = 500
+
+# The status line is already sent when a query fails mid-stream, the body ends with this error instead
+STREAM_ERROR = {"message": "Database error while processing request"}
+
+
+class NDJSONRenderer(JSONRenderer):
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Non streamed responses (errors) are a single line
+        return super().render(data, accepted_media_type, renderer_context) + b"\n"
+
+
+class JSONStreamRenderer(AtomicJsonRenderer):
+    # Non streamed responses (errors) keep the atomic envelope
+    format = "json-stream"
+
+
+def ndjson_stream(alerts):
+    # a failure ends the stream with an {"error": ..., "isSuccess": false} line
+    try:
+        for batch in chunked(alerts, STREAM_BATCH_SIZE):
+            yield b"".join(dumps(alert) + b"\n" for alert in batch)
+    except DatabaseError:
+        logger.exception("low-stock alert stream failed")
+        yield dumps({"error": STREAM_ERROR, "isSuccess": False}) + b"\n"
+
+
+def json_stream(alerts):
+    # Same document as AtomicJsonRenderer would produce for {"alerts": [...], "total_alerts": n};
+    # a failure closes it with the alerts sent so far, the error and "isSuccess": false
+    yield b'{"data":{"alerts":['
+    total = 0
+    error = {}
+    try:
+        for batch in chunked(alerts, STREAM_BATCH_SIZE):
+            # the batch is encoded as one array, its brackets dropped
+            yield (b"," if total else b"") + dumps(batch)[1:-1]
+            total += len(batch)
+    except DatabaseError:
+        logger.exception("low-stock alert stream failed")
+        error = STREAM_ERROR
+    yield b'],"total_alerts":%d},"error":%s,"isSuccess":%s}' % (total, dumps(error), b"false" if error else b"true")
+
+
+STREAMS = {
+    NDJSONRenderer.format: ndjson_stream,
+    JSONStreamRenderer.format: json_stream,
+}
@@ -0,0 +1,125 @@
+from datetime import datetime, time, timedelta, timezone
+
+from django.db import connection, transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Sale, SaleDailyRollup
+
+
+# Rollup buckets are UTC days; the trigger in docs/inventory_schema.sql uses the same boundary
+def window_bounds(window_start):
+    boundary_day = window_start.astimezone(timezone.utc).date()
+    boundary_end = datetime.combine(boundary_day + timedelta(days=1), time.min, tzinfo=timezone.utc)
+    return boundary_day, boundary_end
+
+
+def windowed_sales_subquery(company_id, window_start, product_ref="product_id", warehouse_ref="warehouse_id"):
+    """
+    Total quantity sold since window_start for the outer (product, warehouse) row.
+
+    Whole days come from the pre-summed sales_daily_rollup buckets, only the
+    partial first day of the window is read from sales.
+    """
+    boundary_day, boundary_end = window_bounds(window_start)
+    rollup = (
+        SaleDailyRollup.objects
+        .filter(
+            company_id=company_id,
+            product_id=OuterRef(product_ref),
+            warehouse_id=OuterRef(warehouse_ref),
+            sale_day__gt=boundary_day,
+        )
+        .order_by()
+        .values("product_id", "warehouse_id")
+        .annotate(total=Sum("quantity_sold"))
+        .values("total")
+    )
+    partial_day = (
+        Sale.objects
+        .filter(
+            company_id=company_id,
+            product_id=OuterRef(product_ref),
+            warehouse_id=OuterRef(warehouse_ref),
+            sale_date__gte=window_start,
+            sale_date__lt=boundary_end,
+        )
+        .order_by()
+        .values("product_id", "warehouse_id")
+        .annotate(total=Sum("quantity_sold"))
+        .values("total")
+    )
+    whole_days = Coalesce(Subquery(rollup, output_field=IntegerField()), Value(0))
+    first_day = Coalesce(Subquery(partial_day, output_field=IntegerField()), Value(0))
+    return whole_days + first_day
+
+
+def windowed_sales_totals(company_id, window_start, **filters):
+    # {(product_id, warehouse_id): total_sold} for the window, same split as windowed_sales_subquery
+    boundary_day, boundary_end = window_bounds(window_start)
+    totals = {}
+    sources = (
+        SaleDailyRollup.objects.filter(company_id=company_id, sale_day__gt=boundary_day, **filters),
+        Sale.objects.filter(company_id=company_id, sale_date__gte=window_start, sale_date__lt=boundary_end, **filters),
+    )
+    for queryset in sources:
+        for product_id, warehouse_id, total in (
+            queryset
+            .order_by()
+            .values("product_id", "warehouse_id")
+            .annotate(total=Sum("quantity_sold"))
+            .values_list("product_id", "warehouse_id", "total")
+        ):
+            key = (product_id, warehouse_id)
+            totals[key] = totals.get(key, 0) + (total or 0)
+    return totals
+
+
+RECONCILE_UPSERT_SQL = """
+    INSERT INTO sales_daily_rollup (company_id, warehouse_id, product_id, sale_day, quantity_sold)
+    SELECT company_id, warehouse_id, product_id, (sale_date AT TIME ZONE 'UTC')::date, SUM(quantity_sold)
+    FROM sales
+    WHERE sale_date >= %(since)s
+    GROUP BY 1, 2, 3, 4
+    ON CONFLICT (company_id, warehouse_id, product_id, sale_day)
+    DO UPDATE SET quantity_sold = EXCLUDED.quantity_sold
+    WHERE sales_daily_rollup.quantity_sold <> EXCLUDED.quantity_sold
+"""
+
+RECONCILE_DELETE_SQL = """
+    DELETE FROM sales_daily_rollup r
+    WHERE r.sale_day >= %(since_day)s
+      AND NOT EXISTS (
+          SELECT 1 FROM sales s
+          WHERE s.company_id = r.company_id
+            AND s.warehouse_id = r.warehouse_id
+            AND s.product_id = r.product_id
+            AND s.sale_date >= %(since)s
+            AND (s.sale_date AT TIME ZONE 'UTC')::date = r.sale_day
+      )
+"""
+
+
+def reconcile_sales_rollup(days=None):
+    """
+    Rebuild rollup buckets from sales for the last `days` UTC days (all history when None).
+
+    Buckets that drifted are overwritten, buckets without sales are removed. Sales
+    writes are blocked for the duration so the trigger cannot race the rebuild.
+    Returns (updated, deleted) row counts.
+    """
+    if days is None:
+        since_day = datetime.min.date()
+    else:
+        since_day = datetime.now(timezone.utc).date() - timedelta(days=days)
+    params = {
+        "since_day": since_day,
+        "since": datetime.combine(since_day, time.min, tzinfo=timezone.utc),
+    }
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE sales IN SHARE MODE")
+        cursor.execute(RECONCILE_UPSERT_SQL, params)
+        updated = cursor.rowcount
+        cursor.execute(RECONCILE_DELETE_SQL, params)
+        deleted = cursor.rowcount
+    return updated, deleted
@@ -0,0 +1,41 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .bundles import invalidate_bundle_graph
+from .cache import ALERT_PRODUCT_FIELDS, invalidate_alerts
+from .models import BundleComponent, Inventory, Product, ProductSupplier, Sale, Supplier, Warehouse
+
+
+# Bundle graph cache (inventory.bundles.BundleResolver)
+@receiver([post_save, post_delete], sender=BundleComponent)
+def bundle_components_changed(sender, instance, **kwargs):
+    invalidate_bundle_graph(instance.company_id)
+    invalidate_alerts(instance.company_id)
+
+
+# Low-stock alert cache (inventory.cache)
+@receiver([post_save, post_delete], sender=Inventory)
+@receiver([post_save, post_delete], sender=Sale)
+@receiver([post_save, post_delete], sender=Warehouse)
+@receiver([post_save, post_delete], sender=ProductSupplier)
+def alert_rows_changed(sender, instance, **kwargs):
+    invalidate_alerts(instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not ALERT_PRODUCT_FIELDS.intersection(update_fields):
+        return
+    invalidate_alerts(instance.company_id)
+
+
+# Suppliers are shared between companies; on delete the companies are read before
+# the products lose their supplier_id
+@receiver([post_save, pre_delete], sender=Supplier)
+def supplier_changed(sender, instance, **kwargs):
+    company_ids = set(Product.objects.filter(supplier_id=instance.pk).values_list("company_id", flat=True).distinct())
+    company_ids.update(
+        ProductSupplier.objects.filter(supplier_id=instance.pk).values_list("company_id", flat=True).distinct()
+    )
+    for company_id in company_ids:
+        invalidate_alerts(company_id)
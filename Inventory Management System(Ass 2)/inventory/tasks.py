@@ -0,0 +1,79 @@
+import logging
+import os
+
+from django.db import DatabaseError
+
+from src.celery import app
+from users.models import ImportData
+from .batch import dispatch_alerts_batch, run_batch_partition
+from .cache import refresh_alerts, release_refresh_lock
+from .loaders import LOADERS
+from .models import SaleDailyRollup
+from .sales import reconcile_sales_rollup as reconcile_rollup
+
+
+logger = logging.getLogger(__name__)
+
+# Nightly window covers the longest alert window served from the rollup (90 days)
+ROLLUP_RECONCILE_DAYS = 90
+
+
+@app.task(bind=True)
+def reconcile_sales_rollup(self, days=ROLLUP_RECONCILE_DAYS, backfill=False):
+    # an empty rollup (fresh install / truncated table) is backfilled from the full sales history
+    if backfill or not SaleDailyRollup.objects.exists():
+        days = None
+    updated, deleted = reconcile_rollup(days=days)
+    return {'updated': updated, 'deleted': deleted, 'days': days}
+
+
+@app.task(bind=True)
+def refresh_low_stock_alerts(self, company_id, days):
+    # background half of the stale-while-revalidate alert cache (inventory.cache)
+    try:
+        data = refresh_alerts(company_id, days)
+    finally:
+        release_refresh_lock(company_id, days)
+    return {'company_id': company_id, 'days': days, 'total_alerts': data['total_alerts']}
+
+
+@app.task(bind=True)
+def load_inventory_file(self, import_id, kind, company_id, path, delimiter='\t'):
+    # COPY load of an upload stored by InventoryLoadView, see inventory.loaders
+    import_record = ImportData.objects.get(id=import_id)
+    import_record.update_progress({'totalRows': 0, 'importedRows': 0, 'failedRows': 0, 'errors': []})
+    try:
+        with open(path, 'rb') as file:
+            summary = LOADERS[kind](company_id=company_id, delimiter=delimiter).load(file)
+    except Exception as e:
+        import_record.update_progress(
+            {'totalRows': 0, 'importedRows': 0, 'failedRows': 0, 'errors': [{'line': None, 'error': str(e)}]}, status="failed"
+        )
+        raise
+    finally:
+        os.remove(path)
+    import_record.finish(summary)
+    return {key: summary[key] for key in ('totalRows', 'importedRows', 'failedRows')}
+
+
+@app.task(bind=True)
+def batch_low_stock_alerts(self, company_id, days, partitions=None):
+    # fans the company's warehouses out to low_stock_alerts_partition, see inventory.batch
+    batch = dispatch_alerts_batch(company_id, days, partitions)
+    return {'company_id': company_id, 'days': days, 'batch': batch['id'], 'partitions': batch['partitions']}
+
+
+@app.task(bind=True, autoretry_for=(DatabaseError,), max_retries=3, retry_backoff=True)
+def low_stock_alerts_partition(self, batch, index, warehouse_ids):
+    # retried on database errors: the partition is only counted done once stored, a retry does not count it twice
+    try:
+        data = run_batch_partition(batch, index, warehouse_ids)
+    except Exception:
+        logger.exception(
+            "alerts batch %s partition %d failed (attempt %d)", batch['id'], index, self.request.retries + 1
+        )
+        raise
+    result = {'batch': batch['id'], 'partition': index, 'warehouses': len(warehouse_ids)}
+    if data is not None:
+        result['total_alerts'] = data['total_alerts']
+    return result
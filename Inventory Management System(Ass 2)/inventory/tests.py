@@ -0,0 +1,543 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from fractions import Fraction
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils.timezone import now
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+import numpy as np
+
+from .alerts import LowStockAlertEngine, days_until_stockout, days_until_stockout_array
+from .batch import compute_partition, increment_done, merge_partitions, partition_warehouses, run_batch_partition
+from .bundles import BundleResolver, divide_down
+from users.models import ImportData, Users
+from .cache import HIT, MISS, acquire_refresh_lock, alerts_version, get_low_stock_alerts, serialize_alerts
+from .models import Company, Inventory, Product, ProductSupplier, Sale, Supplier, Warehouse, BundleComponent
+from .loaders import SalesLoader
+from .renderers import json_stream, ndjson_stream
+from .views import InventoryLoadStatusView, InventoryLoadView, LowStockAlertsView
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "docs" / "inventory_schema.sql"
+
+
+class InventorySchemaTestCase(TestCase):
+    """
+    The inventory models are unmanaged: their tables are created from
+    docs/inventory_schema.sql inside the test case transaction.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute(SCHEMA_PATH.read_text())
+
+    def setUp(self):
+        # ids start over with every test case's schema, cached entries of another case would match them
+        cache.clear()
+
+    # product_suppliers and bundle_components have composite keys, the ORM cannot insert them
+    @staticmethod
+    def add_product_supplier(company, product, supplier):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO product_suppliers (company_id, product_id, supplier_id) VALUES (%s, %s, %s)",
+                [company.id, product.id, supplier.id],
+            )
+
+    @staticmethod
+    def add_bundle_component(company, bundle, component, quantity):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO bundle_components (company_id, bundle_product_id, component_product_id, quantity_per_bundle)"
+                " VALUES (%s, %s, %s, %s)",
+                [company.id, bundle.id, component.id, Decimal(quantity)],
+            )
+
+
+def supplier_info(product):
+    if product.supplier_id:
+        supplier = Supplier.objects.filter(id=product.supplier_id).first()
+        if supplier:
+            return {"id": supplier.id, "name": supplier.name, "contact_email": supplier.contact_email}
+    # product_suppliers has no id column, "first" is the lowest supplier id
+    fallback = (
+        ProductSupplier.objects.filter(product_id=product.id)
+        .order_by("supplier_id")
+        .values("supplier__id", "supplier__name", "supplier__contact_email")
+        .first()
+    )
+    if fallback:
+        return {
+            "id": fallback["supplier__id"],
+            "name": fallback["supplier__name"],
+            "contact_email": fallback["supplier__contact_email"],
+        }
+    return {"id": None, "name": None, "contact_email": None}
+
+
+def per_row_alerts(company_id, window_days):
+    """
+    The original LowStockAlertsView computation, one query per inventory row,
+    bundle component and supplier lookup (single level bundles only).
+    """
+    window_start = now() - timedelta(days=window_days)
+    sales_map = {
+        (row["product_id"], row["warehouse_id"]): row["total_sold"] or 0
+        for row in (
+            Sale.objects.filter(company_id=company_id, sale_date__gte=window_start)
+            .values("product_id", "warehouse_id")
+            .annotate(total_sold=Sum("quantity_sold"))
+        )
+    }
+
+    def alert(product, warehouse, current_stock, total_sold):
+        avg_daily = Decimal(total_sold) / Decimal(window_days)
+        return {
+            "product_id": product.id,
+            "product_name": product.name,
+            "sku": product.sku,
+            "warehouse_id": warehouse.id,
+            "warehouse_name": warehouse.name,
+            "current_stock": int(current_stock),
+            "threshold": int(product.threshold),
+            "days_until_stockout": int(Decimal(current_stock) / avg_daily) if avg_daily > 0 else None,
+            "supplier": supplier_info(product),
+        }
+
+    alerts = []
+    for inventory in Inventory.objects.filter(company_id=company_id).select_related("product", "warehouse"):
+        product, warehouse = inventory.product, inventory.warehouse
+        if product.company_id != company_id or warehouse.company_id != company_id:
+            continue
+        if not product.active or not warehouse.active:
+            continue
+        total_sold = sales_map.get((product.id, warehouse.id), 0)
+        if total_sold <= 0 or inventory.quantity_on_hand >= product.threshold:
+            continue
+        alerts.append(alert(product, warehouse, inventory.quantity_on_hand, total_sold))
+
+    for bundle in Product.objects.filter(company_id=company_id, is_bundle=True, active=True):
+        components = list(
+            BundleComponent.objects.filter(company_id=company_id, bundle_product_id=bundle.id)
+            .values_list("component_product_id", "quantity_per_bundle")
+        )
+        if not components:
+            continue
+        for warehouse in Warehouse.objects.filter(company_id=company_id, active=True):
+            total_sold = sales_map.get((bundle.id, warehouse.id), 0)
+            if total_sold <= 0:
+                continue
+            limits = []
+            for component_id, quantity in components:
+                inventory = Inventory.objects.filter(
+                    company_id=company_id, warehouse_id=warehouse.id, product_id=component_id
+                ).first()
+                on_hand = inventory.quantity_on_hand if inventory else 0
+                limits.append(int(Decimal(on_hand) / Decimal(quantity)) if quantity > 0 else 0)
+            bundle_stock = min(limits)
+            if bundle_stock >= bundle.threshold:
+                continue
+            alerts.append(alert(bundle, warehouse, bundle_stock, total_sold))
+
+    alerts.sort(key=lambda a: (a["warehouse_id"], a["product_id"]))
+    return alerts
+
+
+class AlertFixtureMixin:
+    """
+    Two companies; warehouses and products with direct suppliers, the
+    ProductSupplier fallback or no supplier at all, inactive rows, and
+    bundles of plain products.
+    """
+
+    @classmethod
+    def create_alert_fixture(cls):
+        cls.company = Company.objects.create(name="acme")
+        other = Company.objects.create(name="other")
+        cls.suppliers = suppliers = [
+            Supplier.objects.create(name=f"supplier {index}", contact_email=f"s{index}@example.com")
+            for index in range(3)
+        ]
+        cls.warehouses = [
+            Warehouse.objects.create(company=cls.company, name=f"warehouse {index}", active=index != 2)
+            for index in range(4)
+        ]
+        other_warehouse = Warehouse.objects.create(company=other, name="elsewhere")
+
+        products = []
+        for index in range(12):
+            products.append(Product.objects.create(
+                company=cls.company, sku=f"P{index}", name=f"product {index}",
+                threshold=10 + index, active=index != 5,
+                supplier=suppliers[index % 3] if index % 4 == 0 else None,
+            ))
+        cls.fallback_products = set()
+        for index, product in enumerate(products):
+            if index % 4 != 0 and index % 3 != 0:
+                cls.fallback_products.add(product.id)
+                # fallback supplier, the lowest id wins
+                cls.add_product_supplier(cls.company, product, suppliers[2])
+                cls.add_product_supplier(cls.company, product, suppliers[1])
+        bundles = [
+            Product.objects.create(
+                company=cls.company, sku=f"B{index}", name=f"bundle {index}", is_bundle=True,
+                threshold=8, supplier=suppliers[0] if index == 0 else None,
+            )
+            for index in range(3)
+        ]
+        cls.add_product_supplier(cls.company, bundles[1], suppliers[2])
+        cls.add_bundle_component(cls.company, bundles[0], products[0], "2")
+        cls.add_bundle_component(cls.company, bundles[0], products[1], "0.5")
+        cls.add_bundle_component(cls.company, bundles[1], products[2], "3")
+        cls.add_bundle_component(cls.company, bundles[1], products[3], "1.5")
+        cls.add_bundle_component(cls.company, bundles[1], products[4], "1")
+        # bundles[2] has no components and never alerts
+
+        sale_time = now()
+        for w_index, warehouse in enumerate(cls.warehouses):
+            for p_index, product in enumerate(products + bundles):
+                if (w_index + p_index) % 5 != 0:
+                    Inventory.objects.create(
+                        company=cls.company, warehouse=warehouse, product=product,
+                        quantity_on_hand=(w_index * 7 + p_index * 3) % 25,
+                    )
+                for sale in range((w_index + p_index) % 4):
+                    # whole days plus a few hours, never on a window boundary
+                    Sale.objects.create(
+                        company=cls.company, warehouse=warehouse, product=product,
+                        quantity_sold=1 + (p_index + sale) % 6,
+                        sale_date=sale_time - timedelta(days=(p_index * 11 + sale * 17) % 60, hours=3 + sale),
+                    )
+        product = Product.objects.create(company=other, sku="X", name="other product", threshold=50)
+        Inventory.objects.create(company=other, warehouse=other_warehouse, product=product, quantity_on_hand=1)
+        Sale.objects.create(company=other, warehouse=other_warehouse, product=product, quantity_sold=5, sale_date=sale_time)
+
+
+class LowStockAlertEngineTests(AlertFixtureMixin, InventorySchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_alert_fixture()
+
+    def test_matches_per_row_computation(self):
+        for days in (7, 30, 90):
+            with self.subTest(days=days):
+                alerts = LowStockAlertEngine(self.company.id, days).alerts()
+                self.assertEqual(alerts, per_row_alerts(self.company.id, days))
+                self.assertTrue(alerts)
+
+    def test_fixture_covers_suppliers_and_bundles(self):
+        alerts = LowStockAlertEngine(self.company.id, 90).alerts()
+        self.assertIn(None, {alert["supplier"]["id"] for alert in alerts})
+        fallback = {alert["supplier"]["id"] for alert in alerts if alert["product_id"] in self.fallback_products}
+        self.assertEqual(fallback, {self.suppliers[1].id})
+        self.assertTrue(any(alert["sku"].startswith("B") for alert in alerts))
+
+    def test_iter_alerts_matches_alerts(self):
+        engine = LowStockAlertEngine(self.company.id, 30)
+        self.assertEqual(list(engine.iter_alerts(chunk_size=3)), engine.alerts())
+
+
+class ArrayKernelTests(SimpleTestCase):
+
+    def test_days_until_stockout_array_matches_decimal(self):
+        stock, sold = np.meshgrid(np.arange(0, 120), np.arange(0, 60))
+        stock = np.append(stock.ravel(), [10 ** 9, 10 ** 9, 999999999]).astype(np.int64)
+        sold = np.append(sold.ravel(), [1, 7, 10 ** 6]).astype(np.int64)
+        for window_days in (1, 7, 30, 90, 365):
+            with self.subTest(window_days=window_days):
+                expected = [
+                    days_until_stockout(int(current), int(total), window_days) for current, total in zip(stock, sold)
+                ]
+                days = days_until_stockout_array(stock, sold, window_days)
+                self.assertEqual([day if day >= 0 else None for day in days.tolist()], expected)
+
+    def test_divide_down_matches_decimal(self):
+        available = np.append(np.arange(0, 2000), [10 ** 12, 10 ** 15 + 7]).astype(np.int64)
+        for quantity in ("0.5", "1", "1.5", "3", "0.333", "2.75", "7", "0.01", "12.345"):
+            with self.subTest(quantity=quantity):
+                expected = [int(Decimal(int(value)) / Decimal(quantity)) for value in available]
+                self.assertEqual(divide_down(available, Decimal(quantity)).tolist(), expected)
+
+
+class BundleResolverTests(InventorySchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        company = cls.company = Company.objects.create(name="acme")
+        cls.warehouses = [Warehouse.objects.create(company=company, name=f"warehouse {index}") for index in range(3)]
+        parts = [Product.objects.create(company=company, sku=f"P{index}", name=f"part {index}") for index in range(3)]
+        inner, outer, top, shared, sub = [
+            Product.objects.create(company=company, sku=sku, name=sku, is_bundle=True)
+            for sku in ("INNER", "OUTER", "TOP", "SHARED", "SUB")
+        ]
+        cls.shared = shared
+        # top contains outer contains inner, top also uses inner directly;
+        # shared and its sub-bundle both use part 0
+        cls.components = {}
+        for bundle, component, quantity in (
+            (top, outer, "3"), (top, inner, "0.5"),
+            (outer, inner, "1"), (outer, parts[2], "0.5"),
+            (inner, parts[0], "2"), (inner, parts[1], "1.5"),
+            (shared, parts[0], "1"), (shared, sub, "1"),
+            (sub, parts[0], "1"),
+        ):
+            cls.add_bundle_component(company, bundle, component, quantity)
+            cls.components.setdefault(bundle.id, []).append((component.id, Decimal(quantity)))
+        stock = {
+            parts[0]: (40, 10, 0), parts[1]: (30, 9, 100), parts[2]: (5, 1, 100),
+            inner: (0, 4, 6), outer: (2, 0, 1), sub: (0, 3, 20),
+        }
+        cls.on_hand = {}
+        for product, quantities in stock.items():
+            for warehouse, quantity in zip(cls.warehouses, quantities):
+                Inventory.objects.create(company=company, warehouse=warehouse, product=product, quantity_on_hand=quantity)
+                cls.on_hand[product.id, warehouse.id] = quantity
+
+    def consume(self, product_id, amount, stock, top=False):
+        # one unit at a time: sub-bundles come out of their stock first, the rest is built
+        if product_id in self.components:
+            if not top:
+                used = min(amount, max(stock.get(product_id, 0), 0))
+                stock[product_id] = stock.get(product_id, 0) - used
+                amount -= used
+            for component_id, quantity in self.components[product_id]:
+                self.consume(component_id, amount * Fraction(quantity), stock)
+        else:
+            stock[product_id] = stock.get(product_id, 0) - amount
+
+    def expected(self, bundle_id, warehouse_id):
+        stock = {product_id: Fraction(quantity) for (product_id, w_id), quantity in self.on_hand.items() if w_id == warehouse_id}
+        built = 0
+        while True:
+            remaining = dict(stock)
+            self.consume(bundle_id, 1, remaining, top=True)
+            if any(quantity < 0 for quantity in remaining.values()):
+                return built
+            stock = remaining
+            built += 1
+
+    def test_nested_bundles_match_unit_by_unit_building(self):
+        warehouse_ids = [warehouse.id for warehouse in self.warehouses]
+        rows, matrix = BundleResolver(self.company.id).buildable_matrix(warehouse_ids)
+        self.assertEqual(set(rows), set(self.components))
+        for bundle_id, row in rows.items():
+            with self.subTest(bundle_id=bundle_id):
+                self.assertEqual(
+                    matrix[row].tolist(), [self.expected(bundle_id, warehouse_id) for warehouse_id in warehouse_ids]
+                )
+
+    def test_component_shared_with_a_sub_bundle_is_counted_once(self):
+        # 10 of part 0 in the second warehouse: 5 without sub-bundle stock, 3 in stock give 6, none built in the third
+        self.assertEqual(self.expected(self.shared.id, self.warehouses[1].id), 6)
+        buildable = BundleResolver(self.company.id).buildable([warehouse.id for warehouse in self.warehouses])
+        self.assertEqual(buildable[self.shared.id], [20, 6, 0])
+        Inventory.objects.filter(product=self.components[self.shared.id][1][0]).update(quantity_on_hand=0)
+        buildable = BundleResolver(self.company.id).buildable([warehouse.id for warehouse in self.warehouses])
+        self.assertEqual(buildable[self.shared.id], [20, 5, 0])
+
+    def test_warehouse_columns_follow_the_requested_order(self):
+        warehouse_ids = [warehouse.id for warehouse in reversed(self.warehouses)]
+        buildable = BundleResolver(self.company.id).buildable(warehouse_ids)
+        self.assertEqual(
+            buildable,
+            {
+                bundle_id: [self.expected(bundle_id, warehouse_id) for warehouse_id in warehouse_ids]
+                for bundle_id in self.components
+            },
+        )
+
+
+class AlertBatchTests(AlertFixtureMixin, InventorySchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_alert_fixture()
+
+    def partitions(self, days):
+        parts = partition_warehouses(self.company.id, 2)
+        self.assertEqual(len(parts), 2)
+        window_start = now() - timedelta(days=days)
+        return parts, [compute_partition(self.company.id, days, window_start, warehouse_ids) for warehouse_ids in parts]
+
+    def test_merged_partitions_match_alerts(self):
+        for days in (7, 30, 90):
+            with self.subTest(days=days):
+                _, results = self.partitions(days)
+                self.assertTrue(all(results))
+                self.assertEqual(merge_partitions(results), LowStockAlertEngine(self.company.id, days).alerts())
+
+    def test_last_partition_primes_the_cache(self):
+        parts, _ = self.partitions(30)
+        batch = {
+            "id": "batch", "company_id": self.company.id, "days": 30, "version": alerts_version(self.company.id),
+            "window_start": (now() - timedelta(days=30)).isoformat(), "partitions": len(parts),
+        }
+        self.assertIsNone(run_batch_partition(batch, 1, parts[1]))
+        data = run_batch_partition(batch, 0, parts[0])
+        self.assertEqual(data, serialize_alerts(LowStockAlertEngine(self.company.id, 30).alerts()))
+        self.assertEqual(get_low_stock_alerts(self.company.id, 30), (data, HIT))
+
+    def test_done_counter_is_one_redis_transaction(self):
+        client = mock.Mock()
+        client.pipeline.return_value.execute.return_value = [2, True]
+        with mock.patch("inventory.batch.get_counter_client", return_value=client):
+            self.assertEqual(increment_done("done", 60), 2)
+        client.pipeline.assert_called_once_with(transaction=True)
+        client.pipeline.return_value.incr.assert_called_once_with(cache.make_key("done"))
+        client.pipeline.return_value.expire.assert_called_once_with(cache.make_key("done"), 60)
+
+
+class AlertCacheTests(AlertFixtureMixin, InventorySchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.create_alert_fixture()
+
+    def assertInvalidates(self, change):
+        version = alerts_version(self.company.id)
+        change()
+        self.assertNotEqual(alerts_version(self.company.id), version)
+
+    def test_warehouse_changes_invalidate(self):
+        warehouse = self.warehouses[0]
+        warehouse.name = "renamed"
+        self.assertInvalidates(warehouse.save)
+        warehouse.active = False
+        self.assertInvalidates(warehouse.save)
+
+    def test_supplier_changes_invalidate(self):
+        # direct supplier of some products, ProductSupplier fallback of others
+        for supplier in self.suppliers:
+            supplier.contact_email = "new@example.com"
+            self.assertInvalidates(supplier.save)
+        fallback_only = Supplier.objects.create(name="fallback only")
+        self.add_product_supplier(self.company, Product.objects.get(company=self.company, sku="P1"), fallback_only)
+        fallback_only.name = "renamed"
+        self.assertInvalidates(fallback_only.save)
+
+    def test_cold_miss_computes_after_short_wait(self):
+        # another worker holds the lock and never stores an entry
+        acquire_refresh_lock(self.company.id, 30)
+        data, state = get_low_stock_alerts(self.company.id, 30)
+        self.assertEqual(state, MISS)
+        self.assertEqual(data["alerts"], LowStockAlertEngine(self.company.id, 30).alerts())
+
+
+class InventoryLoadTests(InventorySchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = Users.objects.create_superuser(email="admin@example.com", password="x")
+        cls.company = Company.objects.create(name="acme")
+        cls.other = Company.objects.create(name="other")
+        cls.warehouse = Warehouse.objects.create(company=cls.company, name="main")
+        cls.product = Product.objects.create(company=cls.company, sku="P1", name="product", threshold=5)
+
+    def sales_file(self, *lines):
+        return "\n".join(["warehouse_id\tsku\tquantity_sold\tsale_date"] + list(lines)).encode()
+
+    def sale(self, quantity):
+        return "{}\tP1\t{}\t2024-01-02 10:00:00+00".format(self.warehouse.id, quantity)
+
+    def upload(self, company, content, kind="sales"):
+        request = APIRequestFactory().post(
+            f"/api/companies/{company.id}/loads/{kind}",
+            {"file": SimpleUploadedFile("sales.tsv", content)},
+            format="multipart",
+        )
+        force_authenticate(request, user=self.admin)
+        return InventoryLoadView.as_view()(request, company_id=company.id, kind=kind)
+
+    def load_status(self, company, import_id):
+        request = APIRequestFactory().get(f"/api/companies/{company.id}/loads/{import_id}")
+        force_authenticate(request, user=self.admin)
+        return InventoryLoadStatusView.as_view()(request, company_id=company.id, import_id=import_id)
+
+    def test_malformed_lines_are_reported(self):
+        content = self.sales_file(
+            self.sale(2),
+            self.sale(3) + "\textra",
+            "{}\tP1\t4".format(self.warehouse.id),
+            self.sale(5),
+            '{}\t"P1\t6\t2024-01-02'.format(self.warehouse.id),
+        )
+        summary = SalesLoader(company_id=self.company.id).load(BytesIO(content))
+        self.assertEqual((summary["totalRows"], summary["importedRows"], summary["failedRows"]), (5, 2, 3))
+        self.assertEqual([error["line"] for error in summary["errors"]], [3, 4, 6])
+        self.assertEqual(summary["errors"][0]["error"], "expected 4 columns, found 5")
+        self.assertTrue(summary["errors"][2]["error"].startswith("malformed line"))
+        self.assertEqual(Sale.objects.filter(company=self.company).aggregate(total=Sum("quantity_sold"))["total"], 7)
+
+    def test_invalid_utf8_line_is_reported(self):
+        content = self.sales_file(self.sale(2), "{}\tP\xe9\t3\t2024-01-02".format(self.warehouse.id)).replace(
+            "é".encode(), b"\xe9"
+        )
+        summary = SalesLoader(company_id=self.company.id).load(BytesIO(content))
+        self.assertEqual(summary["importedRows"], 1)
+        self.assertEqual(summary["errors"], [{"line": 3, "error": "line is not valid UTF-8"}])
+
+    def test_malformed_upload_is_answered_with_the_summary(self):
+        response = self.upload(self.company, self.sales_file(self.sale(2), self.sale(3) + "\textra"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["importedRows"], response.data["failedRows"]), (1, 1))
+
+    def test_load_status_is_scoped_to_the_company_loads(self):
+        import_id = self.upload(self.company, self.sales_file(self.sale(2))).data["id"]
+        self.assertEqual(self.load_status(self.company, import_id).status_code, 200)
+        self.assertEqual(self.load_status(self.other, import_id).status_code, 404)
+        # imports of other models share the table
+        record = ImportData.objects.create(userId=self.admin, modelName="Users", fileName="users.tsv")
+        self.assertEqual(self.load_status(self.company, record.id).status_code, 404)
+
+
+def failing_alerts(count):
+    # fails once `count` alerts went out, in the middle of the next batch
+    for index in range(count + 1):
+        yield {"product_id": index, "warehouse_id": 1}
+    raise DatabaseError("connection lost")
+
+
+@mock.patch("inventory.renderers.STREAM_BATCH_SIZE", 2)
+class AlertStreamTests(SimpleTestCase):
+
+    def test_json_stream_document(self):
+        alerts = [{"product_id": index, "warehouse_id": 1} for index in range(3)]
+        document = json.loads(b"".join(json_stream(iter(alerts))))
+        self.assertEqual(
+            document, {"data": {"alerts": alerts, "total_alerts": 3}, "error": {}, "isSuccess": True}
+        )
+
+    def test_json_stream_closes_document_on_database_error(self):
+        with self.assertLogs("inventory.renderers", "ERROR"):
+            document = json.loads(b"".join(json_stream(failing_alerts(2))))
+        self.assertFalse(document["isSuccess"])
+        self.assertEqual(document["error"], {"message": "Database error while processing request"})
+        self.assertEqual(document["data"]["total_alerts"], 2)
+
+    def test_ndjson_stream_ends_with_error_record(self):
+        with self.assertLogs("inventory.renderers", "ERROR"):
+            lines = b"".join(ndjson_stream(failing_alerts(2))).splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[-1]), {
+            "error": {"message": "Database error while processing request"}, "isSuccess": False,
+        })
+
+    def test_view_keeps_default_renderers(self):
+        renderers = LowStockAlertsView.renderer_classes
+        self.assertEqual(renderers[:len(api_settings.DEFAULT_RENDERER_CLASSES)], api_settings.DEFAULT_RENDERER_CLASSES)
+        self.assertLessEqual({"ndjson", "json-stream"}, {renderer.format for renderer in renderers})
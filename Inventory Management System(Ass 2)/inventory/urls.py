@@ -1,7 +1,9 @@
 from django.urls import path
-from .views import LowStockAlertsView
+from .views import InventoryLoadStatusView, InventoryLoadView, LowStockAlertsView
 
 
 urlpatterns = [
     path('api/companies/<int:company_id>/alerts/low-stock', LowStockAlertsView.as_view(), name='low-stock-alerts'),
+    path('api/companies/<int:company_id>/loads/<uuid:import_id>', InventoryLoadStatusView.as_view(), name='inventory-load-status'),
+    path('api/companies/<int:company_id>/loads/<str:kind>', InventoryLoadView.as_view(), name='inventory-load'),
 ]
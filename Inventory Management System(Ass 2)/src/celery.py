@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.schedules import crontab
 from celery import shared_task
 from django.conf import settings
 # Set the default Django settings module for the 'celery' program.
@@ -17,6 +18,23 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+# periodic tasks owned by the apps
+@app.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    # backfill/reconcile the daily sales rollup against the sales table
+    sender.add_periodic_task(
+        crontab(hour=2, minute=0),
+        sender.signature('inventory.tasks.reconcile_sales_rollup'),
+        name='reconcile-sales-rollup',
+    )
+    # expired JWTs in the token_blacklist tables
+    sender.add_periodic_task(
+        crontab(minute=30),
+        sender.signature('atomicloops.tasks.purge_expired_tokens'),
+        name='purge-expired-tokens',
+    )
+
+
 # @app.task(bind=True)
 @shared_task
 def debug_task(self):
@@ -63,7 +63,5 @@ if not DEBUG:
     # Remove debug tools from production
     if 'debug_toolbar' in INSTALLED_APPS:
         INSTALLED_APPS.remove('debug_toolbar')
-    if "atomicloops.middleware.QueryCountMiddleware" in MIDDLEWARE:
-        MIDDLEWARE.remove("atomicloops.middleware.QueryCountMiddleware")
     if "debug_toolbar.middleware.DebugToolbarMiddleware" in MIDDLEWARE:
         MIDDLEWARE.remove("debug_toolbar.middleware.DebugToolbarMiddleware")
@@ -52,5 +52,9 @@ class ExportDataAdmin(admin.ModelAdmin):
         'createdAt',
         'updatedAt',
         'userId',
+        'modelName',
+        'status',
+        'format',
+        'rows',
         'fileUrl',
     )
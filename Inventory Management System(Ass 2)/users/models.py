@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from atomicloops.models import AtomicBaseModel
 from django.utils.translation import gettext_lazy as _
@@ -60,6 +61,8 @@ class Users(AbstractUser, AtomicBaseModel):
     is_staff = models.BooleanField(verbose_name=_('Is Staff'), default=False, db_column="is_staff")
     is_superuser = models.BooleanField(verbose_name=_('Is Superuser'), default=False, db_column="is_superuser")
     isVerified = models.BooleanField(verbose_name=_('Is Verified'), default=False, db_column="is_verified")
+    # tokens issued before this time are rejected (atomicloops.authentication.revoke_user_tokens)
+    tokensValidAfter = models.DateTimeField(verbose_name=_('Tokens Valid After'), null=True, blank=True, db_column="tokens_valid_after")
 
     objects = UserManager()
 
@@ -106,13 +109,70 @@ class UsersDevices(AtomicBaseModel):
         managed = True
 
 
+JOB_STATUS_CHOICES = (
+    ("queued", "queued"),
+    ("running", "running"),
+    ("completed", "completed"),
+    ("failed", "failed"),
+)
+
+
+EXPORT_FORMAT_CHOICES = (
+    ("tsv", "tsv"),
+    ("parquet", "parquet"),
+    ("arrow", "arrow"),
+)
+
+
 # Export data table
 class ExportData(AtomicBaseModel):
     userId = models.ForeignKey(Users, verbose_name=_('User Id'), related_name="export_data", db_column="user_id", on_delete=models.CASCADE,)
     modelName = models.CharField(verbose_name=_('Model Name'), max_length=500, db_column="model_name")
-    fileUrl = models.URLField(verbose_name=_('File Url'), max_length=512, db_column="file_url",)
+    appName = models.CharField(verbose_name=_('App Name'), max_length=500, db_column="app_name", default="")
+    fileUrl = models.URLField(verbose_name=_('File Url'), max_length=512, db_column="file_url", blank=True, default="")
+    status = models.CharField(verbose_name=_('Status'), max_length=20, db_column="status", choices=JOB_STATUS_CHOICES, default="queued")
+    format = models.CharField(verbose_name=_('Format'), max_length=20, db_column="format", choices=EXPORT_FORMAT_CHOICES, default="tsv")
+    columns = models.JSONField(verbose_name=_('Columns'), db_column="columns", default=list)
+    filters = models.JSONField(verbose_name=_('Filters'), db_column="filters", default=dict)
+    rows = models.BigIntegerField(verbose_name=_('Rows'), db_column="rows", default=0)
+    # resume point of the streaming export (atomicloops.exporters): multipart upload, uploaded parts and last exported pk
+    fileKey = models.CharField(verbose_name=_('File Key'), max_length=512, db_column="file_key", blank=True, default="")
+    uploadId = models.CharField(verbose_name=_('Upload Id'), max_length=1024, db_column="upload_id", blank=True, default="")
+    parts = models.JSONField(verbose_name=_('Parts'), db_column="parts", default=list)
+    lastKey = models.JSONField(verbose_name=_('Last Key'), db_column="last_key", null=True, blank=True, encoder=DjangoJSONEncoder)
+    # incremental exports cover (watermarkFrom, watermarkTo] of the model's export_watermark_field
+    incremental = models.BooleanField(verbose_name=_('Incremental'), db_column="incremental", default=False)
+    watermarkFrom = models.DateTimeField(verbose_name=_('Watermark From'), db_column="watermark_from", null=True, blank=True)
+    watermarkTo = models.DateTimeField(verbose_name=_('Watermark To'), db_column="watermark_to", null=True, blank=True)
 
     class Meta:
         db_table = "export_data"
         verbose_name_plural = "export_data"
         managed = True
+
+
+# Import data table (progress of AtomicViewSet import-data jobs)
+class ImportData(AtomicBaseModel):
+    userId = models.ForeignKey(Users, verbose_name=_('User Id'), related_name="import_data", db_column="user_id", on_delete=models.CASCADE,)
+    modelName = models.CharField(verbose_name=_('Model Name'), max_length=500, db_column="model_name")
+    fileName = models.CharField(verbose_name=_('File Name'), max_length=500, db_column="file_name")
+    status = models.CharField(verbose_name=_('Status'), max_length=20, db_column="status", choices=JOB_STATUS_CHOICES, default="queued")
+    totalRows = models.IntegerField(verbose_name=_('Total Rows'), db_column="total_rows", default=0)
+    importedRows = models.IntegerField(verbose_name=_('Imported Rows'), db_column="imported_rows", default=0)
+    failedRows = models.IntegerField(verbose_name=_('Failed Rows'), db_column="failed_rows", default=0)
+    errors = models.JSONField(verbose_name=_('Errors'), db_column="errors", default=list)
+
+    class Meta:
+        db_table = "import_data"
+        verbose_name_plural = "import_data"
+        managed = True
+
+    def update_progress(self, summary, status="running"):
+        # one UPDATE per chunk, without touching the other columns
+        self.status = status
+        for key in ('totalRows', 'importedRows', 'failedRows', 'errors'):
+            setattr(self, key, summary[key])
+        self.save(update_fields=['status', 'totalRows', 'importedRows', 'failedRows', 'errors', 'updatedAt'])
+
+    def finish(self, summary):
+        self.update_progress(summary, status="failed" if summary['failedRows'] and not summary['importedRows'] else "completed")
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from atomicloops.serializers import AtomicSerializer
-from .models import Users, UsersDevices, ExportData
+from .models import Users, UsersDevices, ExportData, ImportData
 from django.contrib.auth.password_validation import validate_password
 from django.utils.translation import gettext_lazy as _
 
@@ -158,10 +158,37 @@ class ExportDataSerializer(serializers.ModelSerializer):
             'updatedAt',
             'userId',
             'modelName',
+            'status',
+            'format',
+            'columns',
+            'filters',
+            'rows',
+            'incremental',
+            'watermarkFrom',
+            'watermarkTo',
             'fileUrl'
         )
 
 
+class ImportDataSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ImportData
+        fields = (
+            'id',
+            'createdAt',
+            'updatedAt',
+            'userId',
+            'modelName',
+            'fileName',
+            'status',
+            'totalRows',
+            'importedRows',
+            'failedRows',
+            'errors',
+        )
+
+
 class UploadProfilePictureSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from atomicloops.authentication import invalidate_cached_user
+from .models import Users
+
+
+# Authenticated user cache (atomicloops.authentication.UserCache)
+@receiver([post_save, post_delete], sender=Users)
+def user_changed(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
@@ -1,3 +1,36 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from users.models import Users
+from users.views.login import RefreshTokenView, RevocableRefreshToken
+
+
+class RefreshTokenViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Users.objects.create_user(email='user@example.com', password='x', level=1)
+
+    def refresh(self, token):
+        request = APIRequestFactory().post('/login/refresh/', {'refresh': str(token)}, format='json')
+        return RefreshTokenView.as_view()(request)
+
+    def test_token_is_checked_once(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        with mock.patch('atomicloops.tokens.blacklist_contains', return_value=None) as blacklist_contains:
+            response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(blacklist_contains.call_count, 1)
+        # rotated: the old token is blacklisted
+        self.assertEqual(self.refresh(token).status_code, 401)
 
-# Create your tests here.
+    def test_token_issued_before_the_watermark_is_refused(self):
+        token = RevocableRefreshToken.for_user(self.user)
+        Users.objects.filter(pk=self.user.pk).update(tokensValidAfter=timezone.now() + timedelta(seconds=1))
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'], 'Token has been revoked')
@@ -1,11 +1,10 @@
 # Imports
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenRefreshView
 from .views.users import UsersView, UsersDevicesView, RegisterUserView
 from .views.update_password import UpdatePasswordView
 from .views.login import LoginView
-from .views.login import AdminLoginView
+from .views.login import AdminLoginView, RefreshTokenView
 from .views.logout import LogoutView, LogoutAllView
 from .views.reset_password import (
     reset_password_validate_token,
@@ -30,7 +29,7 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='token-obtain-pair'),
     path('admin-login/', AdminLoginView.as_view(), name='token-obtain-pair-admin'),
     path('update-password/<uuid:pk>/', UpdatePasswordView.as_view(), name='auth_change_password'),
-    path('login/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('login/refresh/', RefreshTokenView.as_view(), name='token-refresh'),
     path('logout/', LogoutView.as_view(), name='logout'),
     path('logout-all/', LogoutAllView.as_view(), name='logout-all'),
     path('reset-password/validate-token/', reset_password_validate_token, name='reset-password-validate'),
@@ -1,5 +1,6 @@
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.views import Response
 from rest_framework.permissions import AllowAny
 from rest_framework import exceptions, status
@@ -7,6 +8,8 @@ from rest_framework import serializers
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils.translation import gettext_lazy as _
 from users.models import Users
+from atomicloops.authentication import is_token_revoked
+from atomicloops.tokens import AtomicRefreshToken
 
 
 # Custom Failure Class
@@ -148,20 +151,27 @@ class AdminLoginView(TokenObtainPairView):
             raise InvalidToken(e.args[0])
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
-# class RefreshTokenView(TokenRefreshView):
-#     # permission_classes = (AllowAny,)
-#     # authentication_classes = ()
-#     # serializer_class = TokenRefreshSerializer
-#     # renderer_classes = [AtomicJsonRenderer]
-
-#     # def post(self, request, *args, **kwargs):
-#     #     serializer = self.serializer_class(data=request.data)
-#     #     try:
-#     #         serializer.is_valid(raise_exception=True)
-#     #     except TokenError as e:
-#     #         raise InvalidToken(e.args[0])
-#     #     # obj =  User.objects.filter(email=request.data['email']).first()
-#     #     # serializer.validated_data['email'] = obj.email
-#     #     # serializer.validated_data['id'] = obj.id
-#     #     # serializer.validated_data['firstName'] = obj.firstName
-#     #     return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+class RevocableRefreshToken(AtomicRefreshToken):
+    """
+    Refresh token also refused when issued before the user's tokensValidAfter
+    watermark (logout from all devices). The check runs with the blacklist
+    check, once per token built.
+    """
+
+    def check_blacklist(self):
+        super().check_blacklist()
+        user = Users.objects.filter(
+            **{api_settings.USER_ID_FIELD: self.get(api_settings.USER_ID_CLAIM)}
+        ).only('tokensValidAfter').first()
+        if user is None or is_token_revoked(user, self):
+            raise InvalidToken("Token has been revoked")
+
+
+class RefreshTokenSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
+
+
+# Refresh Token View
+class RefreshTokenView(TokenRefreshView):
+    serializer_class = RefreshTokenSerializer
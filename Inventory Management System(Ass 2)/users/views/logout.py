@@ -1,11 +1,10 @@
 from rest_framework.views import Response
 from rest_framework import status
 from rest_framework.views import APIView
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from atomicloops.authentication import AtomicJWTAuthentication, revoke_user_tokens
 from atomicloops.renderers import AtomicJsonRenderer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from atomicloops.tokens import AtomicRefreshToken
 
 
 # Logout View
@@ -20,7 +19,7 @@ class LogoutView(APIView):
 
             # Black list token
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = AtomicRefreshToken(refresh_token)
             token.blacklist()
 
             return Response(status=status.HTTP_205_RESET_CONTENT)
@@ -32,12 +31,10 @@ class LogoutView(APIView):
 # Logout ALL View
 class LogoutAllView(APIView):
     permission_classes = [IsAuthenticated,]
-    authentication_classes = [JWTAuthentication,]
+    authentication_classes = [AtomicJWTAuthentication,]
     renderer_classes = [AtomicJsonRenderer]
 
     def post(self, request):
-        tokens = OutstandingToken.objects.filter(user_id=request.user.id)
-        for token in tokens:
-            t, _ = BlacklistedToken.objects.get_or_create(token=token)
+        revoke_user_tokens(request.user.id)
 
         return Response(status=status.HTTP_205_RESET_CONTENT)
@@ -6,10 +6,9 @@ from rest_framework.views import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework.serializers import ValidationError
-from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.decorators import action
+from django.db import transaction
 
 # app imports
 from users.models import Users, UsersDevices
@@ -24,6 +23,7 @@ from users.serializers import (
 from users.filters import UsersFilter, UsersDevicesFilter
 from atomicloops.viewsets import AtomicViewSet
 from atomicloops.permissions import UsersPermission
+from atomicloops.authentication import invalidate_cached_user, revoke_user_tokens
 from users.serializers import UpdateAdminStatusSerializer
 from utils.aws_script import upload_image
 from users.utils import send_otp
@@ -64,29 +64,27 @@ class UsersView(AtomicViewSet):
             serializer_class = UpdateAdminStatusSerializer
             if not request.user.is_superuser:
                 return Response("Unauthorized user", status=status.HTTP_403_FORBIDDEN)
-            if not isinstance(request.data, list):
-                raise ValidationError('Request body must be a list')
-            if request.data == []:
-                raise ValidationError('Empty data not permitted')
-            if len(request.data) > 100:
-                raise ValidationError('Number of list elements must not be greater than 100')
-            ids = self.validate_ids(request.data)
-            instances = Users.objects.filter(id__in=ids)
-            fields = [f.name for f in Users._meta.concrete_fields]
-            fields.remove('id')
-            _ = Users.objects.bulk_update(instances, fields)
+            self.validate_bulk_request(request.data)
+            fields = [name for name in serializer_class.Meta.fields if name != 'id']
+            with transaction.atomic():
+                instances = self.bulk_update_items(Users, request.data, fields=fields)
             serializer = serializer_class(instances, many=True, partial=True, context={'request': self.request, 'view': self})
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
+    def bulk_update_items(self, model, data, fields=None):
+        instances = super().bulk_update_items(model, data, fields=fields)
+        # bulk_update skips the post_save signal that clears the authentication cache
+        for instance in instances:
+            invalidate_cached_user(instance.pk)
+        return instances
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.is_active = False
         instance.save()
-        tokens = OutstandingToken.objects.filter(user_id=instance.id)
-        for token in tokens:
-            t, _ = BlacklistedToken.objects.get_or_create(token=token)
+        revoke_user_tokens(instance.id, blacklist=True)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['post'], url_path='upload-profile')
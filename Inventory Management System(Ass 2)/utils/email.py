@@ -1,45 +1,209 @@
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+import atexit
+import logging
+import os
+import queue
 import smtplib
+import socket
 import threading
+import time
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
 
-class SendEmailThread(threading.Thread):
-    def __init__(self, receiver, subject, message, cc=""):
-        self.email = settings.EMAIL
-        self.password = settings.PASSWORD
-        self.receiver = receiver
-        self.subject = subject
-        self.message = message
-        self.cc = cc
-        threading.Thread.__init__(self)
+DEFAULT_EMAIL_CONFIG = {
+    # HOST / PORT / USE_TLS default to Django's EMAIL_HOST / EMAIL_PORT / EMAIL_USE_TLS
+    'TIMEOUT': 30,
+    # delivery threads per process, each keeps its own SMTP session
+    'WORKERS': 2,
+    # messages waiting for a worker; above it mails are handed to the celery send_email task
+    'QUEUE_SIZE': 1000,
+    # messages a worker sends over one session before checking the queue again
+    'BATCH_SIZE': 50,
+    # an idle session is closed after this many seconds
+    'IDLE_TIMEOUT': 60,
+    # transient failures (disconnects, 4xx replies such as rate limits) are retried with exponential backoff
+    'MAX_RETRIES': 3,
+    'RETRY_BACKOFF': 2,
+    # seconds queued mails get to go out when the process exits
+    'SHUTDOWN_TIMEOUT': 10,
+}
 
-    def run(self):
+
+def get_email_config():
+    config = dict(DEFAULT_EMAIL_CONFIG, HOST=settings.EMAIL_HOST, PORT=settings.EMAIL_PORT, USE_TLS=settings.EMAIL_USE_TLS)
+    config.update(getattr(settings, 'ATOMIC_EMAIL', {}))
+    return config
+
+
+def build_message(receiver, subject, message, cc=''):
+    # returns (recipients, MIME document)
+    body = MIMEMultipart("alternative")
+    body["Subject"] = subject
+    body["From"] = settings.EMAIL
+    body["To"] = receiver   # send to single email
+    body.attach(MIMEText(message, 'html'))
+    if cc != "":
+        body['Cc'] = cc
+        rcpt = [receiver] + cc.split(',')
+    else:
+        rcpt = [receiver]
+    return rcpt, body.as_string()
+
+
+def is_transient(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    # SMTPException is an OSError, only dropped connections and timeouts are retried beyond the replies above
+    return isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout))
+
+
+class SMTPConnection:
+    """
+    Persistent SMTP session: connected, STARTTLS'd and logged in on first use,
+    reused for every following message and reopened after a disconnect.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_email_config()
+        self.server = None
+        self.last_used = 0
+
+    def open(self):
+        server = smtplib.SMTP(self.config['HOST'], self.config['PORT'], timeout=self.config['TIMEOUT'])
         try:
-            # stmp setup to send email
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.set_debuglevel(0)  # 0 for no debugging
             server.ehlo()  # say hello to the server
-            server.starttls()  # start TLS encryption
-            server.login(self.email, self.password)
-
-            # Email Configuration
-            body = MIMEMultipart("alternative")
-            body["Subject"] = self.subject
-            body["From"] = self.email
-            body["To"] = self.receiver   # send to single email
-            body.attach(MIMEText(self.message, 'html'))
-            if self.cc != "":
-                body['Cc'] = self.cc
-                rcpt = [self.receiver] + self.cc.split(',')
-            else:
-                rcpt = [self.receiver]
-            server.sendmail(self.email, rcpt, body.as_string())
-            return True
-        except:
-            return False
+            if self.config['USE_TLS']:
+                server.starttls()  # start TLS encryption
+                server.ehlo()
+            if settings.PASSWORD:
+                server.login(settings.EMAIL, settings.PASSWORD)
+        except (smtplib.SMTPException, OSError):
+            server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, receiver, subject, message, cc=''):
+        if self.server is not None and time.monotonic() - self.last_used > self.config['IDLE_TIMEOUT']:
+            # the server has most likely dropped the session already
+            self.close()
+        if self.server is None:
+            self.open()
+        rcpt, body = build_message(receiver, subject, message, cc)
+        try:
+            self.server.sendmail(settings.EMAIL, rcpt, body)
+        except smtplib.SMTPRecipientsRefused:
+            raise
+        except (smtplib.SMTPException, OSError):
+            self.close()
+            raise
+        self.last_used = time.monotonic()
+
+    def send_with_retries(self, receiver, subject, message, cc=''):
+        attempt = 0
+        while True:
+            try:
+                self.send(receiver, subject, message, cc)
+                return True
+            except (smtplib.SMTPException, OSError) as e:
+                if attempt >= self.config['MAX_RETRIES'] or not is_transient(e):
+                    logger.error("email to %s failed: %s", receiver, e)
+                    return False
+                time.sleep(self.config['RETRY_BACKOFF'] * 2 ** attempt)
+                attempt += 1
+
+
+class EmailDispatcher:
+    """
+    Bounded in-process mail queue. Requests only enqueue; a small pool of
+    daemon threads delivers the mails in batches, each over one persistent
+    SMTP session. When the queue is full the mail goes to the celery
+    send_email task instead of blocking the request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.workers = []
+        self.pid = None
+        self.config = None
+
+    def ensure_workers(self):
+        # one pool per process, restarted after a fork (gunicorn --preload)
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.config = get_email_config()
+            self.queue = queue.Queue(maxsize=self.config['QUEUE_SIZE'])
+            self.workers = [
+                threading.Thread(target=self.run, name=f'atomic-email-{index}', daemon=True)
+                for index in range(self.config['WORKERS'])
+            ]
+            for worker in self.workers:
+                worker.start()
+            self.pid = os.getpid()
+            atexit.register(self.drain)
+
+    def enqueue(self, receiver, subject, message, cc=''):
+        self.ensure_workers()
+        try:
+            self.queue.put_nowait((receiver, subject, message, cc))
+        except queue.Full:
+            from atomicloops.tasks import send_email as send_email_task
+            try:
+                send_email_task.delay(receiver, subject, message, cc)
+            except Exception as e:
+                logger.error("email to %s dropped, queue full and broker unavailable: %s", receiver, e)
+
+    def next_batch(self):
+        # blocks for the first mail, then takes whatever else is already waiting
+        batch = [self.queue.get(timeout=self.config['IDLE_TIMEOUT'])]
+        while len(batch) < self.config['BATCH_SIZE']:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        connection = SMTPConnection(self.config)
+        while True:
+            try:
+                batch = self.next_batch()
+            except queue.Empty:
+                connection.close()
+                continue
+            for mail in batch:
+                try:
+                    connection.send_with_retries(*mail)
+                except Exception as e:
+                    logger.error("email to %s failed: %s", mail[0], e)
+                finally:
+                    self.queue.task_done()
+
+    def drain(self):
+        # wait (bounded) for the queued mails at interpreter exit
+        deadline = time.monotonic() + self.config['SHUTDOWN_TIMEOUT']
+        while self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+dispatcher = EmailDispatcher()
 
 
 def send_email(receiver, subject, message, cc='', *args, **kwargs):
-    SendEmailThread(receiver=receiver, subject=subject, message=message, cc=cc).start()
+    dispatcher.enqueue(receiver=receiver, subject=subject, message=message, cc=cc)
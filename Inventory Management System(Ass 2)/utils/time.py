@@ -1,8 +1,63 @@
+from datetime import timezone as fixed_timezone
+from functools import lru_cache
 import pytz
 
+TIME_FORMAT = "%d-%m-%YT%H:%M:%S%z %Z"
 
-def convert_time(time, timezone):
+
+@lru_cache(maxsize=256)
+def get_timezone(name):
+    # pytz timezone for an X-Timezone-Region value, None when missing or unknown
+    if not name:
+        return None
     try:
-        return time.astimezone(pytz.timezone(timezone)).strftime("%d-%m-%YT%H:%M:%S%z %Z")
-    except:
-        return time.strftime("%d-%m-%YT%H:%M:%S%z %Z")
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        return None
+
+
+def format_offset(offset):
+    # timedelta as strftime's %z
+    if offset is None:
+        return ''
+    sign = '-' if offset.days < 0 else '+'
+    seconds = abs(offset.days * 86400 + offset.seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%s%02d%02d%s' % (sign, hours, minutes, '%02d' % seconds if seconds else '')
+
+
+# "%z %Z" per tzinfo, for the tzinfos whose offset does not depend on the date: pytz's
+# (a converted datetime carries the tzinfo of its own period) and datetime.timezone
+_zone_suffixes = {}
+
+
+def zone_suffix(time):
+    tzinfo = time.tzinfo
+    suffix = _zone_suffixes.get(tzinfo)
+    if suffix is not None:
+        return suffix
+    offset = time.utcoffset()
+    if offset is not None and offset.microseconds:
+        return None
+    suffix = '{} {}'.format(format_offset(offset), time.tzname() or '')
+    if isinstance(tzinfo, (pytz.tzinfo.BaseTzInfo, fixed_timezone)):
+        _zone_suffixes[tzinfo] = suffix
+    return suffix
+
+
+def format_time(time, tz=None):
+    """
+    `time` converted to `tz` (when given) and formatted as TIME_FORMAT,
+    without going through strftime.
+    """
+    if tz is not None:
+        time = time.astimezone(tz)
+    suffix = zone_suffix(time)
+    if suffix is None or time.year < 1000:
+        return time.strftime(TIME_FORMAT)
+    return '%02d-%02d-%04dT%02d:%02d:%02d%s' % (time.day, time.month, time.year, time.hour, time.minute, time.second, suffix)
+
+
+def convert_time(time, timezone):
+    return format_time(time, get_timezone(timezone))